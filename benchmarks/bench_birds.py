@@ -0,0 +1,95 @@
+"""Compare top-species query latency before and after the bird species store.
+
+Builds one database of random bird sightings at schema version 5 (text names
+in bird_observations), times the old GROUP BY query over several windows,
+then migrates it and times station.birds.top_species over the same windows,
+checking both return the same ranking.
+
+    python -m benchmarks.bench_birds --days 30 --sightings 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from station import birds, migrations
+
+OLD_QUERY = (
+    "select common_name, sum(confidence) from bird_observations"
+    " where ts >= ? and ts < ? and confidence > 0.1 group by 1 order by 2 desc"
+)
+
+WINDOWS = {"1m": 60, "1h": 3600, "1d": 86400, "7d": 7 * 86400}
+
+
+def build(db_path, days, sightings, species):
+    migrations.migrate(
+        db_path, [m for m in migrations.SERVER_MIGRATIONS if m.version <= 5]
+    )
+    connection = sqlite3.connect(db_path)
+    end = int(time.time())
+    names = [(f"Species {i}", f"Bird {i}") for i in range(species)]
+    rows = []
+    for i in range(sightings):
+        scientific_name, common_name = random.choice(names)
+        ts = end - random.randint(0, int(days * 86400))
+        rows.append((f"s{i}", ts, scientific_name, common_name, random.random()))
+    connection.executemany("INSERT INTO bird_observations VALUES(?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    return end
+
+
+def time_windows(query, end, repeat):
+    results = {}
+    for name, window in WINDOWS.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = query(end - window - 0.5, end)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = (statistics.median(samples), [row[0] for row in rows])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--sightings", type=int, default=200000)
+    parser.add_argument("--species", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "birds.db")
+        end = build(db_path, args.days, args.sightings, args.species)
+
+        connection = sqlite3.connect(db_path)
+        before = time_windows(
+            lambda start, end: connection.execute(OLD_QUERY, (start, end)).fetchall(),
+            end,
+            args.repeat,
+        )
+        connection.close()
+
+        migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+        connection = sqlite3.connect(db_path)
+        after = time_windows(
+            lambda start, end: birds.top_species(connection, start, end),
+            end,
+            args.repeat,
+        )
+        connection.close()
+
+    print(f"{'window':<8}{'group by ms':>12}{'counters ms':>13}  same ranking")
+    for name in WINDOWS:
+        print(
+            f"{name:<8}{before[name][0]:>12.3f}{after[name][0]:>13.3f}  {before[name][1] == after[name][1]}"
+        )
+
+
+if __name__ == "__main__":
+    main()
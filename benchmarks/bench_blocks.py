@@ -0,0 +1,158 @@
+"""Compare SQLite rows with compressed reading blocks: size and range scans.
+
+Loads the same synthetic minute readings into the server schema twice, once
+left as rows and once compacted into station.blocks' daily blocks, checks
+that a scan of the blocks returns exactly the rows, then reports bytes per
+reading (table and indexes, from dbstat) and the time to read day, week and
+month ranges into NumPy arrays. Timestamps get a few ms of scheduling jitter,
+as the logger's do.
+
+    python -m benchmarks.bench_blocks --days 90
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import synthetic
+from station import blocks, migrations
+
+WINDOWS = {"day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+START = 1704067200  # 2024-01-01
+
+
+def load(db_path: str, days: float, jitter: float, seed: int):
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    rng = random.Random(seed)
+    end = START + days * 86400
+    connection = sqlite3.connect(db_path)
+    with connection:
+        for table, rows in (
+            ("thp_readings", synthetic.weather_readings(START, end)),
+            ("air_quality_readings", synthetic.air_readings(START, end)),
+        ):
+            connection.executemany(
+                f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?)",
+                (
+                    (row[0], row[1] + round(rng.uniform(0, jitter), 6)) + row[2:]
+                    for row in rows
+                ),
+            )
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def sizes(db_path: str) -> dict:
+    connection = sqlite3.connect(db_path)
+    try:
+        return dict(connection.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name"))
+    finally:
+        connection.close()
+
+
+def row_scan(connection, table: str, fields, start: float, end: float) -> dict:
+    rows = connection.execute(
+        f"SELECT ts, {', '.join(fields)} FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts",
+        (start, end),
+    ).fetchall()
+    columns = list(zip(*rows))
+    return {
+        name: np.array(values, np.float64) for name, values in zip(("ts",) + fields, columns)
+    }
+
+
+def timed(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def run(days: float, jitter: float, repeat: int, seed: int) -> dict:
+    results = {"days": days, "jitter": jitter}
+    with tempfile.TemporaryDirectory() as tmp:
+        rows_db = os.path.join(tmp, "rows.db")
+        blocks_db = os.path.join(tmp, "blocks.db")
+        load(rows_db, days, jitter, seed)
+        shutil.copy(rows_db, blocks_db)
+        connection = sqlite3.connect(blocks_db, isolation_level=None)
+        started = time.perf_counter()
+        packed = sum(
+            blocks.compact(connection, table, fields, START + days * 86400)
+            for table, fields in migrations.READING_TABLES.items()
+        )
+        results["compact_readings_per_second"] = packed / (time.perf_counter() - started)
+        connection.execute("VACUUM")
+        connection.close()
+
+        row_sizes, block_sizes = sizes(rows_db), sizes(blocks_db)
+        results["file_bytes"] = {
+            "rows": os.path.getsize(rows_db),
+            "blocks": os.path.getsize(blocks_db),
+        }
+        rows_connection = sqlite3.connect(rows_db)
+        blocks_connection = sqlite3.connect(blocks_db)
+        rng = random.Random(seed)
+        for table, fields in migrations.READING_TABLES.items():
+            count = rows_connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            row_bytes = row_sizes[table] + row_sizes[f"{table}_id"]
+            block_bytes = block_sizes[blocks.block_table(table)]
+            scans = {}
+            for name, window in WINDOWS.items():
+                if window > days * 86400:
+                    continue
+                start = START + rng.uniform(0, days * 86400 - window)
+                expected = row_scan(rows_connection, table, fields, start, start + window)
+                actual = blocks.scan(blocks_connection, table, fields, start, start + window)
+                for column, values in expected.items():
+                    if not np.array_equal(values, actual[column], equal_nan=True):
+                        raise AssertionError(f"{table}.{column} differs over the {name} scan")
+                row_seconds = timed(
+                    lambda: row_scan(rows_connection, table, fields, start, start + window),
+                    repeat,
+                )
+                block_seconds = timed(
+                    lambda: blocks.scan(blocks_connection, table, fields, start, start + window),
+                    repeat,
+                )
+                readings = len(expected["ts"])
+                scans[name] = {
+                    "readings": readings,
+                    "rows_ms": row_seconds * 1000,
+                    "blocks_ms": block_seconds * 1000,
+                    "rows_readings_per_second": readings / row_seconds,
+                    "blocks_readings_per_second": readings / block_seconds,
+                }
+            results[table] = {
+                "readings": count,
+                "rows_bytes_per_reading": row_bytes / count,
+                "blocks_bytes_per_reading": block_bytes / count,
+                "compression": row_bytes / block_bytes,
+                "scans": scans,
+            }
+        rows_connection.close()
+        blocks_connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=float, default=90)
+    parser.add_argument("--jitter", type=float, default=0.005, help="timestamp jitter (s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(run(args.days, args.jitter, args.repeat, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
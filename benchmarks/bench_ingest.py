@@ -0,0 +1,91 @@
+"""Compare per-row and batched ingest throughput of weather-server.
+
+Posts the same synthetic readings once through /weather/latest (one request
+and one transaction per row) and once through /weather/batch, against a
+throwaway database, using Flask's test client so only server work is timed.
+
+    python -m benchmarks.bench_ingest --rows 2000 --batch-size 500
+"""
+import argparse
+import glob
+import importlib
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from station.cache import ring_path
+
+
+def readings(count, start):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "ts": start + i,
+            "temperature": 20.0 + (i % 50) / 10,
+            "humidity": 55.0,
+            "pressure": 1012.0,
+        }
+        for i in range(count)
+    ]
+
+
+def load_server(db_path):
+    os.environ["WEATHER_SERVER_DB"] = db_path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    return importlib.import_module("weather-server")
+
+
+def remove_shared_files(db_path):
+    """Delete the /dev/shm caches and locks a server left for db_path."""
+    for path in glob.glob(ring_path(db_path, "*", "*")):
+        os.unlink(path)
+
+
+def run(rows, batch_size):
+    """Rows per second through /weather/latest and through /weather/batch."""
+    with tempfile.TemporaryDirectory() as tmp:
+        server = load_server(os.path.join(tmp, "bench.db"))
+        client = server.app.test_client()
+        start = time.time() - 2 * rows
+
+        data = readings(rows, start)
+        started = time.perf_counter()
+        for row in data:
+            client.post("/weather/latest", json=row)
+        per_row = time.perf_counter() - started
+
+        data = readings(rows, start + rows)
+        started = time.perf_counter()
+        for i in range(0, len(data), batch_size):
+            client.post("/weather/batch", json=data[i : i + batch_size])
+        batched = time.perf_counter() - started
+
+        for ring in server.reading_cache.values():
+            ring.close()
+        remove_shared_files(server.PRIMARY_DB)
+
+    return {
+        "rows": rows,
+        "batch_size": batch_size,
+        "per_row_rows_per_second": rows / per_row,
+        "batched_rows_per_second": rows / batched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    result = run(args.rows, args.batch_size)
+    print(f"per-row: {result['per_row_rows_per_second']:10.0f} rows/s")
+    print(
+        f"batched: {result['batched_rows_per_second']:10.0f} rows/s (batches of {args.batch_size})"
+    )
+
+
+if __name__ == "__main__":
+    main()
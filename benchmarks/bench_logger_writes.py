@@ -0,0 +1,139 @@
+"""Compare the logger's old per-reading writes with the buffered writer.
+
+Simulates hours of weather and air readings at the emit interval, written
+either one connection and commit per reading (as write_logger_data did) or
+through BufferedWriter flushed every WRITE_FLUSH_INTERVAL. Reports commits,
+WAL frames and fsyncs per hour. SQLite syncs the WAL on every commit with
+synchronous=FULL (the sqlite3 default) and only at checkpoints with NORMAL;
+a checkpoint (every 1000 frames by default) syncs the WAL and the database,
+so fsyncs = commits * (1 if FULL else 0) + 2 * frames / 1000.
+
+    python -m benchmarks.bench_logger_writes --hours 24 --emit-interval 60
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks import synthetic
+from station import migrations
+from station.writer import BufferedWriter
+
+CHECKPOINT_FRAMES = 1000
+
+
+def readings(hours: float, emit_interval: float):
+    """(table, columns, row) for weather and air readings, in time order."""
+    end = hours * 3600
+    weather = synthetic.weather_readings(0, end, emit_interval)
+    air = synthetic.air_readings(0, end, emit_interval)
+    for table, rows in (("thp_readings", weather), ("air_quality_readings", air)):
+        fields = migrations.READING_TABLES[table]
+        columns = ("id", "ts") + fields + migrations.sample_stat_columns(fields)
+        padding = (None,) * (len(columns) - 2 - len(fields))
+        for row in rows:
+            yield row[1], table, columns, row + padding
+
+
+def wal_frames(db_path: str) -> int:
+    connection = sqlite3.connect(db_path)
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    connection.close()
+    size = os.path.getsize(f"{db_path}-wal")
+    return max(0, (size - 32) // (page_size + 24))
+
+
+def prepare(db_path: str):
+    migrations.migrate(db_path, migrations.LOGGER_MIGRATIONS)
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.close()
+
+
+def per_reading(db_path: str, rows) -> dict:
+    commits = 0
+    started = time.perf_counter()
+    for _, table, columns, row in rows:
+        connection = sqlite3.connect(db_path)
+        # Checkpoints are counted from the frames instead
+        connection.execute("PRAGMA wal_autocheckpoint=0")
+        connection.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            row,
+        )
+        connection.commit()
+        connection.close()
+        commits += 1
+    return {"seconds": time.perf_counter() - started, "commits": commits, "syncs_per_commit": 1}
+
+
+def buffered(db_path: str, rows, flush_interval: float, flush_rows: int) -> dict:
+    writer = BufferedWriter(db_path, flush_rows=flush_rows)
+    writer._connection.execute("PRAGMA wal_autocheckpoint=0")
+    started = time.perf_counter()
+    next_flush = flush_interval
+    for ts, table, columns, row in sorted(rows, key=lambda r: r[0]):
+        if ts >= next_flush:
+            writer.flush()
+            next_flush += flush_interval
+        if writer.add(table, columns, row):
+            writer.flush()
+    writer.close()
+    return {
+        "seconds": time.perf_counter() - started,
+        "commits": writer.stats["flushes"],
+        "syncs_per_commit": 0,
+    }
+
+
+def run(hours: float, emit_interval: float, flush_interval: float, flush_rows: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("per_reading", "buffered"):
+            db_path = os.path.join(tmp, f"{name}.db")
+            prepare(db_path)
+            rows = list(readings(hours, emit_interval))
+            # Stands in for the outbox's connection, which stays open in the
+            # logger, so closing the writing connection doesn't checkpoint
+            holder = sqlite3.connect(db_path)
+            holder.execute("SELECT 1 FROM outbox LIMIT 1").fetchall()
+            if name == "per_reading":
+                result = per_reading(db_path, rows)
+            else:
+                result = buffered(db_path, rows, flush_interval, flush_rows)
+            frames = wal_frames(db_path)
+            holder.close()
+            fsyncs = result.pop("syncs_per_commit") * result["commits"] + 2 * frames / CHECKPOINT_FRAMES
+            results[name] = {
+                **result,
+                "rows": len(rows),
+                "wal_frames": frames,
+                "commits_per_hour": result["commits"] / hours,
+                "fsyncs_per_hour": fsyncs / hours,
+            }
+    return {
+        "hours": hours,
+        "emit_interval": emit_interval,
+        "flush_interval": flush_interval,
+        **results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--emit-interval", type=float, default=60)
+    parser.add_argument("--flush-interval", type=float, default=300)
+    parser.add_argument("--flush-rows", type=int, default=500)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            run(args.hours, args.emit_interval, args.flush_interval, args.flush_rows), indent=2
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
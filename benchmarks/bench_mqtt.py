@@ -0,0 +1,109 @@
+"""Compare waiting for each MQTT ack with pipelined QoS 1 publishing, and
+check the publisher's will and reconnect against the fake broker.
+
+    python -m benchmarks.bench_mqtt --messages 500 --ack-delay 0.02
+"""
+import argparse
+import json
+import statistics
+import time
+
+import paho.mqtt.client as mqtt
+
+from benchmarks.fake_broker import FakeBroker
+from station.mqtt import MQTTPublisher
+
+TOPIC = "benchmark/state"
+AVAILABILITY = "benchmark/availability"
+
+
+def wait_for(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("Timed out")
+        time.sleep(0.01)
+
+
+def blocking(port: int, messages: int) -> float:
+    """Messages/s publishing one at a time and waiting for each ack."""
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "benchmark-blocking")
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    wait_for(client.is_connected)
+    started = time.perf_counter()
+    for i in range(messages):
+        client.publish(TOPIC, json.dumps({"i": i}), qos=1).wait_for_publish(timeout=10)
+    elapsed = time.perf_counter() - started
+    client.disconnect()
+    client.loop_stop()
+    return messages / elapsed
+
+
+def run(messages: int, ack_delay: float, max_inflight: int = 20) -> dict:
+    broker = FakeBroker(ack_delay=ack_delay).start()
+    latencies = []
+    connects = []
+    publisher = MQTTPublisher(
+        "127.0.0.1",
+        broker.port,
+        "benchmark-pipelined",
+        AVAILABILITY,
+        on_connect=connects.append,
+        on_ack=latencies.append,
+        max_inflight=max_inflight,
+    )
+    publisher.start()
+    try:
+        wait_for(lambda: connects)
+        blocking_rate = blocking(broker.port, messages)
+
+        peak_pending = 0
+        started = time.perf_counter()
+        infos = []
+        for i in range(messages):
+            infos.append(publisher.publish(TOPIC, json.dumps({"i": i})))
+            peak_pending = max(peak_pending, publisher.pending)
+        publish_seconds = time.perf_counter() - started
+        for info in infos:
+            info.wait_for_publish(timeout=30)
+        pipelined_rate = messages / (time.perf_counter() - started)
+
+        # An outage: the broker publishes the will, and the publisher
+        # reconnects and announces itself again
+        broker.drop_connections()
+        wait_for(lambda: broker.retained.get(AVAILABILITY) == b"offline")
+        wait_for(lambda: len(connects) == 2)
+        wait_for(lambda: broker.retained.get(AVAILABILITY) == b"online")
+    finally:
+        publisher.stop()
+        broker.stop()
+    latencies.sort()
+    return {
+        "messages": messages,
+        "ack_delay": ack_delay,
+        "max_inflight": max_inflight,
+        "blocking_messages_per_second": blocking_rate,
+        "pipelined_messages_per_second": pipelined_rate,
+        "pipelined_publish_call_us": publish_seconds / messages * 1e6,
+        "peak_pending": peak_pending,
+        "ack_latency_ms": {
+            "p50": statistics.median(latencies) * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+        },
+        "will_published_on_drop": True,
+        "reconnected": True,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--ack-delay", type=float, default=0.02, help="simulated broker round trip (s)")
+    parser.add_argument("--max-inflight", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.messages, args.ack_delay, args.max_inflight), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare latest/recent query latency on the unversioned and migrated schemas.
+
+Builds two databases holding the same multi-year run of minute readings, one
+left at the original layout (schema version 1) and one fully migrated, then
+times the queries weather-server runs on every request.
+
+    python -m benchmarks.bench_schema --years 3
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+
+from station import migrations
+
+QUERIES = {
+    "latest_weather": (
+        "select temperature, humidity, pressure, ts from thp_readings where ts > ? order by ts desc limit 1"
+    ),
+    "recent_weather": (
+        "select avg(temperature), avg(humidity), avg(pressure), count(id), max(ts) from thp_readings where ts > ?"
+    ),
+    "recent_birds": (
+        "select common_name, sum(confidence) from bird_observations where ts > ? and confidence > 0.1 group by 1 order by 2 desc"
+    ),
+    "latest_birds": (
+        "select common_name, confidence from bird_observations where ts = (select max(ts) from bird_observations) order by 2 desc"
+    ),
+}
+
+SPECIES = ["Blackbird", "Magpie", "Wren", "Robin", "Kookaburra", "Currawong"]
+
+
+def build(db_path, years, version):
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS[:1])
+    connection = sqlite3.connect(db_path)
+    end = time.time()
+    start = end - years * 365 * 86400
+    rows = (
+        (str(uuid.uuid4()), ts, 20 + random.random(), 50.0, 1010.0)
+        for ts in range(int(start), int(end), 60)
+    )
+    connection.executemany("INSERT INTO thp_readings VALUES(?, ?, ?, ?, ?)", rows)
+    birds = (
+        (str(uuid.uuid4()), ts, "", random.choice(SPECIES), random.random())
+        for ts in range(int(start), int(end), 600)
+    )
+    connection.executemany("INSERT INTO bird_observations VALUES(?, ?, ?, ?, ?)", birds)
+    connection.commit()
+    connection.close()
+    migrations.migrate(
+        db_path, [m for m in migrations.SERVER_MIGRATIONS if m.version <= version]
+    )
+
+
+def time_queries(db_path, repeat):
+    connection = sqlite3.connect(db_path)
+    results = {}
+    for name, query in QUERIES.items():
+        params = () if "?" not in query else (time.time() - 300,)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(query, params).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(samples)
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    latest_version = migrations.SERVER_MIGRATIONS[-1].version
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, version in (("unversioned", 1), ("migrated", latest_version)):
+            db_path = os.path.join(tmp, f"{label}.db")
+            build(db_path, args.years, version)
+            results[label] = time_queries(db_path, args.repeat)
+
+    print(f"{'query':<16}{'unversioned ms':>16}{'migrated ms':>14}")
+    for name in QUERIES:
+        print(
+            f"{name:<16}{results['unversioned'][name]:>16.3f}{results['migrated'][name]:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
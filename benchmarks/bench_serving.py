@@ -0,0 +1,112 @@
+"""Load-test a running weather-server with concurrent pollers and idle streams.
+
+Start the server under the deployment you want to measure, e.g.
+
+    gunicorn --workers 2 --worker-class gthread --threads 16 --bind 127.0.0.1:8000 weather-server:app
+    uvicorn weather-server:asgi_app --workers 2 --port 8000
+
+then run the same load against each:
+
+    python -m benchmarks.bench_serving --url http://127.0.0.1:8000/weather/recent \\
+        --concurrency 32 --requests 4000 --streams 50
+
+Idle /stream clients are opened first and held for the whole run, which is
+where thread-per-connection and event-loop servers differ most.
+"""
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def open_stream(host, port):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    connection.request("GET", "/stream")
+    response = connection.getresponse()
+    response.read1(64)
+    return connection
+
+
+def poll(host, port, path, count, latencies, errors):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+    connection.close()
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+def run(url, concurrency, requests, streams):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+
+    idle = []
+    for _ in range(streams):
+        try:
+            idle.append(open_stream(host, port))
+        except (OSError, http.client.HTTPException):
+            break
+
+    latencies, errors = [], []
+    per_thread = requests // concurrency
+    threads = [
+        threading.Thread(target=poll, args=(host, port, path, per_thread, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for connection in idle:
+        connection.close()
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "idle_streams": len(idle),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / elapsed if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+        }
+        if latencies
+        else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/weather/recent")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--streams", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.url, args.concurrency, args.requests, args.streams), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""A minimal MQTT 3.1.1 broker stand-in for benchmarks, run in a thread.
+
+It accepts connections, acknowledges QoS 1 publishes after `ack_delay`
+seconds (to mimic a broker across a Wi-Fi link), answers pings and records
+what it receives, including the last will of any client that drops without
+a DISCONNECT. It does not route messages to subscribers.
+
+    python -m benchmarks.fake_broker --port 1883 --ack-delay 0.02
+"""
+import argparse
+import asyncio
+import struct
+import threading
+import time
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def _string(data: bytes, offset: int):
+    (length,) = struct.unpack_from("!H", data, offset)
+    return data[offset + 2 : offset + 2 + length], offset + 2 + length
+
+
+class FakeBroker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ack_delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.ack_delay = ack_delay
+        # (received at, topic, payload, qos, retain)
+        self.messages = []
+        self.retained = {}
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._started = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="fake-broker", daemon=True).start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def drop_connections(self):
+        """Close every client socket abruptly, as a network outage would."""
+
+        def drop():
+            for writer in list(self._writers):
+                writer.transport.abort()
+
+        self._loop.call_soon_threadsafe(drop)
+
+    def _record(self, topic: bytes, payload: bytes, qos: int, retain: bool):
+        self.messages.append((time.time(), topic.decode(), payload, qos, retain))
+        if retain:
+            self.retained[topic.decode()] = payload
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header[0] >> 4, header[0] & 0x0F, await reader.readexactly(length)
+
+    async def _ack(self, writer, packet_id: int):
+        if self.ack_delay:
+            await asyncio.sleep(self.ack_delay)
+        if not writer.is_closing():
+            writer.write(struct.pack("!BBH", PUBACK << 4, 2, packet_id))
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        will = None
+        pending = set()
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == CONNECT:
+                    self.connections += 1
+                    _, offset = _string(body, 0)
+                    connect_flags = body[offset + 1]
+                    _, offset = _string(body, offset + 4)
+                    if connect_flags & 0x04:
+                        topic, offset = _string(body, offset)
+                        payload, offset = _string(body, offset)
+                        will = (topic, payload, (connect_flags >> 3) & 3, bool(connect_flags & 0x20))
+                    writer.write(bytes((CONNACK << 4, 2, 0, 0)))
+                elif kind == PUBLISH:
+                    qos = (flags >> 1) & 3
+                    topic, offset = _string(body, 0)
+                    if qos:
+                        (packet_id,) = struct.unpack_from("!H", body, offset)
+                        offset += 2
+                    self._record(topic, body[offset:], qos, bool(flags & 1))
+                    if qos:
+                        task = asyncio.ensure_future(self._ack(writer, packet_id))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                elif kind == PINGREQ:
+                    writer.write(bytes((PINGRESP << 4, 0)))
+                elif kind == DISCONNECT:
+                    will = None
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            if will is not None:
+                self._record(*will)
+            self._writers.discard(writer)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--ack-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    broker = FakeBroker(args.host, args.port, args.ack_delay).start()
+    print(f"Fake MQTT broker on {args.host}:{broker.port}, acks after {args.ack_delay}s")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
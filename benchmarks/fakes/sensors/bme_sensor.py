@@ -0,0 +1,19 @@
+"""Stand-in for sensors.bme_sensor when benchmarking without the hardware.
+
+Put benchmarks/fakes first on sys.path to use it. BENCH_BME_LATENCY sets how
+long a read blocks, like a forced-mode BME280 conversion over I2C.
+"""
+import math
+import os
+import random
+import time
+
+latency = float(os.environ.get("BENCH_BME_LATENCY", "0.01"))
+
+
+def read_all():
+    time.sleep(latency)
+    day = 2 * math.pi * (time.time() % 86400) / 86400
+    temperature = 15 - 5 * math.cos(day) + random.gauss(0, 0.3)
+    humidity = 65 + 20 * math.cos(day) + random.gauss(0, 2)
+    return temperature, humidity, 1013.0 + random.gauss(0, 0.2)
@@ -0,0 +1,23 @@
+"""Stand-in for sensors.pms_sensor when benchmarking without the hardware.
+
+Put benchmarks/fakes first on sys.path to use it. BENCH_PMS_LATENCY sets how
+long a read blocks waiting for the next frame from the serial port.
+"""
+import os
+import random
+import time
+
+latency = float(os.environ.get("BENCH_PMS_LATENCY", "0.2"))
+
+
+class Reading:
+    def __init__(self, pm2_5: float):
+        self.values = {1.0: pm2_5 * 0.7, 2.5: pm2_5, 10: pm2_5 * 1.6}
+
+    def pm_ug_per_m3(self, size):
+        return self.values[size]
+
+
+def read_all():
+    time.sleep(latency)
+    return Reading(max(0.0, random.gauss(6, 1.5)))
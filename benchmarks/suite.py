@@ -0,0 +1,299 @@
+"""Run the benchmark scenarios and write the results as JSON.
+
+Scenarios:
+  ingest   rows/s through the per-reading and batch endpoints (in-process)
+  growth   database size per day of synthetic readings, rollups and birds
+  serving  latency percentiles of each endpoint under concurrent polling,
+           against gunicorn serving the synthetic database
+  logger   the logger pipeline with fake sensors at accelerated intervals,
+           delivering to that server
+
+    python -m benchmarks.suite --days 365 --output results.json
+    python -m benchmarks.suite --scenarios ingest,serving --compare results.json
+
+The synthetic data is seeded, so results from different commits on the same
+machine are comparable; --compare prints the change in every number.
+"""
+import argparse
+import asyncio
+import datetime
+import http.client
+import json
+import os
+import platform
+import runpy
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import bench_ingest, bench_serving, synthetic
+from benchmarks.fake_broker import FakeBroker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+FAKES = os.path.join(ROOT, "benchmarks", "fakes")
+SCENARIOS = ("ingest", "growth", "serving", "logger")
+
+ENDPOINTS = (
+    "/weather/latest",
+    "/weather/recent",
+    "/weather/recent?window=86400",
+    "/weather/history",
+    "/air/recent",
+    "/birds/recent",
+    "/birds/top?window=604800",
+    "/",
+)
+
+# Logger intervals, scaled down so a short run covers many emits
+LOGGER_INTERVALS = {
+    "BME_INTERVAL": 0.25,
+    "PMS_INTERVAL": 0.5,
+    "EMIT_INTERVAL": 2,
+    "WRITE_FLUSH_INTERVAL": 4,
+}
+
+
+def metadata(args) -> dict:
+    def git(*command):
+        try:
+            return subprocess.run(
+                ["git", *command], cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def table_sizes(db_path: str) -> dict:
+    """Bytes per table and index, if SQLite was built with dbstat."""
+    connection = sqlite3.connect(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        connection.close()
+    return dict(rows)
+
+
+def growth(db_path: str, days: float, fill_seconds: float) -> dict:
+    size = os.path.getsize(db_path)
+    return {
+        "days": days,
+        "fill_seconds": fill_seconds,
+        "bytes": size,
+        "bytes_per_day": size / days,
+        "projected_bytes_per_year": size / days * 365,
+        "tables": table_sizes(db_path),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path: str, port: int, workers: int, threads: int):
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--workers", str(workers),
+            "--worker-class", "gthread",
+            "--threads", str(threads),
+            "--bind", f"127.0.0.1:{port}",
+            "--log-level", "warning",
+            "weather-server:app",
+        ],
+        cwd=ROOT,
+        env={**os.environ, "WEATHER_SERVER_DB": db_path},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/weather/latest")
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("weather-server did not start")
+
+
+def serving(port: int, concurrency: int, requests: int) -> dict:
+    return {
+        path: bench_serving.run(f"http://127.0.0.1:{port}{path}", concurrency, requests, 0)
+        for path in ENDPOINTS
+    }
+
+
+def logger_pipeline(server_port: int, seconds: float) -> dict:
+    """Run the logger's pipeline against fake sensors for `seconds`."""
+    sys.path.insert(0, FAKES)
+    sys.path.insert(1, ROOT)
+    os.environ.setdefault("BENCH_BME_LATENCY", "0.01")
+    os.environ.setdefault("BENCH_PMS_LATENCY", "0.05")
+    module = runpy.run_path(os.path.join(ROOT, "weather-logger.py"), run_name="benchmark")
+    logger_globals = module["log_readings"].__globals__
+    base = f"http://127.0.0.1:{server_port}"
+    broker = FakeBroker(ack_delay=0.01).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "logger.db")
+        logger_globals.update(LOGGER_INTERVALS)
+        logger_globals.update(
+            LOGGER_DB=db_path,
+            BROKER_HOST="127.0.0.1",
+            BROKER_PORT=broker.port,
+            SERVER_URLS={
+                "weather": f"{base}/weather/latest",
+                "air": f"{base}/air/latest",
+            },
+            SERVER_SYNC_URLS={
+                "weather": f"{base}/weather/sync",
+                "air": f"{base}/air/sync",
+            },
+        )
+        logger_globals["initiate_tables"](db_path)
+        publisher = logger_globals["create_publisher"]()
+        publisher.start()
+
+        async def run():
+            try:
+                await asyncio.wait_for(logger_globals["log_readings"](publisher), seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - started
+        publisher.stop()
+        broker.stop()
+
+        connection = sqlite3.connect(db_path)
+        stored, samples = connection.execute(
+            "SELECT count(*), avg(samples) FROM thp_readings"
+        ).fetchone()
+        air_samples = connection.execute(
+            "SELECT avg(samples) FROM air_quality_readings"
+        ).fetchone()[0]
+        outbox = dict(
+            connection.execute("SELECT sink, count(*) FROM outbox GROUP BY sink").fetchall()
+        )
+        connection.close()
+
+    emit = LOGGER_INTERVALS["EMIT_INTERVAL"]
+    return {
+        "seconds": elapsed,
+        "intervals": LOGGER_INTERVALS,
+        "weather_readings": stored,
+        "expected_weather_readings": int(elapsed // emit),
+        "bme_samples_per_reading": samples,
+        "expected_bme_samples": emit / LOGGER_INTERVALS["BME_INTERVAL"],
+        "pms_samples_per_reading": air_samples,
+        "expected_pms_samples": emit / LOGGER_INTERVALS["PMS_INTERVAL"],
+        "outbox": outbox,
+        "mqtt_messages": len(broker.messages),
+    }
+
+
+def numbers(value, prefix=""):
+    """Flatten nested results into {dotted.path: number}."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(numbers(item, f"{prefix}{key}."))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def compare(baseline: dict, results: dict):
+    before = numbers(baseline["results"])
+    after = numbers(results["results"])
+    print(f"{'metric':<72}{'baseline':>14}{'current':>14}{'change':>9}")
+    for key, value in after.items():
+        if key not in before or "args" in key:
+            continue
+        change = f"{(value - before[key]) / before[key] * 100:+.1f}%" if before[key] else ""
+        print(f"{key:<72}{before[key]:>14.4g}{value:>14.4g}{change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--days", type=float, default=365, help="synthetic history to load")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ingest-rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=800)
+    parser.add_argument("--logger-seconds", type=float, default=20)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON to print changes against")
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(",")
+
+    results = {"meta": metadata(args), "results": {}}
+    if "ingest" in scenarios:
+        results["results"]["ingest"] = bench_ingest.run(args.ingest_rows, args.batch_size)
+
+    if {"growth", "serving", "logger"} & set(scenarios):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "weather-server.db")
+            end = time.time()
+            started = time.perf_counter()
+            synthetic.fill_server_db(db_path, end - args.days * 86400, end, seed=args.seed)
+            fill_seconds = time.perf_counter() - started
+            if "growth" in scenarios:
+                results["results"]["growth"] = growth(db_path, args.days, fill_seconds)
+            if {"serving", "logger"} & set(scenarios):
+                port = free_port()
+                server = start_server(db_path, port, args.workers, args.threads)
+                try:
+                    if "serving" in scenarios:
+                        results["results"]["serving"] = serving(
+                            port, args.concurrency, args.requests
+                        )
+                    if "logger" in scenarios:
+                        results["results"]["logger"] = logger_pipeline(
+                            port, args.logger_seconds
+                        )
+                finally:
+                    server.terminate()
+                    server.wait()
+                    bench_ingest.remove_shared_files(db_path)
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Reproducible synthetic readings and bird sightings for the benchmarks.
+
+Weather follows daily and yearly cycles plus noise, pressure a slow random
+walk, and particulates a noisy baseline with occasional smoke episodes.
+Birds arrive in bursts: a dawn chorus every morning and a few short bursts
+through the day. Every generator takes a seed, so runs are comparable
+across commits.
+"""
+import math
+import random
+import sqlite3
+import uuid
+
+from station import birds, migrations, rollups
+
+SPECIES = [
+    ("Turdus merula", "Blackbird"),
+    ("Erithacus rubecula", "Robin"),
+    ("Troglodytes troglodytes", "Wren"),
+    ("Pica pica", "Magpie"),
+    ("Dacelo novaeguineae", "Laughing Kookaburra"),
+    ("Strepera graculina", "Pied Currawong"),
+    ("Cracticus tibicen", "Australian Magpie"),
+    ("Manorina melanocephala", "Noisy Miner"),
+    ("Rhipidura leucophrys", "Willie Wagtail"),
+    ("Trichoglossus moluccanus", "Rainbow Lorikeet"),
+]
+
+
+def _id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def weather_readings(start: float, end: float, interval: float = 60, seed: int = 1):
+    """(id, ts, temperature, humidity, pressure) rows from start to end."""
+    rng = random.Random(seed)
+    pressure = 1013.0
+    ts = start
+    while ts < end:
+        day = 2 * math.pi * (ts % 86400) / 86400
+        year = 2 * math.pi * (ts % 31557600) / 31557600
+        temperature = 15 + 8 * math.cos(year) - 5 * math.cos(day) + rng.gauss(0, 0.3)
+        humidity = min(100.0, max(5.0, 65 + 20 * math.cos(day) + rng.gauss(0, 2)))
+        pressure = min(1045.0, max(975.0, pressure + rng.gauss(0, 0.05)))
+        yield (_id(rng), ts, temperature, humidity, pressure)
+        ts += interval
+
+
+def air_readings(start: float, end: float, interval: float = 60, seed: int = 2):
+    """(id, ts, pm1, pm2_5, pm10) rows from start to end."""
+    rng = random.Random(seed)
+    smoke = 0.0
+    ts = start
+    while ts < end:
+        if rng.random() < 1 / 20000:
+            smoke = rng.uniform(30, 150)
+        smoke *= 0.995
+        pm2_5 = max(0.0, 6 + smoke + rng.gauss(0, 1.5))
+        yield (_id(rng), ts, pm2_5 * 0.7, pm2_5, pm2_5 * 1.6 + rng.uniform(0, 4))
+        ts += interval
+
+
+def bird_sightings(start: float, end: float, seed: int = 3):
+    """(id, ts, scientific_name, common_name, confidence) rows in time order."""
+    rng = random.Random(seed)
+    day = start - start % 86400
+    while day < end:
+        bursts = [(day + 6 * 3600 + rng.uniform(-1800, 1800), 400, 1800)]
+        bursts += [(day + rng.uniform(7, 19) * 3600, 30, 300) for _ in range(rng.randint(2, 6))]
+        rows = []
+        for burst_start, count, length in bursts:
+            for _ in range(rng.randint(count // 2, count)):
+                ts = int(burst_start + rng.uniform(0, length))
+                if start <= ts < end:
+                    scientific_name, common_name = rng.choice(SPECIES)
+                    rows.append((_id(rng), ts, scientific_name, common_name, rng.random()))
+        rows.sort(key=lambda row: row[1])
+        yield from rows
+        day += 86400
+
+
+def _chunks(rows, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fill_server_db(db_path: str, start: float, end: float, seed: int = 1, chunk: int = 10000):
+    """Migrate db_path and load it with synthetic readings and sightings,
+    writing rollups and bird counters as the server would."""
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    connection = sqlite3.connect(db_path)
+    sources = {
+        "thp_readings": weather_readings(start, end, seed=seed),
+        "air_quality_readings": air_readings(start, end, seed=seed + 1),
+    }
+    for table, rows in sources.items():
+        fields = migrations.READING_TABLES[table]
+        columns = ", ".join(("id", "ts") + fields)
+        placeholders = ", ".join("?" for _ in range(2 + len(fields)))
+        for batch in _chunks(rows, chunk):
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", batch
+                )
+                rollups.add_readings(
+                    connection, table, fields, [(row[1], row[2:]) for row in batch]
+                )
+    for batch in _chunks(bird_sightings(start, end, seed=seed + 2), chunk):
+        with connection:
+            birds.add_sightings(connection, batch)
+    connection.close()
@@ -0,0 +1,68 @@
+"""Summarise high-rate raw sensor samples into one record per interval."""
+import math
+import statistics
+
+# Modified z-score above which a sample is treated as an outlier
+OUTLIER_THRESHOLD = 3.5
+# Fewer samples than this are too few to judge outliers from
+MIN_SAMPLES_FOR_REJECTION = 4
+
+
+def reject_outliers(values: list, threshold: float = OUTLIER_THRESHOLD) -> list:
+    """Drop values whose modified z-score (median absolute deviation) exceeds threshold.
+
+    Integer readings such as the PMS5003's often have more than half their
+    samples on the median, making the MAD zero; the score then uses the mean
+    absolute deviation instead (scaled by 1.2533 to match), so real changes
+    aren't thrown away as outliers.
+    """
+    if len(values) < MIN_SAMPLES_FOR_REJECTION:
+        return values
+    median = statistics.median(values)
+    deviations = [abs(v - median) for v in values]
+    mad = statistics.median(deviations)
+    if mad != 0:
+        scale = mad / 0.6745
+    else:
+        scale = 1.2533 * statistics.fmean(deviations)
+        if scale == 0:
+            return values
+    return [v for v, d in zip(values, deviations) if d / scale <= threshold]
+
+
+class SampleAggregator:
+    """Collect raw samples of a set of fields until the interval is emitted.
+
+    `emit()` returns, per field, the mean (under the field's own name) plus
+    `<field>_min`, `<field>_max` and `<field>_std` after outlier rejection,
+    and `samples`, the number of raw reads in the interval.
+    """
+
+    def __init__(self, fields, threshold: float = OUTLIER_THRESHOLD):
+        self.fields = tuple(fields)
+        self.threshold = threshold
+        self._reset()
+
+    def _reset(self):
+        self.samples = 0
+        self._values = {field: [] for field in self.fields}
+
+    def add(self, values):
+        self.samples += 1
+        for field, value in zip(self.fields, values):
+            if value is not None and not math.isnan(value):
+                self._values[field].append(value)
+
+    def emit(self):
+        """Summary of the samples since the last emit, or None if there were none."""
+        if not self.samples:
+            return None
+        summary = {"samples": self.samples}
+        for field, values in self._values.items():
+            kept = reject_outliers(values, self.threshold)
+            summary[field] = statistics.fmean(kept) if kept else None
+            summary[f"{field}_min"] = min(kept) if kept else None
+            summary[f"{field}_max"] = max(kept) if kept else None
+            summary[f"{field}_std"] = statistics.pstdev(kept) if kept else None
+        self._reset()
+        return summary
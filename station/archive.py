@@ -0,0 +1,133 @@
+"""Compressed monthly archives of rows pruned from the databases.
+
+Each table's rows are archived per calendar month (UTC) to
+`<directory>/<table>/<YYYY-MM>.npz`, one compressed array per column: `id`
+as text and every other column as float64, with NULL stored as NaN. Writing
+a month that already has an archive merges the two, so rows that arrive late
+for an archived month are kept rather than overwriting it.
+"""
+import datetime
+import os
+from functools import lru_cache
+
+import numpy as np
+
+# Archived months kept decoded in memory per process, for repeated history
+# queries. A month of minute readings is several MB decoded, ids included
+CACHED_MONTHS = 2
+
+
+def archive_dir(db_path: str) -> str:
+    """Where a database's archives live, e.g. db/weather-server-archive."""
+    return f"{os.path.splitext(db_path)[0]}-archive"
+
+
+def month_bounds(ts: float) -> tuple:
+    """Start and end timestamps of the UTC calendar month containing ts."""
+    day = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+    start = day.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+def month_path(directory: str, table: str, ts: float) -> str:
+    month = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+    return os.path.join(directory, table, f"{month:%Y-%m}.npz")
+
+
+def to_arrays(columns, rows) -> dict:
+    arrays = {}
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows]
+        if column == "id":
+            arrays[column] = np.array(["" if v is None else str(v) for v in values], dtype=str)
+        else:
+            arrays[column] = np.array(
+                [np.nan if v is None else v for v in values], dtype=np.float64
+            )
+    return arrays
+
+
+@lru_cache(maxsize=CACHED_MONTHS)
+def _load(path: str, mtime_ns: int) -> dict:
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_month(path: str, cached: bool = True):
+    """The archived columns in `path`, or None if there is no archive.
+
+    With cached=False the month is read from disk and not kept, e.g. for a
+    one-off export that would otherwise evict the months history is using.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if not cached:
+        return _load.__wrapped__(path, mtime_ns)
+    return _load(path, mtime_ns)
+
+
+def write_month(path: str, columns, rows):
+    """Archive rows (tuples ordered as `columns`, including ts) for one month."""
+    arrays = to_arrays(columns, rows)
+    existing = load_month(path, cached=False)
+    if existing is not None:
+        arrays = {
+            column: np.concatenate((existing[column], arrays[column])) for column in columns
+        }
+        # Drop rows archived before, e.g. if a run stopped before deleting them
+        # (NaN never compares equal, so it is keyed as inf)
+        keys = [
+            values if values.dtype.kind == "U" else np.where(np.isnan(values), np.inf, values)
+            for values in (arrays[column] for column in columns)
+        ]
+        records = np.rec.fromarrays(keys, names=columns)
+        _, keep = np.unique(records, return_index=True)
+        arrays = {column: values[keep] for column, values in arrays.items()}
+    order = np.argsort(arrays["ts"], kind="stable")
+    arrays = {column: values[order] for column, values in arrays.items()}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.partial"
+    with open(partial, "wb") as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+
+def iter_months(
+    directory: str,
+    table: str,
+    columns,
+    start: float,
+    end: float,
+    batch_rows: int = None,
+    cached: bool = True,
+):
+    """Archived rows of `columns` with start <= ts < end, as lists in ts order.
+
+    Each list holds one month's rows, or at most `batch_rows` of them, so
+    only one batch of row tuples exists at a time.
+    """
+    month = month_bounds(start)[0]
+    while month < end:
+        data = load_month(month_path(directory, table, month), cached)
+        if data is not None:
+            lo, hi = np.searchsorted(data["ts"], [start, end])
+            step = batch_rows or max(hi - lo, 1)
+            for i in range(lo, hi, step):
+                selected = [data[column][i : min(i + step, hi)].tolist() for column in columns]
+                yield [tuple(None if v != v else v for v in row) for row in zip(*selected)]
+        month = month_bounds(month)[1]
+
+
+def read(directory: str, table: str, columns, start: float, end: float) -> list:
+    """Archived rows of `columns` with start <= ts < end, in ts order."""
+    return [
+        row
+        for rows in iter_months(directory, table, columns, start, end)
+        for row in rows
+    ]
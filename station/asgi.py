@@ -0,0 +1,128 @@
+"""Serve the Flask app under an ASGI server without blocking the event loop.
+
+WSGIBridge runs each request through the WSGI app on a thread pool, pulling
+the response body a chunk at a time, while the event loop handles the sockets.
+Slow clients then cost a coroutine instead of a worker, and routes that need
+to stay open (like /stream) can be written natively as coroutines.
+"""
+import asyncio
+import io
+import sys
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """A WSGI environ for an ASGI HTTP scope and its full request body."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+class WSGIBridge:
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, await read_body(receive))
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            # The ASGI server adds its own Date header
+            started["headers"] = [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in headers
+                if name.lower() != "date"
+            ]
+
+        def begin():
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            if not any(name == b"content-length" for name, _ in started["headers"]):
+                return result, chunks, None
+            # A sized response is complete already; finish it in this one hop
+            try:
+                return None, None, b"".join(chunks)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+        result, chunks, body = await loop.run_in_executor(self.executor, begin)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": started["headers"],
+            }
+        )
+        if body is not None:
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            # Hold one chunk back so the last is sent with more_body=False;
+            # separate trailing writes would stall on delayed ACKs.
+            pending = b""
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if pending:
+                    await send({"type": "http.response.body", "body": pending, "more_body": True})
+                pending = chunk
+            await send({"type": "http.response.body", "body": pending})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.executor, result.close)
+
+
+async def lifespan(receive, send):
+    """Acknowledge startup and shutdown; the app has nothing to set up."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
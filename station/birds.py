@@ -0,0 +1,269 @@
+"""Bird sightings stored against a species dictionary, with time-bucketed counters.
+
+Each species name is stored once in bird_species, which also keeps its first
+and last sighting, so "latest" and per-species lookups read that small table
+instead of the sightings. bird_counts holds, per bucket and species, the number
+and summed confidence of detections above MIN_CONFIDENCE at minute, hour and
+day resolution. A top-N query over any window sums the coarsest whole buckets
+that fit and reads raw sightings only for the partial minutes at either end.
+"""
+import math
+
+# Widths of the counter buckets, finest first (seconds)
+RESOLUTIONS = (60, 3600, 86400)
+# Detections at or below this confidence are stored but not counted
+MIN_CONFIDENCE = 0.1
+
+_UPSERT_SPECIES = """INSERT INTO bird_species
+    (scientific_name, common_name, first_seen, last_seen, last_confidence, detections)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (common_name) DO UPDATE SET
+        scientific_name = coalesce(excluded.scientific_name, scientific_name),
+        first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen),
+        last_confidence = CASE
+            WHEN excluded.last_seen > last_seen THEN excluded.last_confidence
+            WHEN excluded.last_seen = last_seen THEN max(last_confidence, excluded.last_confidence)
+            ELSE last_confidence END,
+        detections = detections + excluded.detections
+    RETURNING species_id"""
+
+_UPSERT_COUNT = """INSERT INTO bird_counts
+    (resolution, bucket, species_id, detections, confidence_sum)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, bucket, species_id) DO UPDATE SET
+        detections = detections + excluded.detections,
+        confidence_sum = confidence_sum + excluded.confidence_sum"""
+
+SPECIES_COLUMNS = (
+    "common_name",
+    "scientific_name",
+    "first_seen",
+    "last_seen",
+    "last_confidence",
+    "detections",
+)
+
+
+def create_bird_tables(connection):
+    """Move bird_observations into the species-keyed tables.
+
+    bird_observations is replaced by a view with the same columns, so ad-hoc
+    queries against it keep working.
+    """
+    connection.execute(
+        """CREATE TABLE bird_species (
+            species_id integer PRIMARY KEY,
+            common_name text NOT NULL UNIQUE,
+            scientific_name text,
+            first_seen integer NOT NULL,
+            last_seen integer NOT NULL,
+            last_confidence real,
+            detections integer NOT NULL
+        )"""
+    )
+    connection.execute(
+        """CREATE TABLE bird_sightings (
+            id text,
+            ts integer NOT NULL,
+            species_id integer NOT NULL REFERENCES bird_species,
+            confidence real
+        )"""
+    )
+    connection.execute("CREATE INDEX bird_sightings_ts ON bird_sightings (ts)")
+    connection.execute(
+        "CREATE INDEX bird_sightings_species_ts ON bird_sightings (species_id, ts)"
+    )
+    connection.execute(
+        """CREATE TABLE bird_counts (
+            resolution integer NOT NULL,
+            bucket integer NOT NULL,
+            species_id integer NOT NULL,
+            detections integer NOT NULL,
+            confidence_sum real NOT NULL,
+            PRIMARY KEY (resolution, bucket, species_id)
+        ) WITHOUT ROWID"""
+    )
+
+    connection.execute(
+        """INSERT INTO bird_species
+            (common_name, scientific_name, first_seen, last_seen, detections)
+        SELECT common_name, max(scientific_name), min(ts), max(ts), count(*)
+        FROM bird_observations WHERE common_name IS NOT NULL GROUP BY common_name"""
+    )
+    connection.execute(
+        """UPDATE bird_species SET last_confidence = (
+            SELECT max(confidence) FROM bird_observations o
+            WHERE o.common_name = bird_species.common_name AND o.ts = bird_species.last_seen
+        )"""
+    )
+    connection.execute(
+        """INSERT INTO bird_sightings (id, ts, species_id, confidence)
+        SELECT o.id, o.ts, s.species_id, o.confidence
+        FROM bird_observations o JOIN bird_species s USING (common_name) ORDER BY o.ts"""
+    )
+    for resolution in RESOLUTIONS:
+        connection.execute(
+            f"""INSERT INTO bird_counts
+            SELECT {resolution}, cast(ts / {resolution} AS integer) * {resolution},
+                species_id, count(*), total(confidence)
+            FROM bird_sightings WHERE confidence > {MIN_CONFIDENCE} GROUP BY 2, 3"""
+        )
+    connection.execute("DROP TABLE bird_observations")
+    connection.execute(
+        """CREATE VIEW bird_observations AS
+        SELECT b.id, b.ts, s.scientific_name, s.common_name, b.confidence
+        FROM bird_sightings b JOIN bird_species s USING (species_id)"""
+    )
+
+
+def index_sighting_ids(connection):
+    connection.execute("CREATE INDEX IF NOT EXISTS bird_sightings_id ON bird_sightings (id)")
+
+
+def stored_ids(connection, ids) -> set:
+    """The given sighting ids that are already stored."""
+    ids = list(ids)
+    found = set()
+    for i in range(0, len(ids), 500):
+        batch = ids[i : i + 500]
+        found.update(
+            row[0]
+            for row in connection.execute(
+                f"SELECT id FROM bird_sightings WHERE id IN ({', '.join('?' for _ in batch)})",
+                batch,
+            )
+        )
+    return found
+
+
+def add_sightings(connection, sightings):
+    """Store (id, ts, scientific_name, common_name, confidence) sightings."""
+    species = {}
+    counts = {}
+    for id, ts, scientific_name, common_name, confidence in sightings:
+        entry = species.setdefault(common_name, [scientific_name, ts, ts, confidence, 0])
+        entry[0] = scientific_name or entry[0]
+        entry[1] = min(entry[1], ts)
+        if ts > entry[2]:
+            entry[2], entry[3] = ts, confidence
+        elif ts == entry[2] and (confidence or 0) > (entry[3] or 0):
+            entry[3] = confidence
+        entry[4] += 1
+
+    species_ids = {}
+    for common_name, (scientific_name, first, last, confidence, n) in species.items():
+        species_ids[common_name] = connection.execute(
+            _UPSERT_SPECIES, (scientific_name, common_name, first, last, confidence, n)
+        ).fetchone()[0]
+
+    rows = []
+    for id, ts, _, common_name, confidence in sightings:
+        species_id = species_ids[common_name]
+        rows.append((id, ts, species_id, confidence))
+        if confidence is None or confidence <= MIN_CONFIDENCE:
+            continue
+        for resolution in RESOLUTIONS:
+            bucket = int(ts // resolution) * resolution
+            count = counts.setdefault((resolution, bucket, species_id), [0, 0.0])
+            count[0] += 1
+            count[1] += confidence
+    connection.executemany(
+        "INSERT INTO bird_sightings (id, ts, species_id, confidence) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+    connection.executemany(_UPSERT_COUNT, [key + tuple(count) for key, count in counts.items()])
+
+
+def _split_window(start: float, end: float, resolutions=RESOLUTIONS):
+    """Cover [start, end) (end None for open-ended), in time order, with
+    (resolution, lo, hi) ranges of the coarsest whole buckets that fit and
+    (None, lo, hi) raw edges."""
+    if not resolutions:
+        return [(None, start, end)] if start < end else []
+    size = resolutions[-1]
+    first = math.ceil(start / size) * size
+    if end is None:
+        return _split_window(start, first, resolutions[:-1]) + [(size, first, None)]
+    last = int(end // size) * size
+    if last <= first:
+        return _split_window(start, end, resolutions[:-1])
+    return (
+        _split_window(start, first, resolutions[:-1])
+        + [(size, first, last)]
+        + _split_window(last, end, resolutions[:-1])
+    )
+
+
+def _fine_counts_from(ranges, since: float):
+    """Ranges with the finest buckets before `since` read raw instead, for
+    when those buckets have been pruned."""
+    finest = RESOLUTIONS[0]
+    since = math.ceil(since / finest) * finest
+    for resolution, lo, hi in ranges:
+        if resolution != finest or lo >= since:
+            yield resolution, lo, hi
+            continue
+        cut = since if hi is None else min(hi, since)
+        yield None, lo, cut
+        if hi is None or cut < hi:
+            yield resolution, cut, hi
+
+
+def top_species(
+    connection, start: float, end: float = None, limit: int = None, fine_since: float = None
+):
+    """(common_name, scientific_name, detections, confidence_sum) for each
+    species counted between start and end (open-ended if None), highest
+    summed confidence first. Minute counts are only used from `fine_since`
+    on, if given (older ones may have been pruned)."""
+    ranges = _split_window(start, end)
+    if fine_since is not None:
+        ranges = _fine_counts_from(ranges, fine_since)
+    parts, params = [], ()
+    for resolution, lo, hi in ranges:
+        if resolution is None:
+            parts.append(
+                """SELECT species_id, 1 AS n, confidence AS total FROM bird_sightings
+                WHERE ts >= ? AND ts < ? AND confidence > ?"""
+            )
+            params += (lo, hi, MIN_CONFIDENCE)
+            continue
+        parts.append(
+            """SELECT species_id, detections AS n, confidence_sum AS total FROM bird_counts
+            WHERE resolution = ? AND bucket >= ?"""
+            + ("" if hi is None else " AND bucket < ?")
+        )
+        params += (resolution, lo) if hi is None else (resolution, lo, hi)
+    if not parts:
+        return []
+    union = " UNION ALL ".join(parts)
+    query = f"""SELECT s.common_name, s.scientific_name, sum(c.n), sum(c.total)
+        FROM ({union}) AS c JOIN bird_species s USING (species_id)
+        GROUP BY c.species_id ORDER BY 4 DESC"""
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    return connection.execute(query, params).fetchall()
+
+
+def latest_species(connection):
+    """Names of the species in the most recent sighting, most confident first."""
+    rows = connection.execute(
+        """SELECT common_name FROM bird_species
+        WHERE last_seen = (SELECT max(last_seen) FROM bird_species)
+        ORDER BY last_confidence DESC"""
+    )
+    return [row[0] for row in rows]
+
+
+def species(connection, common_name: str = None):
+    """Dictionary rows (see SPECIES_COLUMNS) for one species, or all by last seen."""
+    columns = ", ".join(SPECIES_COLUMNS)
+    if common_name is None:
+        return connection.execute(
+            f"SELECT {columns} FROM bird_species ORDER BY last_seen DESC"
+        ).fetchall()
+    return connection.execute(
+        f"SELECT {columns} FROM bird_species WHERE common_name = ?", (common_name,)
+    ).fetchall()
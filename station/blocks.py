@@ -0,0 +1,420 @@
+"""Compressed, time-partitioned blocks of raw readings.
+
+An optional layout for the reading tables (READING_BLOCKS in weather-server.py).
+Readings still arrive as rows; once a UTC day is old enough, compact() packs
+its rows into one block in `<table>_blocks` and deletes them, so the row
+table only holds the last few days. Each block stores its columns as:
+
+- ids as 16 raw bytes per uuid (newline-separated text if any id isn't one),
+- timestamps as integer microseconds, delta-of-delta encoded, so readings
+  taken on a steady schedule are a few bytes each,
+- each field as the XOR of its float64 bits with the previous value's, as in
+  Gorilla: a repeated value XORs to zero and a slowly changing one shares
+  its sign, exponent and leading mantissa bits.
+
+Gorilla packs these at bit level, which takes a loop per value to decode.
+Here each XOR (or zig-zagged delta-of-delta) keeps only its significant
+bytes, with a control byte per value giving their count and offset, so a
+block is encoded and decoded with whole-array NumPy operations. The block is
+then zlib-compressed, which mostly shrinks the control bytes.
+
+scan() decodes the blocks overlapping a range into NumPy arrays and merges in
+the rows not compacted yet, so readers see a single table. Timestamps are
+kept to the microsecond, which is all datetime.timestamp() produces. NULL
+values read back as NaN.
+
+Compact, restore to rows, or size up a database by hand with:
+    python -m station.blocks {compact|expand|stats} db/weather-server.db
+"""
+import sqlite3
+import struct
+import sys
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+from station import archive
+
+# Width of a block (seconds)
+BLOCK_SECONDS = 86400
+
+_HEADER = struct.Struct("<BIq")
+_FORMAT_VERSION = 1
+_UUID_IDS, _TEXT_IDS = 0, 1
+_COLUMNS = np.arange(8)
+
+
+def block_table(table: str) -> str:
+    return f"{table}_blocks"
+
+
+def block_start(ts: float) -> int:
+    return int(ts // BLOCK_SECONDS) * BLOCK_SECONDS
+
+
+def create_block_table(connection, table: str):
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS {block_table(table)} (
+            start integer PRIMARY KEY,
+            count integer NOT NULL,
+            min_ts real NOT NULL,
+            max_ts real NOT NULL,
+            data blob NOT NULL
+        )"""
+    )
+
+
+def _pack(values: np.ndarray) -> tuple:
+    """Control bytes and significant bytes of uint64 values.
+
+    Each control byte holds the offset of the lowest non-zero byte in the
+    high nibble and the number of bytes kept from there in the low nibble.
+    """
+    matrix = values.astype("<u8").view(np.uint8).reshape(-1, 8)
+    nonzero = matrix != 0
+    used = nonzero.any(axis=1)
+    low = np.where(used, nonzero.argmax(axis=1), 0)
+    high = np.where(used, 8 - nonzero[:, ::-1].argmax(axis=1), 0)
+    control = (low << 4 | (high - low)).astype(np.uint8)
+    kept = (_COLUMNS >= low[:, None]) & (_COLUMNS < high[:, None])
+    return control.tobytes(), matrix[kept].tobytes()
+
+
+def _unpack(control: bytes, payload: bytes) -> np.ndarray:
+    control = np.frombuffer(control, np.uint8)
+    low = (control >> 4).astype(np.intp)
+    high = low + (control & 0x0F)
+    matrix = np.zeros((len(control), 8), np.uint8)
+    matrix[(_COLUMNS >= low[:, None]) & (_COLUMNS < high[:, None])] = np.frombuffer(
+        payload, np.uint8
+    )
+    return matrix.reshape(-1).view("<u8")
+
+
+def _encode_ids(ids) -> bytes:
+    raw = []
+    for id in ids:
+        try:
+            value = uuid.UUID(id)
+        except (TypeError, ValueError):
+            break
+        if str(value) != id:
+            break
+        raw.append(value.bytes)
+    else:
+        return bytes([_UUID_IDS]) + b"".join(raw)
+    return bytes([_TEXT_IDS]) + "\n".join(ids).encode()
+
+
+def _decode_ids(data: bytes) -> list:
+    if data[0] == _TEXT_IDS:
+        return data[1:].decode().split("\n")
+    return [str(uuid.UUID(bytes=data[i : i + 16])) for i in range(1, len(data), 16)]
+
+
+def encode_block(ids, ts, fields) -> bytes:
+    """A block of readings: ids, timestamps and one float64 array per field, in ts order."""
+    micros = np.round(np.asarray(ts, np.float64) * 1e6).astype(np.int64)
+    deltas = np.diff(micros, prepend=micros[:1])
+    dod = np.diff(deltas, prepend=0)
+    zigzag = (dod << 1) ^ (dod >> 63)
+    streams = [_encode_ids(ids), *_pack(zigzag.view(np.uint64))]
+    for values in fields:
+        bits = np.asarray(values, np.float64).view(np.uint64)
+        streams += _pack(bits ^ np.concatenate((np.zeros(1, np.uint64), bits[:-1])))
+    body = _HEADER.pack(_FORMAT_VERSION, len(micros), int(micros[0]))
+    body += b"".join(struct.pack("<I", len(stream)) + stream for stream in streams)
+    return zlib.compress(body)
+
+
+def decode_block(data: bytes, ids: bool = False) -> tuple:
+    """(ids or None, ts, [field arrays]) from encode_block's output."""
+    body = zlib.decompress(data)
+    version, count, first = _HEADER.unpack_from(body)
+    if version != _FORMAT_VERSION:
+        raise ValueError(f"Unsupported block format {version}")
+    streams, offset = [], _HEADER.size
+    while offset < len(body):
+        (length,) = struct.unpack_from("<I", body, offset)
+        streams.append(body[offset + 4 : offset + 4 + length])
+        offset += 4 + length
+    zigzag = _unpack(streams[1], streams[2])
+    dod = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    micros = first + np.cumsum(np.cumsum(dod))
+    fields = [
+        np.bitwise_xor.accumulate(_unpack(control, payload)).view(np.float64)
+        for control, payload in zip(streams[3::2], streams[4::2])
+    ]
+    return (_decode_ids(streams[0]) if ids else None), micros / 1e6, fields
+
+
+def _to_arrays(rows, fields) -> tuple:
+    """(ids, ts, [field arrays]) from (id, ts, *values) rows, NULL as NaN."""
+    ts = np.array([row[1] for row in rows], np.float64)
+    values = [
+        np.array([np.nan if row[2 + i] is None else row[2 + i] for row in rows], np.float64)
+        for i in range(len(fields))
+    ]
+    return [row[0] for row in rows], ts, values
+
+
+def read_block(connection, table: str, start: int, ids: bool = True):
+    """The decoded block starting at `start`, or None if there isn't one."""
+    row = connection.execute(
+        f"SELECT data FROM {block_table(table)} WHERE start = ?", (start,)
+    ).fetchone()
+    return None if row is None else decode_block(row[0], ids)
+
+
+def write_block(connection, table: str, start: int, ids, ts, fields):
+    connection.execute(
+        f"""INSERT OR REPLACE INTO {block_table(table)} (start, count, min_ts, max_ts, data)
+        VALUES (?, ?, ?, ?, ?)""",
+        (start, len(ts), float(ts.min()), float(ts.max()), encode_block(ids, ts, fields)),
+    )
+
+
+def _merge(blocks) -> tuple:
+    """One (ids, ts, fields) from several, keeping the first of each id, in ts order."""
+    ids = [id for block in blocks for id in block[0]]
+    ts = np.concatenate([block[1] for block in blocks])
+    fields = [np.concatenate(columns) for columns in zip(*(block[2] for block in blocks))]
+    _, first = np.unique(np.array(ids, dtype=str), return_index=True)
+    keep = first[np.argsort(ts[first], kind="stable")]
+    return [ids[i] for i in keep], ts[keep], [values[keep] for values in fields]
+
+
+def compact(connection, table: str, fields, before: float) -> int:
+    """Pack the rows of whole days ending at or before `before` into blocks.
+
+    A day that already has a block (rows that arrived late) is merged into
+    it. Returns the number of rows packed. The connection must be in
+    autocommit mode (isolation_level=None); each day is its own transaction.
+    """
+    columns = ", ".join(("id", "ts") + tuple(fields))
+    packed = 0
+    while True:
+        oldest = connection.execute(f"SELECT min(ts) FROM {table}").fetchone()[0]
+        if oldest is None:
+            return packed
+        start = block_start(oldest)
+        end = start + BLOCK_SECONDS
+        if end > before:
+            return packed
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                f"SELECT {columns} FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts",
+                (start, end),
+            ).fetchall()
+            block = _to_arrays(rows, fields)
+            existing = read_block(connection, table, start)
+            if existing is not None:
+                block = _merge([existing, block])
+            write_block(connection, table, start, *block)
+            connection.execute(f"DELETE FROM {table} WHERE ts >= ? AND ts < ?", (start, end))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        packed += len(rows)
+
+
+def expand(connection, table: str, fields) -> int:
+    """Move every block of a table back into rows; returns the rows restored."""
+    columns = ("id", "ts") + tuple(fields)
+    restored = 0
+    starts = [
+        row[0]
+        for row in connection.execute(f"SELECT start FROM {block_table(table)} ORDER BY start")
+    ]
+    for start in starts:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            ids, ts, values = read_block(connection, table, start)
+            rows = _rows(ids, ts, values)
+            connection.executemany(
+                f"""INSERT OR IGNORE INTO {table} ({', '.join(columns)})
+                VALUES ({', '.join('?' for _ in columns)})""",
+                rows,
+            )
+            connection.execute(f"DELETE FROM {block_table(table)} WHERE start = ?", (start,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        restored += len(rows)
+    return restored
+
+
+def _rows(ids, ts, fields) -> list:
+    """(id, ts, *values) rows from arrays, with NaN as None."""
+    columns = [ts.tolist()] + [values.tolist() for values in fields]
+    rows = [tuple(None if v != v else v for v in row) for row in zip(*columns)]
+    return [(id,) + row for id, row in zip(ids, rows)] if ids is not None else rows
+
+
+def prune(connection, table: str, fields, cutoff: float, directory: str) -> int:
+    """Archive and delete the blocks of whole months ending before `cutoff`.
+
+    Like retention.prune for the row table, so archived months hold both.
+    Returns the number of readings removed.
+    """
+    columns = ("id", "ts") + tuple(fields)
+    removed = 0
+    while True:
+        oldest = connection.execute(f"SELECT min(start) FROM {block_table(table)}").fetchone()[0]
+        if oldest is None:
+            return removed
+        start, end = archive.month_bounds(oldest)
+        if end > cutoff:
+            return removed
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = []
+            for (data,) in connection.execute(
+                f"SELECT data FROM {block_table(table)} WHERE start >= ? AND start < ? ORDER BY start",
+                (start, end),
+            ).fetchall():
+                rows += _rows(*decode_block(data, ids=True))
+            archive.write_month(archive.month_path(directory, table, start), columns, rows)
+            connection.execute(
+                f"DELETE FROM {block_table(table)} WHERE start >= ? AND start < ?", (start, end)
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        removed += len(rows)
+
+
+def known_ids(connection, table: str, rows) -> set:
+    """Ids of (id, ts, ...) rows that are already stored in a block."""
+    starts = sorted({block_start(row[1]) for row in rows})
+    found = set()
+    for i in range(0, len(starts), 500):
+        batch = starts[i : i + 500]
+        for (data,) in connection.execute(
+            f"SELECT data FROM {block_table(table)} WHERE start IN ({', '.join('?' for _ in batch)})",
+            batch,
+        ):
+            found.update(decode_block(data, ids=True)[0])
+    return found & {row[0] for row in rows}
+
+
+def iter_scan(connection, table: str, fields, start: float, end: float, ids: bool = False):
+    """Readings with start <= ts < end as {"ts", *fields} arrays (plus "id"
+    lists with ids=True), one block's worth at a time in ts order.
+
+    Rows not compacted yet are merged into the block their day belongs to.
+    """
+    fields = tuple(fields)
+    columns = ("id", "ts") + fields
+    rows = connection.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts",
+        (start, end),
+    ).fetchall()
+    row_ids, row_ts, row_values = _to_arrays(rows, fields)
+    row_starts = (row_ts // BLOCK_SECONDS).astype(np.int64) * BLOCK_SECONDS
+    stored = connection.execute(
+        f"""SELECT start, data FROM {block_table(table)}
+        WHERE start >= ? AND start < ? AND max_ts >= ? ORDER BY start""",
+        (block_start(start), end, start),
+    )
+    days = {int(day): None for day in np.unique(row_starts)}
+    for day, data in stored:
+        days[day] = data
+    for day in sorted(days):
+        parts = []
+        data = days[day]
+        if data is not None:
+            block_ids, ts, values = decode_block(data, ids)
+            lo, hi = np.searchsorted(ts, [start, end])
+            parts.append(
+                (block_ids[lo:hi] if ids else [], ts[lo:hi], [v[lo:hi] for v in values])
+            )
+        lo, hi = np.searchsorted(row_starts, [day, day + BLOCK_SECONDS])
+        if hi > lo:
+            parts.append(
+                (row_ids[lo:hi] if ids else [], row_ts[lo:hi], [v[lo:hi] for v in row_values])
+            )
+        if len(parts) == 1:
+            block_ids, ts, values = parts[0]
+        else:
+            ts = np.concatenate([part[1] for part in parts])
+            order = np.argsort(ts, kind="stable")
+            ts = ts[order]
+            values = [np.concatenate(v)[order] for v in zip(*(part[2] for part in parts))]
+            block_ids = [id for part in parts for id in part[0]]
+            block_ids = [block_ids[i] for i in order] if ids else []
+        if len(ts):
+            result = {"ts": ts, **dict(zip(fields, values))}
+            if ids:
+                result["id"] = list(block_ids)
+            yield result
+
+
+def scan(connection, table: str, fields, start: float, end: float, ids: bool = False) -> dict:
+    """Readings with start <= ts < end as {"ts", *fields} arrays, in ts order."""
+    parts = list(iter_scan(connection, table, fields, start, end, ids))
+    result = {
+        column: np.concatenate([part[column] for part in parts])
+        if parts
+        else np.empty(0, np.float64)
+        for column in ("ts",) + tuple(fields)
+    }
+    if ids:
+        result["id"] = [id for part in parts for id in part["id"]]
+    return result
+
+
+def rows_between(connection, table: str, fields, start: float, end: float, ids: bool = False):
+    """Lists of (id, ts, *values) rows, or (ts, *values) without ids, like a
+    row query over the range would return, a block at a time."""
+    for part in iter_scan(connection, table, fields, start, end, ids):
+        yield _rows(
+            part["id"] if ids else None, part["ts"], [part[field] for field in fields]
+        )
+
+
+def stats(connection, table: str) -> dict:
+    blocks, readings, size = connection.execute(
+        f"SELECT count(*), total(count), total(length(data)) FROM {block_table(table)}"
+    ).fetchone()
+    rows = connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    return {
+        "blocks": blocks,
+        "block_readings": int(readings),
+        "block_bytes": int(size),
+        "bytes_per_reading": size / readings if readings else None,
+        "rows": rows,
+    }
+
+
+def main(argv):
+    from station import migrations
+
+    if len(argv) not in (3, 4) or argv[1] not in ("compact", "expand", "stats"):
+        print("usage: python -m station.blocks {compact|expand|stats} DB_PATH [KEEP_DAYS]")
+        return 2
+    command, db_path = argv[1], argv[2]
+    keep_days = float(argv[3]) if len(argv) == 4 else 2
+    connection = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        for table, fields in migrations.READING_TABLES.items():
+            if command == "compact":
+                before = time.time() - keep_days * 86400
+                print(f"{table}: packed {compact(connection, table, fields, before)} rows")
+            elif command == "expand":
+                print(f"{table}: restored {expand(connection, table, fields)} rows")
+            else:
+                print(f"{table}: {stats(connection, table)}")
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
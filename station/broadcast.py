@@ -0,0 +1,121 @@
+"""Fan-out of change notifications to idle streaming clients in one worker."""
+import asyncio
+import threading
+import time
+
+
+class Broadcaster:
+    """Wake subscribers when any of a set of version numbers changes.
+
+    One watcher thread per worker polls `versions()` (cheap reads of the shared
+    cache) while at least one client is subscribed, and wakes every waiting
+    client at once through a condition variable. Clients compare the versions
+    they last saw with the current ones, so a slow client that misses a wake-up
+    still learns about every topic that changed.
+    """
+
+    def __init__(self, versions, poll: float = 1.0):
+        self.versions = versions
+        self.poll = poll
+        self._condition = threading.Condition()
+        self._current = {}
+        self._subscribers = 0
+        self._watcher = None
+
+    def _watch(self):
+        while True:
+            current = self.versions()
+            with self._condition:
+                if self._subscribers == 0:
+                    self._watcher = None
+                    return
+                if current != self._current:
+                    self._current = current
+                    self._condition.notify_all()
+            time.sleep(self.poll)
+
+    def subscribe(self, limit: int = None) -> bool:
+        """Count a new client in; returns False if `limit` clients already are."""
+        with self._condition:
+            if limit is not None and self._subscribers >= limit:
+                return False
+            self._subscribers += 1
+            if self._watcher is None:
+                self._current = self.versions()
+                self._watcher = threading.Thread(
+                    target=self._watch, name="broadcast-watcher", daemon=True
+                )
+                self._watcher.start()
+            return True
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def wait(self, seen: dict, timeout: float):
+        """Block until versions differ from `seen`; returns (current, changed topics).
+
+        Returns (seen, []) if nothing changed before the timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._current != seen, timeout)
+            current = dict(self._current)
+        changed = [topic for topic, version in current.items() if seen.get(topic) != version]
+        return (current, changed) if changed else (seen, [])
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+
+class AsyncBroadcaster:
+    """The asyncio counterpart of Broadcaster, for the ASGI server.
+
+    Waiting clients are coroutines rather than threads, so thousands of idle
+    streams cost only memory. `versions()` must be cheap enough to call on the
+    event loop.
+    """
+
+    def __init__(self, versions, poll: float = 1.0):
+        self.versions = versions
+        self.poll = poll
+        self._condition = None
+        self._current = {}
+        self._subscribers = 0
+        self._watcher = None
+
+    async def _watch(self):
+        while True:
+            current = self.versions()
+            async with self._condition:
+                if self._subscribers == 0:
+                    self._watcher = None
+                    return
+                if current != self._current:
+                    self._current = current
+                    self._condition.notify_all()
+            await asyncio.sleep(self.poll)
+
+    def subscribe(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        self._subscribers += 1
+        if self._watcher is None:
+            self._current = self.versions()
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    def unsubscribe(self):
+        self._subscribers -= 1
+
+    async def wait(self, seen: dict, timeout: float):
+        """Like Broadcaster.wait, without blocking a thread."""
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self._current != seen), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+            current = dict(self._current)
+        changed = [topic for topic, version in current.items() if seen.get(topic) != version]
+        return (current, changed) if changed else (seen, [])
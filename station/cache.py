@@ -0,0 +1,294 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Prefer RAM-backed shared memory so cache updates never reach the SD card
+CACHE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+MAGIC = b"WSRING03"
+# magic, number of fields, capacity, number of windows, identity of the
+# database mirrored, records ever appended
+HEADER = struct.Struct("<8sIIIxxxxQQ")
+
+
+def ring_path(db_path: str, table: str, suffix: str = "ring") -> str:
+    """Cache file for a table, unique to the database it mirrors."""
+    digest = hashlib.sha1(os.path.realpath(db_path).encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(CACHE_DIR, f"{name}-{digest}-{table}.{suffix}")
+
+
+def database_identity(db_path: str) -> int:
+    """A number that changes when the database at db_path is replaced.
+
+    Combines the file's inode with the random token the server migrations
+    store in it, so a new file and a different database copied over the old
+    one are both noticed.
+    """
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        (token,) = connection.execute("SELECT token FROM database_identity").fetchone()
+    finally:
+        connection.close()
+    digest = hashlib.sha1(f"{os.stat(db_path).st_ino}:{token}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class ReadingRing:
+    """Ring buffer of the most recent readings of one table in a shared mmap.
+
+    Every gunicorn worker maps the same file, so a reading POSTed to one worker
+    is immediately visible to GETs served by the others. Records are
+    (ts, *fields) doubles, with None stored as NaN. Appends must be in time
+    order; older readings (e.g. backfills) are left to the database.
+
+    For each sliding window the header also keeps running sums and counts of
+    the readings inside it. Appending adds to every window and expires
+    readings that have aged out from the tail, so both appending and reading
+    an aggregate are amortised O(1). A window can only cover as many readings
+    as the ring holds.
+
+    `identity` (see database_identity) ties the ring to the database it
+    mirrors: a ring left in shared memory for another database is cleared.
+    """
+
+    def __init__(
+        self, path: str, fields: int, capacity: int = 4096, windows=(300,), identity: int = 0
+    ):
+        self.path = path
+        self.identity = identity
+        self.fields = fields
+        self.capacity = capacity
+        self.windows = tuple(windows)
+        self.record = struct.Struct("<" + "d" * (fields + 1))
+        # window length, tail index, readings in window, sum and count per field
+        self.window_state = struct.Struct("<QQQ" + "d" * fields + "Q" * fields)
+        self.records_offset = HEADER.size + len(self.windows) * self.window_state.size
+        self.size = self.records_offset + capacity * self.record.size
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o660)
+        with self._locked(fcntl.LOCK_EX):
+            if not self._layout_matches():
+                self._initialise()
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def _initialise(self):
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, self.size)
+        header = HEADER.pack(
+            MAGIC, self.fields, self.capacity, len(self.windows), self.identity, 0
+        )
+        states = b"".join(
+            self.window_state.pack(window, 0, 0, *([0.0] * self.fields), *([0] * self.fields))
+            for window in self.windows
+        )
+        os.pwrite(self._fd, header + states, 0)
+
+    def _layout_matches(self) -> bool:
+        if os.fstat(self._fd).st_size != self.size:
+            return False
+        data = os.pread(self._fd, self.records_offset, 0)
+        magic, fields, capacity, windows, identity, _ = HEADER.unpack_from(data, 0)
+        if (magic, fields, capacity, windows, identity) != (
+            MAGIC,
+            self.fields,
+            self.capacity,
+            len(self.windows),
+            self.identity,
+        ):
+            return False
+        lengths = [
+            self.window_state.unpack_from(data, HEADER.size + i * self.window_state.size)[0]
+            for i in range(windows)
+        ]
+        return tuple(lengths) == self.windows
+
+    @contextmanager
+    def _locked(self, operation):
+        # flock excludes other processes; threads of this process share the
+        # file description, so they also need an ordinary lock.
+        with self._thread_lock:
+            fcntl.flock(self._fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _count(self) -> int:
+        return HEADER.unpack_from(self._map, 0)[5]
+
+    def _read(self, index: int):
+        offset = self.records_offset + (index % self.capacity) * self.record.size
+        return self.record.unpack_from(self._map, offset)
+
+    def _read_window(self, position: int):
+        offset = HEADER.size + position * self.window_state.size
+        state = self.window_state.unpack_from(self._map, offset)
+        sums = list(state[3 : 3 + self.fields])
+        counts = list(state[3 + self.fields :])
+        return state[1], state[2], sums, counts
+
+    def _write_window(self, position: int, tail: int, count: int, sums, counts):
+        if count == 0:
+            # Reset exactly rather than carrying floating point residue forward
+            sums, counts = [0.0] * self.fields, [0] * self.fields
+        offset = HEADER.size + position * self.window_state.size
+        self.window_state.pack_into(
+            self._map, offset, self.windows[position], tail, count, *sums, *counts
+        )
+
+    def _expire(self, position: int, min_ts: float, keep_from: int = 0):
+        """Drop readings at or before min_ts (or before index keep_from)."""
+        tail, count, sums, counts = self._read_window(position)
+        end = self._count()
+        while count and tail < end:
+            record = self._read(tail)
+            if record[0] > min_ts and tail >= keep_from:
+                break
+            for i, value in enumerate(record[1:]):
+                if not math.isnan(value):
+                    sums[i] -= value
+                    counts[i] -= 1
+            tail += 1
+            count -= 1
+        self._write_window(position, tail, count, sums, counts)
+
+    @property
+    def version(self) -> int:
+        """Number of readings ever appended; changes whenever the ring does."""
+        with self._locked(fcntl.LOCK_SH):
+            return self._count()
+
+    def append(self, ts: float, values) -> bool:
+        record = [float(ts)] + [math.nan if v is None else float(v) for v in values]
+        with self._locked(fcntl.LOCK_EX):
+            count = self._count()
+            if count and self._read(count - 1)[0] >= record[0]:
+                return False
+            if count >= self.capacity:
+                # The slot about to be reused must leave every window first
+                for position in range(len(self.windows)):
+                    self._expire(position, -math.inf, keep_from=count - self.capacity + 1)
+            offset = self.records_offset + (count % self.capacity) * self.record.size
+            self.record.pack_into(self._map, offset, *record)
+            HEADER.pack_into(
+                self._map,
+                0,
+                MAGIC,
+                self.fields,
+                self.capacity,
+                len(self.windows),
+                self.identity,
+                count + 1,
+            )
+            for position, window in enumerate(self.windows):
+                tail, window_count, sums, counts = self._read_window(position)
+                if window_count == 0:
+                    tail = count
+                for i, value in enumerate(record[1:]):
+                    if not math.isnan(value):
+                        sums[i] += value
+                        counts[i] += 1
+                self._write_window(position, tail, window_count + 1, sums, counts)
+                self._expire(position, record[0] - window)
+        return True
+
+    def aggregate(self, window: int, now: float):
+        """Averages (ignoring NaN, like SQL avg), count and newest ts of a window."""
+        position = self.windows.index(window)
+        with self._locked(fcntl.LOCK_EX):
+            self._expire(position, now - window)
+            _, count, sums, counts = self._read_window(position)
+            latest = self._read(self._count() - 1)[0] if count else None
+        averages = [s / c if c else None for s, c in zip(sums, counts)]
+        return averages, count, latest
+
+    def latest(self):
+        """The newest (ts, *fields) record, or None if the ring is empty."""
+        with self._locked(fcntl.LOCK_SH):
+            count = self._count()
+            return self._read(count - 1) if count else None
+
+    def first_after(self, min_ts: float):
+        """Timestamp of the oldest record with ts > min_ts, or None."""
+        with self._locked(fcntl.LOCK_SH):
+            count = self._count()
+            lo, hi = max(count - self.capacity, 0), count
+            while lo < hi:
+                middle = (lo + hi) // 2
+                if self._read(middle)[0] > min_ts:
+                    hi = middle
+                else:
+                    lo = middle + 1
+            return self._read(lo)[0] if lo < count else None
+
+    def since(self, min_ts: float):
+        """Records with ts > min_ts, oldest first."""
+        records = []
+        with self._locked(fcntl.LOCK_SH):
+            count = self._count()
+            for index in range(count - 1, max(count - self.capacity, 0) - 1, -1):
+                record = self._read(index)
+                if record[0] <= min_ts:
+                    break
+                records.append(record)
+        records.reverse()
+        return records
+
+    def clear(self):
+        """Forget every record, e.g. when the database it mirrors went back in time."""
+        with self._locked(fcntl.LOCK_EX):
+            self._initialise()
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class SharedCounter:
+    """A version number in a shared mmap, bumped whenever a table changes.
+
+    Used for tables that aren't mirrored in a ReadingRing, so other workers
+    can notice new rows without querying the database.
+    """
+
+    COUNTER = struct.Struct("<Q")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o660)
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != self.COUNTER.size:
+                    os.ftruncate(self._fd, self.COUNTER.size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.COUNTER.size)
+
+    def increment(self, by: int = 1):
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = self.COUNTER.unpack_from(self._map, 0)[0] + by
+                self.COUNTER.pack_into(self._map, 0, value)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
+
+    @property
+    def value(self) -> int:
+        # An aligned 8-byte read is atomic, which is all a version check needs
+        return self.COUNTER.unpack_from(self._map, 0)[0]
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
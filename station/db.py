@@ -0,0 +1,88 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Applied to every pooled connection. WAL lets readers run alongside the
+# writer, and synchronous=NORMAL only fsyncs at checkpoints in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionPool:
+    """A small pool of long-lived SQLite connections for one process.
+
+    Connections are opened lazily and handed to one thread at a time, so the
+    pool is safe under gunicorn's threaded workers. If the process forks after
+    the pool was created (e.g. `gunicorn --preload`), the child drops the
+    inherited connections and starts a fresh pool. sqlite3 keeps a prepared
+    statement cache per connection, so parameterized queries are compiled once
+    and reused for the life of the connection.
+    """
+
+    def __init__(self, db_path: str, size: int = 4, cached_statements: int = 128):
+        self.db_path = db_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.db_path,
+            timeout=5,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, returning it to the pool afterwards."""
+        if self._pid != os.getpid():
+            self._reset()
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            except sqlite3.Error:
+                # Don't hand a connection in an unknown state to the next caller.
+                connection.close()
+                raise
+            except BaseException:
+                connection.rollback()
+                self._idle.put(connection)
+                raise
+            else:
+                if connection.in_transaction:
+                    connection.rollback()
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def query(self, sql: str, params=()):
+        with self.connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
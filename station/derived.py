@@ -0,0 +1,154 @@
+"""Metrics derived from the raw readings, computed over whole arrays at once.
+
+Every function takes array-likes (None or NaN for missing values) and returns
+float arrays of the same length, so one call covers a single latest reading
+or thousands of history points alike. Temperatures are in degrees Celsius,
+humidity in %RH, pressure in hPa and particulates in ug/m3.
+"""
+import numpy as np
+
+# Magnus coefficients for water over -45..60 C (Sonntag 1990)
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12
+# Pressure tendency is reported as the change over this many seconds
+TENDENCY_PERIOD = 3 * 3600
+
+# US EPA AQI breakpoints (2024): lowest concentration of each category, its
+# highest, and the index range it maps to
+US_AQI_PM2_5 = (
+    (0.0, 9.0, 0, 50),
+    (9.1, 35.4, 51, 100),
+    (35.5, 55.4, 101, 150),
+    (55.5, 125.4, 151, 200),
+    (125.5, 225.4, 201, 300),
+    (225.5, 325.4, 301, 500),
+)
+US_AQI_PM10 = (
+    (0, 54, 0, 50),
+    (55, 154, 51, 100),
+    (155, 254, 101, 150),
+    (255, 354, 151, 200),
+    (355, 424, 201, 300),
+    (425, 604, 301, 500),
+)
+# European Air Quality Index (EEA, 2024) band upper limits; levels run from
+# 1 (good) to 6 (extremely poor)
+EU_AQI_PM2_5 = (5, 15, 50, 90, 140)
+EU_AQI_PM10 = (15, 45, 120, 195, 270)
+EU_AQI_LEVELS = ("good", "fair", "moderate", "poor", "very poor", "extremely poor")
+
+
+def as_array(values) -> np.ndarray:
+    # numpy reads None as NaN for float arrays
+    return np.asarray(values, dtype=np.float64)
+
+
+def to_list(values: np.ndarray) -> list:
+    """Plain floats for JSON, with NaN as None."""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def _vapour_pressure(temperature):
+    """Saturation vapour pressure (hPa)."""
+    return 6.112 * np.exp(MAGNUS_A * temperature / (MAGNUS_B + temperature))
+
+
+def dew_point(temperature, humidity):
+    gamma = np.log(humidity / 100) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+
+def absolute_humidity(temperature, humidity):
+    """Water vapour density (g/m3)."""
+    return _vapour_pressure(temperature) * humidity * 2.1674 / (273.15 + temperature)
+
+
+def heat_index(temperature, humidity):
+    """NWS heat index (Rothfusz regression with its adjustments), in C."""
+    t = temperature * 9 / 5 + 32
+    rh = humidity
+    simple = 0.5 * (t + 61 + (t - 68) * 1.2 + rh * 0.094)
+    full = (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * rh
+        - 0.22475541 * t * rh
+        - 0.00683783 * t * t
+        - 0.05481717 * rh * rh
+        + 0.00122874 * t * t * rh
+        + 0.00085282 * t * rh * rh
+        - 0.00000199 * t * t * rh * rh
+    )
+    with np.errstate(invalid="ignore"):
+        dry = (rh < 13) & (t >= 80) & (t <= 112)
+        full = full - np.where(
+            dry, (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17), 0
+        )
+        humid = (rh > 85) & (t >= 80) & (t <= 87)
+        full = full + np.where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+    result = np.where((simple + t) / 2 < 80, simple, full)
+    return (result - 32) * 5 / 9
+
+
+def _us_aqi(concentration, breakpoints, decimals):
+    scale = 10**decimals
+    # Concentrations are truncated to the breakpoints' precision first
+    c = np.floor(concentration * scale) / scale
+    lows = np.array([b[0] for b in breakpoints])
+    c = np.clip(c, 0, breakpoints[-1][1])
+    i = np.clip(np.searchsorted(lows, np.nan_to_num(c), side="right") - 1, 0, None)
+    c_low, c_high, i_low, i_high = (np.array(column)[i] for column in zip(*breakpoints))
+    aqi = np.round((i_high - i_low) / (c_high - c_low) * (c - c_low) + i_low)
+    return np.where(np.isnan(concentration), np.nan, aqi)
+
+
+def us_aqi(pm2_5, pm10):
+    """US EPA AQI, the worse of the PM2.5 and PM10 sub-indices.
+
+    The EPA defines it on 24-hour means; applied to shorter averages it is an
+    indication only.
+    """
+    return np.fmax(_us_aqi(pm2_5, US_AQI_PM2_5, 1), _us_aqi(pm10, US_AQI_PM10, 0))
+
+
+def eu_aqi(pm2_5, pm10):
+    """European Air Quality Index level (1-6), the worse of PM2.5 and PM10."""
+
+    def level(concentration, limits):
+        levels = np.digitize(concentration, limits, right=True) + 1.0
+        return np.where(np.isnan(concentration), np.nan, levels)
+
+    return np.fmax(level(pm2_5, EU_AQI_PM2_5), level(pm10, EU_AQI_PM10))
+
+
+def pressure_tendency(ts, pressure, period: float = TENDENCY_PERIOD):
+    """Change in pressure (hPa) over the preceding `period` at each point.
+
+    The earlier pressure is interpolated between readings; points less than
+    `period` after the first reading have no tendency.
+    """
+    valid = ~np.isnan(pressure)
+    if not valid.any():
+        return np.full_like(pressure, np.nan)
+    known_ts = ts[valid]
+    earlier = np.interp(ts - period, known_ts, pressure[valid])
+    return np.where(ts - period >= known_ts[0], pressure - earlier, np.nan)
+
+
+def weather_metrics(temperature, humidity, pressure=None, ts=None) -> dict:
+    """All weather metrics in one pass; the tendency needs ts and pressure."""
+    temperature, humidity = as_array(temperature), as_array(humidity)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        metrics = {
+            "dew_point": dew_point(temperature, humidity),
+            "heat_index": heat_index(temperature, humidity),
+            "absolute_humidity": absolute_humidity(temperature, humidity),
+        }
+    if ts is not None and pressure is not None:
+        metrics["pressure_tendency"] = pressure_tendency(as_array(ts), as_array(pressure))
+    return metrics
+
+
+def air_metrics(pm2_5, pm10) -> dict:
+    pm2_5, pm10 = as_array(pm2_5), as_array(pm10)
+    return {"aqi_us": us_aqi(pm2_5, pm10), "aqi_eu": eu_aqi(pm2_5, pm10)}
@@ -0,0 +1,97 @@
+"""Encode batches of rows as CSV, NDJSON, Arrow IPC or Parquet, as they arrive.
+
+Every encoder is a generator of bytes that consumes one batch of rows at a
+time, so an export of any length only ever holds a single batch in memory.
+Arrow and Parquet need the optional pyarrow package.
+"""
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def available(format: str) -> bool:
+    return format in MIMETYPES and (format in ("csv", "ndjson") or pa is not None)
+
+
+def _csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson(columns, batches):
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n" for row in rows
+        ).encode()
+
+
+def _schema(columns):
+    types = {"id": pa.string(), "count": pa.int64()}
+    return pa.schema([(column, types.get(column, pa.float64())) for column in columns])
+
+
+def _record_batch(schema, rows):
+    arrays = [
+        pa.array(values, type=field.type) for field, values in zip(schema, zip(*rows))
+    ]
+    return pa.record_batch(arrays, schema=schema)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def _arrow(columns, batches):
+    schema = _schema(columns)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            if rows:
+                writer.write_batch(_record_batch(schema, rows))
+                yield _drain(sink)
+    yield _drain(sink)
+
+
+def _parquet(columns, batches):
+    # Each batch becomes a row group; the writer only ever appends, so the
+    # file can be sent as it is written and the footer follows at the end.
+    schema = _schema(columns)
+    sink = io.BytesIO()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in batches:
+            if rows:
+                writer.write_batch(_record_batch(schema, rows))
+                yield _drain(sink)
+    yield _drain(sink)
+
+
+ENCODERS = {"csv": _csv, "ndjson": _ndjson, "arrow": _arrow, "parquet": _parquet}
+
+
+def encode(format: str, columns, batches):
+    """Bytes of `batches` (iterables of row tuples) in the given format."""
+    return ENCODERS[format](tuple(columns), batches)
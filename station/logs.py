@@ -0,0 +1,161 @@
+"""JSON logging for both services, written off the calling thread.
+
+Loggers hand records to a QueueHandler; a QueueListener thread does the JSON
+encoding and the write to stdout, so a request or sampling loop only pays
+for building the record. Messages should use %-style arguments so that
+records below the logger's level are never formatted at all.
+
+On the calling side a RateLimitFilter lets each log call site through a
+burst of records per interval and drops the rest, reporting the number
+dropped on the next record it lets through. Records also pick up the
+current trace id, set with `trace()`; the logger uses the reading id, and
+sends it on to the server, so one reading can be followed from sampling to
+the server and MQTT.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Records from one call site allowed per interval before the rest are dropped
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_INTERVAL = 60
+# Header carrying the trace id between services
+TRACE_HEADER = "X-Trace-Id"
+
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+@contextmanager
+def trace(id: str):
+    """Tag records logged in this context (and threads started from it) with `id`."""
+    token = trace_id.set(id)
+    try:
+        yield
+    finally:
+        trace_id.reset(token)
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+        log_data = {
+            "timestamp": f"{timestamp}.{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "service": self.service,
+            "message": record.getMessage(),
+            "logger": record.name,
+        }
+        trace = getattr(record, "trace_id", None)
+        if trace is not None:
+            log_data["trace_id"] = trace
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            log_data["suppressed"] = suppressed
+        if record.exc_info:
+            log_data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_data)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let `burst` records per call site through each `interval` seconds.
+
+    Errors and above always pass. Also stamps each record with the trace id.
+    """
+
+    def __init__(self, burst: int = RATE_LIMIT_BURST, interval: float = RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, records let through, records dropped]
+        self._sites = {}
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= self.interval:
+                dropped = site[2] if site is not None else 0
+                self._sites[key] = [record.created, 1, 0]
+                record.suppressed = dropped
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                record.suppressed = site[2]
+                site[2] = 0
+                return True
+            site[2] += 1
+            return False
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that owns its listener thread.
+
+    A listener thread doesn't survive a fork (e.g. `gunicorn --preload`), so
+    the first record in a new process starts a fresh one.
+    """
+
+    def __init__(self, *handlers):
+        super().__init__(queue.SimpleQueue())
+        self.targets = handlers
+        self._start()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.targets, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record needs no pickling
+        # and its message is formatted on the listener thread too
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.queue = queue.SimpleQueue()
+            self._start()
+        super().emit(record)
+
+    def close(self):
+        if self._pid == os.getpid() and self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+def setup_logging(service: str, level: int = logging.INFO) -> logging.Logger:
+    """Send the root logger's records, as JSON lines, to stdout from a background thread.
+
+    Calling it again (e.g. with both services loaded in one process) replaces
+    the previous handler rather than duplicating every line.
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter(service))
+    handler = BackgroundHandler(stream)
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, BackgroundHandler):
+            root.removeHandler(existing)
+            existing.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.close)
+    return root
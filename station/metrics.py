@@ -0,0 +1,311 @@
+"""Counters, histograms and gauges exported in the Prometheus text format.
+
+Recording is an in-memory update under a lock; nothing is formatted until a
+scrape. A disabled Registry still hands out metrics, but `timed` returns the
+function it wraps unchanged and every other update returns at once, so
+instrumentation can stay in the hot paths.
+
+Gunicorn workers each record into their own Registry. Given a `shared` path
+template, each process periodically writes its counters and histograms to
+its own file and a scrape of any worker sums them all, so /metrics reports
+the whole server whichever worker answers. A process removes its file when
+it exits, and files left by processes that died are removed at the next
+scrape, so a restarted worker's counts aren't added in forever. Gauges, and counters kept
+elsewhere, are read by a callback at scrape time and are not shared.
+"""
+import atexit
+import bisect
+import functools
+import glob
+import http.server
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) sized for SQLite queries on a Pi up to slow sensor reads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, registry, name: str, help: str, labels=(), collect=None):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Read at scrape time instead of recorded: returns {label values: value},
+        # or a bare number when there are no labels
+        self.collect = collect
+        # label values -> state
+        self.values = {}
+
+    def state(self) -> dict:
+        with self.registry.lock:
+            return {json.dumps(key): self._copy(value) for key, value in self.values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, by: float = 1):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + by
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, values):
+        for key, value in values.items():
+            yield f"{self.name}_total{_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *labels):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # per-bucket (not cumulative) counts, then sum
+                state = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _copy(self, value):
+        return list(value)
+
+    def merge(self, total, value):
+        if len(value) != len(self.buckets) + 1:
+            # written by a process with different buckets
+            return total
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, values):
+        for key, state in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_format_value(state[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def samples(self, values):
+        for key, value in values.items():
+            if value is not None:
+                yield f"{self.name}{_labels(self.labels, key)} {_format_value(value)}"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self, enabled: bool = True, shared: str = None, share_interval: float = 5):
+        """`shared` is a file path containing `{pid}`, for multi-process export."""
+        self.enabled = enabled
+        self.shared = shared
+        self.share_interval = share_interval
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels=(), collect=None) -> Counter:
+        return self._add(Counter(self, name, help, labels, collect))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, collect, labels=()) -> Gauge:
+        return self._add(Gauge(self, name, help, labels, collect))
+
+    def timed(self, histogram: Histogram):
+        """Decorator observing each call's duration, labelled with the function name."""
+
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, func.__name__)
+
+            return wrapper
+
+        return decorator
+
+    def _snapshot(self) -> dict:
+        return {
+            name: metric.state()
+            for name, metric in self.metrics.items()
+            if metric.collect is None
+        }
+
+    def share(self):
+        """Write this process's counters and histograms for the other workers."""
+        path = self.shared.format(pid=os.getpid())
+        partial = f"{path}.partial"
+        with open(partial, "w") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(partial, path)
+
+    def unshare(self):
+        """Remove this process's shared file, e.g. as it exits."""
+        try:
+            os.remove(self.shared.format(pid=os.getpid()))
+        except FileNotFoundError:
+            pass
+
+    def start_sharing(self):
+        if not (self.enabled and self.shared):
+            return
+        atexit.register(self.unshare)
+
+        def loop():
+            while True:
+                time.sleep(self.share_interval)
+                try:
+                    self.share()
+                except OSError as e:
+                    logger.warning("Could not share metrics: %s", e)
+
+        threading.Thread(target=loop, name="metrics", daemon=True).start()
+
+    def _collected(self) -> dict:
+        """Counter and histogram states of every process, summed."""
+        if not self.shared:
+            snapshots = [self._snapshot()]
+        else:
+            self.share()
+            snapshots = []
+            prefix, suffix = self.shared.split("{pid}")
+            for path in glob.glob(self.shared.format(pid="*")):
+                if path.endswith(".partial"):
+                    continue
+                pid = path[len(prefix) : len(path) - len(suffix)]
+                if pid.isdigit() and not _alive(int(pid)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        totals = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                merged = totals.setdefault(name, {})
+                for key, value in values.items():
+                    key = tuple(json.loads(key))
+                    merged[key] = metric.merge(merged.get(key), value)
+        return totals
+
+    def render(self) -> str:
+        totals = self._collected()
+        lines = []
+        for name, metric in self.metrics.items():
+            if metric.collect is not None:
+                try:
+                    values = metric.collect()
+                except Exception:
+                    logger.exception("Collecting %s failed", name)
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+            else:
+                values = totals.get(name, {})
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry: Registry, port: int, host: str = "0.0.0.0"):
+    """Serve /metrics from a daemon thread, for processes without a web server."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
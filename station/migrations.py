@@ -0,0 +1,236 @@
+"""Versioned schema migrations for the weather-logger and weather-server databases.
+
+The schema version is kept in `PRAGMA user_version`. Each migration runs in its
+own transaction, so a database can be upgraded in place from any earlier
+version, including databases created before versioning existed (version 0).
+
+Run by hand with:
+    python -m station.migrations server db/weather-server.db
+    python -m station.migrations logger db/weather-logger.db
+"""
+import logging
+import random
+import sqlite3
+import sys
+import uuid
+from collections import namedtuple
+
+from station import birds, blocks, outbox, rollups, sync
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple("Migration", ["version", "description", "apply"])
+
+READING_TABLES = {
+    "thp_readings": ("temperature", "humidity", "pressure"),
+    "air_quality_readings": ("pm1", "pm2_5", "pm10"),
+}
+
+# Per-interval statistics the logger stores alongside each averaged reading
+SAMPLE_STATS = ("min", "max", "std")
+
+
+def sample_stat_columns(fields) -> tuple:
+    return tuple(f"{f}_{stat}" for f in fields for stat in SAMPLE_STATS) + ("samples",)
+
+
+# Original (unversioned) table layouts, as created by initiate_tables
+BASE_COLUMNS = {
+    "thp_readings": "id text, ts integer, temperature real, humidity real, pressure real",
+    "air_quality_readings": "id text, ts integer, pm1 real, pm2_5 real, pm10 real",
+    "bird_observations": "id text, ts integer, scientific_name text, common_name text, confidence real",
+}
+
+
+def table_exists(connection, name: str) -> bool:
+    row = connection.execute(
+        "select 1 from sqlite_master where type = 'table' and name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _create_base_tables(tables):
+    def apply(connection):
+        for table in tables:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({BASE_COLUMNS[table]})"
+            )
+
+    return apply
+
+
+def _import_legacy_readings(connection):
+    """Split the pre-0.2 combined `readings` table into the per-sensor tables."""
+    if not table_exists(connection, "readings"):
+        return
+    for table, fields in READING_TABLES.items():
+        columns = ", ".join(("id", "ts") + fields)
+        connection.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM readings"
+        )
+
+
+def _uuid7(ts: float) -> str:
+    """A uuid7 string for a reading taken at ts (with random low bits)."""
+    value = (int(ts * 1000) & (1 << 48) - 1) << 80 | random.getrandbits(80)
+    value = value & ~(0xF << 76) | 7 << 76  # version
+    value = value & ~(0x3 << 62) | 0x2 << 62  # RFC 4122 variant
+    return str(uuid.UUID(int=value))
+
+
+def _cluster_reading_tables(connection):
+    """Rebuild the reading tables clustered on (ts, id).
+
+    As WITHOUT ROWID tables the rows are stored in ts order, so `max(ts)` and
+    `ts > ?` range scans are b-tree seeks rather than full table scans. The
+    unique index on id deduplicates re-sent readings.
+
+    Old rows could have no id (NULL, or the text 'None' written by the
+    original inserts) or share one with a different reading; those get a new
+    uuid7 for their ts rather than being lost. Exact repeats of a reading
+    and rows without a ts can't be kept, and are counted in the log.
+    """
+    for table, fields in READING_TABLES.items():
+        field_columns = ", ".join(f"{field} real" for field in fields)
+        columns = ", ".join(("id", "ts") + fields)
+        placeholders = ", ".join("?" for _ in ("id", "ts") + fields)
+        connection.execute(f"ALTER TABLE {table} RENAME TO {table}_unclustered")
+        connection.execute(
+            f"""CREATE TABLE {table} (
+                id text NOT NULL,
+                ts integer NOT NULL,
+                {field_columns},
+                PRIMARY KEY (ts, id)
+            ) WITHOUT ROWID"""
+        )
+        connection.execute(f"CREATE UNIQUE INDEX {table}_id ON {table} (id)")
+        connection.execute(
+            f"""INSERT OR IGNORE INTO {table} ({columns})
+            SELECT {columns} FROM {table}_unclustered
+            WHERE id IS NOT NULL AND id NOT IN ('', 'None') ORDER BY ts"""
+        )
+        unplaced = connection.execute(
+            f"""SELECT {columns} FROM {table}_unclustered AS old
+            WHERE ts IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM {table} AS new WHERE new.id = old.id AND new.ts = old.ts
+            )"""
+        ).fetchall()
+        connection.executemany(
+            f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+            [(_uuid7(row[1]),) + row[1:] for row in unplaced],
+        )
+        total = connection.execute(f"SELECT count(*) FROM {table}_unclustered").fetchone()[0]
+        kept = connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        if unplaced:
+            logger.warning("Gave %d %s rows without a unique id new ids", len(unplaced), table)
+        if kept < total:
+            logger.warning(
+                "Dropped %d %s rows that repeated a reading or had no ts", total - kept, table
+            )
+        connection.execute(f"DROP TABLE {table}_unclustered")
+
+
+def _index_bird_observations(connection):
+    # Covers both the recent (ts range, confidence filter, group by name) and
+    # latest (max(ts)) bird queries without touching the table itself.
+    connection.execute(
+        """CREATE INDEX IF NOT EXISTS bird_observations_ts_confidence_name
+        ON bird_observations (ts, confidence, common_name)"""
+    )
+
+
+def _create_rollups(connection):
+    for table, fields in READING_TABLES.items():
+        rollups.create_rollup_tables(connection, table, fields)
+
+
+def _create_reading_blocks(connection):
+    for table in READING_TABLES:
+        blocks.create_block_table(connection, table)
+
+
+def _add_sample_stats(connection):
+    for table, fields in READING_TABLES.items():
+        for column in sample_stat_columns(fields):
+            kind = "integer" if column == "samples" else "real"
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+
+def _create_database_identity(connection):
+    # A random token that stays with this database file, so caches of it can
+    # tell when the file at the same path is a different database
+    connection.execute("CREATE TABLE database_identity (token text NOT NULL)")
+    connection.execute("INSERT INTO database_identity VALUES (?)", (uuid.uuid4().hex,))
+
+
+def _drop_http_outbox(connection):
+    # Readings the server missed are now sent by the watermark sync from the
+    # reading tables, so the HTTP outbox would only deliver them twice
+    connection.execute("DELETE FROM outbox WHERE sink = 'http'")
+
+
+LOGGER_MIGRATIONS = [
+    Migration(1, "Create base tables", _create_base_tables(READING_TABLES)),
+    Migration(2, "Import legacy readings table", _import_legacy_readings),
+    Migration(3, "Cluster reading tables on (ts, id)", _cluster_reading_tables),
+    Migration(4, "Create delivery outbox", outbox.create_outbox_table),
+    Migration(5, "Add per-interval sample statistics", _add_sample_stats),
+    Migration(6, "Drop HTTP outbox entries replaced by sync", _drop_http_outbox),
+]
+
+SERVER_MIGRATIONS = [
+    Migration(1, "Create base tables", _create_base_tables(BASE_COLUMNS)),
+    Migration(2, "Import legacy readings table", _import_legacy_readings),
+    Migration(3, "Cluster reading tables on (ts, id)", _cluster_reading_tables),
+    Migration(4, "Index bird observations", _index_bird_observations),
+    Migration(5, "Create reading rollups", _create_rollups),
+    Migration(6, "Key bird sightings on a species dictionary", birds.create_bird_tables),
+    Migration(7, "Create sync watermarks", sync.create_watermark_table),
+    Migration(8, "Create compressed reading blocks", _create_reading_blocks),
+    Migration(9, "Index bird sighting ids", birds.index_sighting_ids),
+    Migration(10, "Record a database identity", _create_database_identity),
+]
+
+
+def schema_version(connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str, migrations) -> int:
+    """Apply any pending migrations to the database and return its version."""
+    connection = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        for migration in migrations:
+            # Lock before checking the version so concurrent workers starting
+            # up at the same time apply each migration exactly once.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(connection) >= migration.version:
+                    connection.execute("COMMIT")
+                    continue
+                logger.info(
+                    "Applying migration %d: %s", migration.version, migration.description
+                )
+                migration.apply(connection)
+                connection.execute(f"PRAGMA user_version = {migration.version:d}")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return schema_version(connection)
+    finally:
+        connection.close()
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ("server", "logger"):
+        print("usage: python -m station.migrations {server|logger} DB_PATH")
+        return 2
+    migrations = SERVER_MIGRATIONS if argv[1] == "server" else LOGGER_MIGRATIONS
+    version = migrate(argv[2], migrations)
+    print(f"{argv[2]} is at schema version {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
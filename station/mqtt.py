@@ -0,0 +1,139 @@
+"""A long-lived MQTT connection that publishes without waiting for each ack.
+
+paho's network loop runs in a background thread and reconnects with backoff
+on its own. The broker holds a last will that marks the device offline if
+the connection drops without a clean disconnect, and every (re)connect
+publishes the online state and runs `on_connect`, e.g. to repeat Home
+Assistant discovery after a broker restart.
+
+`publish` only queues a message; up to `max_inflight` QoS 1 messages are
+on the wire at once, and their acks are matched up in paho's thread to
+measure publish latency.
+"""
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+
+class MQTTPublisher:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        client_id: str,
+        availability_topic: str,
+        on_connect=None,
+        on_ack=None,
+        keepalive: int = 60,
+        max_inflight: int = 20,
+    ):
+        """`on_connect(publisher)` runs after every connect; `on_ack(seconds)`
+        gets the latency of every acknowledged publish."""
+        self.host = host
+        self.port = port
+        self.availability_topic = availability_topic
+        self.on_connect = on_connect
+        self.on_ack = on_ack
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        # mid -> time published, for messages queued or sent and not yet
+        # acknowledged (paho holds back all but max_inflight of them)
+        self._pending = {}
+        # acks that arrived before publish() had recorded the mid
+        self._early_acks = set()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id)
+        self.client.will_set(availability_topic, "offline", qos=1, retain=True)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=120)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+
+    @property
+    def connected(self) -> bool:
+        return self.client.is_connected()
+
+    @property
+    def pending(self) -> int:
+        """Messages queued in paho or on the wire, and not yet acknowledged."""
+        return len(self._pending)
+
+    def start(self):
+        """Connect in the background; paho retries until the broker is reachable."""
+        self.client.connect_async(self.host, self.port, keepalive=self.keepalive)
+        self.client.loop_start()
+
+    def stop(self, timeout: float = 5):
+        """Mark the device offline and disconnect cleanly, so the will isn't sent."""
+        if self.connected:
+            info = self.publish(self.availability_topic, "offline", retain=True)
+            info.wait_for_publish(timeout=timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error("Failed to connect to MQTT broker at %s:%s: %s", self.host, self.port, reason_code)
+            return
+        logger.info("Connected to MQTT broker at %s:%s", self.host, self.port)
+        self.publish(self.availability_topic, "online", retain=True)
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
+            logger.info("Disconnected from MQTT broker.")
+            return
+        logger.warning(
+            "Lost the MQTT broker (%s) with %d messages unacknowledged, reconnecting.",
+            reason_code,
+            len(self._pending),
+        )
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        # paho calls this holding its own message lock, which publish() needs,
+        # so this must never wait on publish()
+        now = time.perf_counter()
+        with self._lock:
+            published = self._pending.pop(mid, None)
+            if published is None:
+                self._early_acks.add(mid)
+                return
+        if self.on_ack is not None:
+            self.on_ack(now - published)
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = False):
+        """Queue a message and return its paho MQTTMessageInfo without waiting."""
+        published = time.perf_counter()
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if qos == 0:
+            return info
+        with self._lock:
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                acked = True
+            else:
+                self._pending[info.mid] = published
+                acked = False
+        if acked and self.on_ack is not None:
+            self.on_ack(time.perf_counter() - published)
+        return info
+
+    def publish_many(self, messages, qos: int = 1, timeout: float = 10):
+        """Publish (topic, payload) pairs back to back, then wait for every ack.
+
+        Raises RuntimeError if disconnected or if any ack is still missing
+        after `timeout` seconds.
+        """
+        if not self.connected:
+            raise RuntimeError("Not connected to the MQTT broker")
+        infos = [self.publish(topic, payload, qos=qos) for topic, payload in messages]
+        deadline = time.monotonic() + timeout
+        for info in infos:
+            info.wait_for_publish(timeout=max(0.0, deadline - time.monotonic()))
+            if not info.is_published():
+                raise RuntimeError("Timed out waiting for the MQTT broker to acknowledge")
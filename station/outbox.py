@@ -0,0 +1,137 @@
+"""Durable store-and-forward outbox for readings a sink failed to accept.
+
+Undelivered readings are kept in the `outbox` table of the logger database
+and replayed in batches once the sink recovers, backing off exponentially
+while it stays down. Each sink is capped at `max_rows`; beyond that the oldest
+readings are dropped so an outage can't fill the SD card.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def create_outbox_table(connection):
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+            seq integer PRIMARY KEY,
+            sink text NOT NULL,
+            kind text NOT NULL,
+            payload text NOT NULL,
+            created real NOT NULL
+        )"""
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS outbox_sink_seq ON outbox (sink, seq)")
+
+
+class Outbox:
+    def __init__(self, db_path: str, max_rows: int = 20000):
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self.stats = {}
+
+    def _sink_stats(self, sink: str) -> dict:
+        return self.stats.setdefault(
+            sink, {"queued": 0, "delivered": 0, "dropped": 0, "catch_up_rate": None}
+        )
+
+    def add(self, sink: str, kind: str, reading: dict, latest_only: bool = False):
+        """Store a reading for later delivery.
+
+        With latest_only, any reading of the same kind already waiting is
+        replaced, for sinks where only the current value matters.
+        """
+        with self._lock, self._connection as connection:
+            if latest_only:
+                connection.execute(
+                    "DELETE FROM outbox WHERE sink = ? AND kind = ?", (sink, kind)
+                )
+            connection.execute(
+                "INSERT INTO outbox (sink, kind, payload, created) VALUES (?, ?, ?, ?)",
+                (sink, kind, json.dumps(reading), time.time()),
+            )
+            dropped = connection.execute(
+                """DELETE FROM outbox WHERE sink = ? AND seq <= (
+                    SELECT seq FROM outbox WHERE sink = ? ORDER BY seq DESC LIMIT 1 OFFSET ?
+                )""",
+                (sink, sink, self.max_rows),
+            ).rowcount
+        stats = self._sink_stats(sink)
+        stats["queued"] += 1
+        stats["dropped"] += dropped
+        if dropped:
+            logger.warning("Outbox for %s is full, dropped %d oldest readings.", sink, dropped)
+
+    def peek(self, sink: str, limit: int):
+        """The oldest waiting (seq, kind, reading) entries for a sink."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT seq, kind, payload FROM outbox WHERE sink = ? ORDER BY seq LIMIT ?",
+                (sink, limit),
+            ).fetchall()
+        return [(seq, kind, json.loads(payload)) for seq, kind, payload in rows]
+
+    def ack(self, sink: str, seqs):
+        with self._lock, self._connection as connection:
+            connection.executemany(
+                "DELETE FROM outbox WHERE sink = ? AND seq = ?", [(sink, s) for s in seqs]
+            )
+        self._sink_stats(sink)["delivered"] += len(seqs)
+
+    def depth(self, sink: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT count(*) FROM outbox WHERE sink = ?", (sink,)
+            ).fetchone()[0]
+
+    async def drain(self, sink: str, deliver, batch_size: int = 500, poll: float = 5, max_backoff: float = 300):
+        """Replay a sink's backlog forever.
+
+        `deliver(entries)` is called in a worker thread with up to batch_size
+        (seq, kind, reading) entries and must raise if the sink rejects them.
+        """
+        backoff = poll
+        catch_up_start, caught_up = None, 0
+        while True:
+            entries = await asyncio.to_thread(self.peek, sink, batch_size)
+            if not entries:
+                if catch_up_start is not None:
+                    elapsed = time.monotonic() - catch_up_start
+                    rate = caught_up / elapsed if elapsed else None
+                    self._sink_stats(sink)["catch_up_rate"] = rate
+                    logger.info(
+                        "Outbox for %s caught up, replayed %d readings in %.1fs.",
+                        sink,
+                        caught_up,
+                        elapsed,
+                    )
+                    catch_up_start, caught_up = None, 0
+                await asyncio.sleep(poll)
+                continue
+            if catch_up_start is None:
+                catch_up_start = time.monotonic()
+            try:
+                await asyncio.to_thread(deliver, entries)
+            except Exception as e:
+                logger.info(
+                    "Replaying outbox to %s failed (%s), retrying in %.0fs.",
+                    sink,
+                    type(e).__name__,
+                    backoff,
+                )
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+                continue
+            await asyncio.to_thread(self.ack, sink, [entry[0] for entry in entries])
+            caught_up += len(entries)
+            backoff = poll
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
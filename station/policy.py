@@ -0,0 +1,61 @@
+"""Decide which readings are worth publishing as Home Assistant state.
+
+Each published state stays current until a field moves past its deadband,
+so MQTT traffic (and the Home Assistant recorder) follows how much the
+readings change rather than how often they are sampled. Deadbands are
+measured from the last published value, not the last reading, so slow
+drift is still published once it adds up.
+"""
+
+
+class PublishPolicy:
+    """Publish a change at most every `min_interval` seconds, and the current
+    state at least every `max_interval` seconds while readings arrive.
+
+    A change that arrives inside `min_interval` is held and becomes due at
+    `flush_at()`, so it is published even if no further reading comes.
+    Times are monotonic seconds.
+    """
+
+    def __init__(self, deadbands: dict, min_interval: float, max_interval: float):
+        self.deadbands = deadbands
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.published = None
+        self.published_at = None
+        # Latest values not yet published
+        self.pending = None
+
+    def _changed(self) -> bool:
+        for field, deadband in self.deadbands.items():
+            new, old = self.pending[field], self.published[field]
+            if (new is None) != (old is None):
+                return True
+            if new is not None and abs(new - old) >= deadband:
+                return True
+        return False
+
+    def offer(self, reading: dict, now: float):
+        """Take a reading; returns the state to publish now, or None."""
+        self.pending = {field: reading.get(field) for field in self.deadbands}
+        return self.poll(now)
+
+    def poll(self, now: float):
+        """The state to publish now, or None if nothing is due."""
+        if self.pending is None:
+            return None
+        if self.published is not None:
+            elapsed = now - self.published_at
+            if elapsed < self.min_interval:
+                return None
+            if elapsed < self.max_interval and not self._changed():
+                return None
+        state = self.pending
+        self.published, self.published_at, self.pending = state, now, None
+        return state
+
+    def flush_at(self):
+        """When a held change becomes due, or None if nothing is held."""
+        if self.pending is None or self.published is None or not self._changed():
+            return None
+        return self.published_at + self.min_interval
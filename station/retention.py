@@ -0,0 +1,152 @@
+"""Retention policies: prune aged rows, archiving them first, and reclaim the space.
+
+Rows are pruned a calendar month at a time, once the whole month is older
+than the policy allows, so each archive file holds exactly one month. Freed
+pages are returned to the filesystem with incremental vacuum rather than a
+full VACUUM, which would rewrite the whole database on the SD card.
+
+Incremental vacuum needs the database switched over with one full VACUUM,
+which holds the write lock for as long as it takes, so that is a manual step
+run while the services are stopped:
+    python -m station.retention vacuum db/weather-server.db
+Until then, pruning still frees pages for reuse but the file doesn't shrink.
+"""
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+from station import archive
+
+logger = logging.getLogger(__name__)
+
+# days=None keeps the table forever. If archive_columns is set, those columns
+# (which must include "ts") are archived before rows are deleted. `where`
+# limits the policy to matching rows, e.g. one resolution of a counter table.
+RetentionPolicy = namedtuple(
+    "RetentionPolicy", ["table", "ts_column", "days", "archive_columns", "where"],
+    defaults=(None,),
+)
+
+
+def cutoff(policy: RetentionPolicy, now: float):
+    """Rows older than this may be pruned, or None if they are kept forever."""
+    return None if policy.days is None else now - policy.days * 86400
+
+
+def incremental_vacuum_enabled(connection) -> bool:
+    return connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(connection):
+    """Switch the database to incremental auto-vacuum, once.
+
+    The mode only takes effect after a full VACUUM (outside a transaction),
+    which rewrites the whole file; later calls are a pragma check.
+    """
+    if incremental_vacuum_enabled(connection):
+        return
+    logger.info("Enabling incremental vacuum, rebuilding the database once")
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+
+
+def prune(connection, policy: RetentionPolicy, now: float, directory: str) -> int:
+    """Archive (if the policy says so) and delete the whole months past its cutoff."""
+    limit = cutoff(policy, now)
+    if limit is None:
+        return 0
+    table, ts_column = policy.table, policy.ts_column
+    where = "" if policy.where is None else f" AND ({policy.where})"
+    removed = 0
+    while True:
+        oldest = connection.execute(
+            f"SELECT min({ts_column}) FROM {table} WHERE 1{where}"
+        ).fetchone()[0]
+        if oldest is None:
+            return removed
+        start, end = archive.month_bounds(oldest)
+        if end > limit:
+            return removed
+        # Lock out writers so nothing lands in the month between copy and delete
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if policy.archive_columns:
+                rows = connection.execute(
+                    f"""SELECT {', '.join(policy.archive_columns)} FROM {table}
+                    WHERE {ts_column} >= ? AND {ts_column} < ?{where}""",
+                    (start, end),
+                ).fetchall()
+                archive.write_month(
+                    archive.month_path(directory, table, start), policy.archive_columns, rows
+                )
+            removed += connection.execute(
+                f"DELETE FROM {table} WHERE {ts_column} >= ? AND {ts_column} < ?{where}",
+                (start, end),
+            ).rowcount
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def enforce(db_path: str, policies, now: float = None) -> dict:
+    """Apply every policy to the database, then return freed pages to the filesystem."""
+    now = time.time() if now is None else now
+    directory = archive.archive_dir(db_path)
+    connection = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        vacuum = incremental_vacuum_enabled(connection)
+        if not vacuum:
+            logger.warning(
+                "Incremental vacuum is off for %s, so pruned space is not returned; "
+                "run `python -m station.retention vacuum %s` with the services stopped",
+                db_path,
+                db_path,
+            )
+        removed = {
+            policy.table: prune(connection, policy, now, directory) for policy in policies
+        }
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0] if vacuum else 0
+        if free_pages:
+            # executescript steps the pragma to completion; execute() would
+            # free a single page
+            connection.executescript("PRAGMA incremental_vacuum")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        connection.execute("PRAGMA optimize")
+    finally:
+        connection.close()
+    logger.info(
+        "Retention on %s: removed %s; reclaimed %d pages",
+        db_path,
+        ", ".join(f"{count} from {table}" for table, count in removed.items()),
+        free_pages,
+    )
+    return {"removed": removed, "reclaimed_pages": free_pages}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Switch a database to incremental vacuum (a one-off full VACUUM)."
+    )
+    parser.add_argument("command", choices=["vacuum"])
+    parser.add_argument("db_path")
+    args = parser.parse_args(argv[1:])
+    connection = sqlite3.connect(args.db_path, isolation_level=None, timeout=30)
+    try:
+        if incremental_vacuum_enabled(connection):
+            print(f"{args.db_path}: incremental vacuum is already on")
+            return 0
+        before = connection.execute("PRAGMA page_count").fetchone()[0]
+        enable_incremental_vacuum(connection)
+        after = connection.execute("PRAGMA page_count").fetchone()[0]
+        print(f"{args.db_path}: incremental vacuum on, {before} -> {after} pages")
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,101 @@
+"""Downsampled min/max/avg rollups of the reading tables.
+
+Each reading table has one rollup table per resolution, e.g. thp_readings_5m,
+keyed on the integer bucket start so rows are stored in time order. Rollups
+are updated with an upsert in the same transaction as the raw insert, and the
+history query picks the finest resolution that fits a point budget.
+"""
+from functools import lru_cache
+
+# Nominal spacing of raw readings, used to estimate how many a range holds
+RAW_INTERVAL = 60
+
+RESOLUTIONS = {300: "5m", 3600: "1h", 86400: "1d"}
+
+
+def rollup_table(table: str, resolution: int) -> str:
+    return f"{table}_{RESOLUTIONS[resolution]}"
+
+
+def create_rollup_tables(connection, table: str, fields):
+    """Create and backfill the rollup tables for one reading table."""
+    columns = ", ".join(
+        f"{f}_min real, {f}_max real, {f}_sum real, {f}_n integer" for f in fields
+    )
+    aggregates = ", ".join(
+        f"min({f}), max({f}), total({f}), count({f})" for f in fields
+    )
+    for resolution in RESOLUTIONS:
+        name = rollup_table(table, resolution)
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (bucket integer PRIMARY KEY, count integer NOT NULL, {columns})"
+        )
+        connection.execute(
+            f"""INSERT OR REPLACE INTO {name}
+            SELECT cast(ts / {resolution} AS integer) * {resolution}, count(*), {aggregates}
+            FROM {table} GROUP BY 1"""
+        )
+
+
+@lru_cache(maxsize=None)
+def _upsert_query(table: str, fields, resolution: int) -> str:
+    name = rollup_table(table, resolution)
+    columns = ", ".join(f"{f}_min, {f}_max, {f}_sum, {f}_n" for f in fields)
+    placeholders = ", ".join("?" for _ in range(2 + 4 * len(fields)))
+    updates = ", ".join(
+        f"""{f}_min = min(coalesce({f}_min, excluded.{f}_min), coalesce(excluded.{f}_min, {f}_min)),
+        {f}_max = max(coalesce({f}_max, excluded.{f}_max), coalesce(excluded.{f}_max, {f}_max)),
+        {f}_sum = {f}_sum + excluded.{f}_sum,
+        {f}_n = {f}_n + excluded.{f}_n"""
+        for f in fields
+    )
+    return f"""INSERT INTO {name} (bucket, count, {columns}) VALUES ({placeholders})
+    ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count, {updates}"""
+
+
+def add_readings(connection, table: str, fields, readings):
+    """Fold (ts, values) readings into every rollup of their table."""
+    rows = {resolution: [] for resolution in RESOLUTIONS}
+    for ts, values in readings:
+        stats = []
+        for value in values:
+            stats += [value, value, value or 0.0, 0 if value is None else 1]
+        for resolution, bucket_rows in rows.items():
+            bucket_rows.append([int(ts // resolution) * resolution, 1] + stats)
+    for resolution, bucket_rows in rows.items():
+        connection.executemany(_upsert_query(table, fields, resolution), bucket_rows)
+
+
+def pick_resolution(start: float, end: float, points: int):
+    """The finest resolution (None for raw rows) with at most `points` buckets."""
+    span = max(end - start, 0)
+    if span / RAW_INTERVAL <= points:
+        return None
+    for resolution in RESOLUTIONS:
+        if span / resolution <= points:
+            return resolution
+    return max(RESOLUTIONS)
+
+
+def history(connection, table: str, fields, start: float, end: float, resolution):
+    """Rows of (ts, count, (avg, min, max) per field) between start and end."""
+    if resolution is None:
+        columns = ", ".join(fields)
+        rows = connection.execute(
+            f"select ts, {columns} from {table} where ts >= ? and ts < ? order by ts",
+            (start, end),
+        )
+        return [(row[0], 1, [(v, v, v) for v in row[1:]]) for row in rows]
+
+    columns = ", ".join(
+        f"{f}_sum / nullif({f}_n, 0), {f}_min, {f}_max" for f in fields
+    )
+    rows = connection.execute(
+        f"""select bucket, count, {columns} from {rollup_table(table, resolution)}
+        where bucket >= ? and bucket < ? order by bucket""",
+        (int(start // resolution) * resolution, end),
+    )
+    return [
+        (row[0], row[1], [tuple(row[2 + 3 * i : 5 + 3 * i]) for i in range(len(fields))])
+        for row in rows
+    ]
@@ -0,0 +1,70 @@
+"""Drift-free periodic scheduling on the event loop's monotonic clock."""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run an async callable every `interval` seconds.
+
+    Deadlines are computed from the start time (start + n * interval) rather
+    than by sleeping after each run, so loop overhead never accumulates into
+    drift. If a run overruns its interval the missed ticks are skipped, not
+    run back to back. Start jitter and overruns are kept in `stats`.
+    With immediate=False the first run waits one interval.
+    """
+
+    def __init__(self, name: str, interval: float, func, immediate: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.immediate = immediate
+        self.stats = {
+            "runs": 0,
+            "errors": 0,
+            "overruns": 0,
+            "skipped": 0,
+            "jitter_mean": 0.0,
+            "jitter_max": 0.0,
+            "duration_max": 0.0,
+        }
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tick = 0 if self.immediate else 1
+        while True:
+            deadline = start + tick * self.interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            began = loop.time()
+            try:
+                await self.func()
+            except Exception:
+                self.stats["errors"] += 1
+                logger.exception("Scheduled task %s failed", self.name)
+            finished = loop.time()
+            self._record(began - deadline, finished - began)
+            next_tick = int((finished - start) // self.interval) + 1
+            self.stats["skipped"] += next_tick - tick - 1
+            tick = next_tick
+
+    def _record(self, jitter: float, duration: float):
+        stats = self.stats
+        stats["runs"] += 1
+        stats["jitter_mean"] += (jitter - stats["jitter_mean"]) / stats["runs"]
+        stats["jitter_max"] = max(stats["jitter_max"], jitter)
+        stats["duration_max"] = max(stats["duration_max"], duration)
+        if duration > self.interval:
+            stats["overruns"] += 1
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"{self.name} every {self.interval:g}s: {s['runs']} runs, "
+            f"jitter mean {s['jitter_mean'] * 1000:.1f}ms max {s['jitter_max'] * 1000:.1f}ms, "
+            f"longest run {s['duration_max']:.2f}s, {s['overruns']} overruns, "
+            f"{s['skipped']} skipped, {s['errors']} errors"
+        )
@@ -0,0 +1,197 @@
+"""Incremental sync of logger readings to the weather-server by watermark.
+
+Reading ids are uuid7 strings, which sort in the order they were created, so
+the server only has to remember the highest id it has stored from each
+source and table (its watermark). A sync asks for the watermark, then sends
+every local row above it in id order, in NDJSON batches of `batch_rows`. The
+server inserts each batch and advances the watermark in one transaction and
+skips ids it already has, so an interrupted sync is simply re-run, and a
+long outage is backfilled in a few requests rather than one per reading.
+
+Readings the server already acknowledged some other way (the logger's live
+POSTs) are left out of a batch; each batch names the last row it covers, so
+the watermark still moves past them. A logger syncing for the first time can
+start from the server's newest reading, or the first it delivered live,
+instead of sending its whole database.
+
+Run by hand, e.g. to backfill from a copy of a logger database:
+    python -m station.sync db/weather-logger.db http://127.0.0.1:8000 --source outside
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Server endpoints for each reading table, relative to the server's base URL
+SYNC_PATHS = {
+    "thp_readings": "/weather/sync",
+    "air_quality_readings": "/air/sync",
+}
+
+
+def create_watermark_table(connection):
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS sync_watermarks (
+            source text NOT NULL,
+            reading_table text NOT NULL,
+            last_id text NOT NULL,
+            last_ts real NOT NULL,
+            rows integer NOT NULL,
+            updated real NOT NULL,
+            PRIMARY KEY (source, reading_table)
+        )"""
+    )
+
+
+def advance_watermark(
+    connection, source: str, table: str, rows: list, now: float, through: tuple = None
+):
+    """Move the watermark up to the highest id in (id, ts, ...) rows, or to
+    `through`, an (id, ts) the source says the server has everything up to.
+
+    Called in the transaction that stores the rows. The watermark never moves
+    back, so a batch re-sent after a lost response leaves it where it was.
+    """
+    candidates = list(rows) if through is None else list(rows) + [through]
+    if not candidates:
+        return
+    last = max(candidates, key=lambda row: row[0])
+    connection.execute(
+        """INSERT INTO sync_watermarks (source, reading_table, last_id, last_ts, rows, updated)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, reading_table) DO UPDATE SET
+            last_ts = CASE WHEN excluded.last_id > last_id THEN excluded.last_ts ELSE last_ts END,
+            last_id = max(last_id, excluded.last_id),
+            rows = rows + excluded.rows,
+            updated = excluded.updated""",
+        (source, table, last[0], last[1], len(rows), now),
+    )
+
+
+def watermark(connection, source: str, table: str) -> dict:
+    row = connection.execute(
+        """SELECT last_id, last_ts, rows, updated FROM sync_watermarks
+        WHERE source = ? AND reading_table = ?""",
+        (source, table),
+    ).fetchone()
+    if row is None:
+        return {"source": source, "id": None, "ts": None, "rows": 0, "updated": None}
+    return {"source": source, "id": row[0], "ts": row[1], "rows": row[2], "updated": row[3]}
+
+
+def rows_after(connection, table: str, fields: tuple, after: str, limit: int) -> list:
+    """Up to `limit` readings with ids above `after`, as dicts in id order."""
+    columns = ("id", "ts") + fields
+    rows = connection.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+        (after, limit),
+    ).fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def sync_table(
+    connection,
+    session,
+    url: str,
+    source: str,
+    table: str,
+    fields: tuple,
+    batch_rows: int = 5000,
+    timeout: float = 30,
+    delivered: set = None,
+    seed: bool = False,
+) -> int:
+    """Send the server every row of `table` above its watermark.
+
+    `session` is a requests.Session (or the requests module). Rows whose ids
+    are in `delivered` are not sent, and are removed from it once the
+    watermark has passed them. With seed=True and no watermark yet, rows
+    older than both the server's newest reading and the oldest id in
+    `delivered` are taken to be stored already (e.g. delivered before the
+    logger synced by watermark). Returns the number of
+    rows sent; raises if the server can't be reached or rejects a batch,
+    leaving the watermark at the last batch it stored.
+    """
+    params = {"source": source}
+    r = session.get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    mark = r.json()
+    after = mark["id"]
+    if after is None and seed:
+        # delivered may be added to by another thread; copy() doesn't iterate
+        first = min(delivered.copy(), default=None) if delivered else None
+        after = min((id for id in (mark.get("latest"), first) if id), default=None)
+        if first is not None and after == first:
+            delivered.discard(first)
+    after = after or ""
+    sent = 0
+    while True:
+        rows = rows_after(connection, table, fields, after, batch_rows)
+        if not rows:
+            return sent
+        new = rows if not delivered else [row for row in rows if row["id"] not in delivered]
+        body = "".join(json.dumps(row) + "\n" for row in new)
+        r = session.post(
+            url,
+            params={**params, "through": rows[-1]["id"], "through_ts": rows[-1]["ts"]},
+            data=body.encode(),
+            headers={"Content-Type": "application/x-ndjson"},
+            timeout=timeout,
+        )
+        r.raise_for_status()
+        result = r.json()
+        sent += len(new)
+        if (result["watermark"]["id"] or "") < rows[-1]["id"]:
+            raise RuntimeError(f"{url} did not store the batch ending at {rows[-1]['id']}")
+        logger.debug(
+            "Synced %d %s rows, %d new, up to %s",
+            len(new),
+            table,
+            result["inserted"],
+            rows[-1]["id"],
+        )
+        if delivered:
+            for row in rows:
+                delivered.discard(row["id"])
+        after = rows[-1]["id"]
+        if len(rows) < batch_rows:
+            return sent
+
+
+def main(argv):
+    import requests
+
+    from station import migrations
+
+    parser = argparse.ArgumentParser(
+        description="Send a logger database's readings to a weather-server."
+    )
+    parser.add_argument("db_path")
+    parser.add_argument("server", help="base URL, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--source", required=True, help="name the server tracks this logger by")
+    parser.add_argument("--batch-rows", type=int, default=5000)
+    args = parser.parse_args(argv[1:])
+    connection = sqlite3.connect(args.db_path)
+    try:
+        with requests.Session() as session:
+            for table, path in SYNC_PATHS.items():
+                sent = sync_table(
+                    connection,
+                    session,
+                    args.server.rstrip("/") + path,
+                    args.source,
+                    table,
+                    migrations.READING_TABLES[table],
+                    args.batch_rows,
+                )
+                print(f"{table}: sent {sent} rows")
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
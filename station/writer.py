@@ -0,0 +1,96 @@
+"""Group commits of buffered rows over one long-lived SQLite connection.
+
+Writing each reading in its own connection and transaction costs a connect,
+a journal sync and a close per row, which on an SD card is both slow and
+wearing. BufferedWriter instead keeps rows in memory and writes them all
+in one transaction with executemany, once `flush_rows` are waiting, when
+the owner's periodic flush runs (the durability window: a crash loses at
+most one window of readings) and on close.
+
+The connection uses the pool's pragmas, so the database is in WAL mode with
+synchronous=NORMAL: a commit appends to the WAL without an fsync and only
+checkpoints sync, which bounds the fsyncs by the volume written rather than
+the number of commits.
+"""
+import logging
+import sqlite3
+import threading
+
+from station.db import PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter:
+    def __init__(self, db_path: str, flush_rows: int = 500, max_rows: int = 20000):
+        self.db_path = db_path
+        self.flush_rows = flush_rows
+        # Rows kept while flushes are failing, before the oldest are dropped
+        self.max_rows = max_rows
+        self.stats = {"rows": 0, "flushes": 0, "dropped": 0}
+        self._lock = threading.Lock()
+        # One flush at a time, so rows reach the database in order
+        self._flush_lock = threading.Lock()
+        # (table, columns) -> rows, in arrival order
+        self._pending = {}
+        self._count = 0
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        for pragma in PRAGMAS:
+            self._connection.execute(pragma)
+
+    @property
+    def pending(self) -> int:
+        return self._count
+
+    def add(self, table: str, columns: tuple, row: tuple) -> bool:
+        """Buffer a row; returns True once enough are waiting to be flushed."""
+        with self._lock:
+            self._pending.setdefault((table, columns), []).append(row)
+            self._count += 1
+            return self._count >= self.flush_rows
+
+    def flush(self) -> int:
+        """Write every buffered row in one transaction; returns the number written.
+
+        If the write fails the rows go back in the buffer for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, count, self._count = self._pending, {}, self._count, 0
+            if not pending:
+                return 0
+            try:
+                with self._connection as connection:
+                    for (table, columns), rows in pending.items():
+                        placeholders = ", ".join("?" for _ in columns)
+                        connection.executemany(
+                            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                            rows,
+                        )
+            except sqlite3.Error:
+                self._restore(pending, count)
+                raise
+            self.stats["rows"] += count
+            self.stats["flushes"] += 1
+            return count
+
+    def _restore(self, pending: dict, count: int):
+        with self._lock:
+            for key, rows in self._pending.items():
+                pending.setdefault(key, []).extend(rows)
+            self._pending, self._count = pending, self._count + count
+            excess = self._count - self.max_rows
+            if excess > 0:
+                for rows in self._pending.values():
+                    dropped = min(excess, len(rows))
+                    del rows[:dropped]
+                    excess -= dropped
+                    self._count -= dropped
+                    self.stats["dropped"] += dropped
+                logger.warning("Write buffer is full, dropped the oldest readings.")
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._connection.close()
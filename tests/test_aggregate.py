@@ -0,0 +1,59 @@
+import math
+
+import pytest
+
+from station.aggregate import MIN_SAMPLES_FOR_REJECTION, SampleAggregator, reject_outliers
+
+
+def test_all_equal_samples_are_kept():
+    assert reject_outliers([21.5] * 10) == [21.5] * 10
+
+
+def test_a_single_outlier_is_dropped():
+    values = [20.1, 20.3, 19.9, 20.0, 20.2, 85.0, 20.1]
+    assert reject_outliers(values) == [20.1, 20.3, 19.9, 20.0, 20.2, 20.1]
+
+
+def test_an_outlier_is_dropped_when_most_samples_are_on_the_median():
+    # More than half the samples equal, so the MAD is zero
+    values = [12, 12, 12, 12, 12, 12, 13, 11, 250]
+    assert reject_outliers(values) == [12, 12, 12, 12, 12, 12, 13, 11]
+
+
+def test_a_real_change_is_kept_when_the_mad_is_zero():
+    values = [12] * 6 + [14] * 4
+    assert reject_outliers(values) == values
+
+
+@pytest.mark.parametrize("count", range(MIN_SAMPLES_FOR_REJECTION))
+def test_too_few_samples_are_kept(count):
+    values = [20.0, 500.0, -40.0][:count]
+    assert reject_outliers(values) == values
+
+
+def test_emit_summarises_the_kept_samples():
+    aggregator = SampleAggregator(("temperature", "humidity"))
+    assert aggregator.emit() is None
+    for temperature, humidity in [(20, 50), (21, None), (22, math.nan), (21, 52), (90, 51)]:
+        aggregator.add((temperature, humidity))
+    summary = aggregator.emit()
+    assert summary["samples"] == 5
+    assert summary["temperature"] == 21
+    assert (summary["temperature_min"], summary["temperature_max"]) == (20, 22)
+    assert summary["temperature_std"] == pytest.approx(math.sqrt(0.5))
+    # Only three humidity samples, too few to reject any
+    assert summary["humidity"] == 51
+    assert (summary["humidity_min"], summary["humidity_max"]) == (50, 52)
+    assert aggregator.emit() is None
+
+
+def test_emit_with_no_values_for_a_field():
+    aggregator = SampleAggregator(("pm2_5",))
+    aggregator.add((None,))
+    assert aggregator.emit() == {
+        "samples": 1,
+        "pm2_5": None,
+        "pm2_5_min": None,
+        "pm2_5_max": None,
+        "pm2_5_std": None,
+    }
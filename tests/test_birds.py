@@ -0,0 +1,159 @@
+import math
+import random
+import sqlite3
+
+import pytest
+
+from station import birds, migrations
+
+DAY = 86400
+# A Monday at midnight UTC, so day, hour and minute buckets all line up here
+START = 1704067200
+SPECIES = [
+    ("Turdus merula", "Eurasian Blackbird"),
+    ("Erithacus rubecula", "European Robin"),
+    ("Parus major", "Great Tit"),
+    ("Columba palumbus", "Common Wood-Pigeon"),
+    (None, "Unknown Warbler"),
+]
+
+
+@pytest.fixture(scope="module")
+def connection(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp("birds") / "weather.db")
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    connection = sqlite3.connect(db_path)
+    rng = random.Random(14)
+    sightings, ts = [], START - DAY // 2
+    while ts < START + 3 * DAY:
+        # Bursts of detections in the same second and minute, then gaps
+        ts += rng.choice((0, 0, 1, 7, 59, 60, 61, 900, 3600))
+        scientific_name, common_name = rng.choice(SPECIES)
+        confidence = rng.choice((None, 0.05, birds.MIN_CONFIDENCE, rng.uniform(0.1, 1)))
+        sightings.append((f"s{len(sightings)}", ts, scientific_name, common_name, confidence))
+    # Stored in a few batches, as the server receives them
+    for i in range(0, len(sightings), 250):
+        birds.add_sightings(connection, sightings[i : i + 250])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def brute_force(connection, start, end=None):
+    """{common_name: (detections, confidence_sum)} straight from the sightings."""
+    rows = connection.execute(
+        """SELECT s.common_name, count(*), total(b.confidence)
+        FROM bird_sightings b JOIN bird_species s USING (species_id)
+        WHERE b.ts >= ? AND b.ts < ? AND b.confidence > ? GROUP BY 1""",
+        (start, math.inf if end is None else end, birds.MIN_CONFIDENCE),
+    )
+    return {name: (n, total) for name, n, total in rows}
+
+
+def counted(rows):
+    return {name: (n, pytest.approx(total, abs=1e-9)) for name, _, n, total in rows}
+
+
+def random_windows(rng, count):
+    for _ in range(count):
+        start = START + rng.choice(
+            (rng.uniform(-DAY, 3 * DAY), rng.randrange(-DAY, 3 * DAY, 60))
+        )
+        length = rng.choice((0, 0.5, 30, 59, 60, 61, 3599, 3600, 7300, DAY, 2.5 * DAY))
+        yield start, start + length
+
+
+def assert_covers(ranges, start, end):
+    """The ranges tile [start, end) in order, each bucket range on its own grid."""
+    position = start
+    for resolution, lo, hi in ranges:
+        assert lo == position
+        assert hi is None or lo < hi
+        if resolution is not None:
+            assert lo % resolution == 0
+            assert hi is None or hi % resolution == 0
+        position = hi
+    if ranges:
+        assert position == end
+    else:
+        assert end is not None and start >= end
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        (START, START + DAY),
+        (START + 0.5, START + DAY - 0.5),
+        (START + 61, START + 3599),
+        (START - 30, None),
+        (START + 3600, None),
+        (START + 10, START + 50),  # inside one minute
+        (START + 10, START + 10),
+    ],
+)
+def test_split_window_covers_the_window(start, end):
+    assert_covers(birds._split_window(start, end), start, end)
+
+
+def test_split_window_uses_the_coarsest_buckets():
+    assert birds._split_window(START - 30, START + DAY + 3630) == [
+        (None, START - 30, START),
+        (86400, START, START + DAY),
+        (3600, START + DAY, START + DAY + 3600),
+        (None, START + DAY + 3600, START + DAY + 3630),
+    ]
+    assert birds._split_window(START + 10, START + 50) == [(None, START + 10, START + 50)]
+    assert birds._split_window(START + 10, None) == [
+        (None, START + 10, START + 60),
+        (60, START + 60, START + 3600),
+        (3600, START + 3600, START + DAY),
+        (86400, START + DAY, None),
+    ]
+
+
+@pytest.mark.parametrize("since", [START + 3600, START + 3630, START + 3659.5, START - DAY])
+def test_fine_counts_from_reads_pruned_minutes_raw(since):
+    for start, end in [(START + 10, START + 7300), (START + 10, None), (START + 3640, None)]:
+        ranges = list(birds._fine_counts_from(birds._split_window(start, end), since))
+        assert_covers(ranges, start, end)
+        for resolution, lo, _ in ranges:
+            if resolution == birds.RESOLUTIONS[0]:
+                assert lo >= since
+
+
+def test_top_species_matches_the_sightings(connection):
+    rng = random.Random(1)
+    windows = list(random_windows(rng, 300))
+    windows += [(start, None) for start, _ in windows[:50]]
+    windows += [(START + 10, START + 50), (START - DAY, None), (START + 3 * DAY, None)]
+    for start, end in windows:
+        assert counted(birds.top_species(connection, start, end)) == brute_force(
+            connection, start, end
+        )
+
+
+def test_top_species_orders_by_summed_confidence(connection):
+    rows = birds.top_species(connection, START - DAY, None)
+    assert [row[3] for row in rows] == sorted((row[3] for row in rows), reverse=True)
+    assert birds.top_species(connection, START - DAY, None, limit=2) == rows[:2]
+
+
+def test_top_species_without_the_pruned_minute_counts(connection):
+    rng = random.Random(2)
+    # Part way through a minute, so the bucket it falls in is pruned too
+    fine_since = START + DAY + 3630.5
+    connection.execute("SAVEPOINT prune")
+    connection.execute(
+        "DELETE FROM bird_counts WHERE resolution = ? AND bucket < ?",
+        (birds.RESOLUTIONS[0], fine_since),
+    )
+    try:
+        windows = list(random_windows(rng, 300))
+        windows += [(start, None) for start, _ in windows[:50]]
+        windows += [(fine_since - 20, fine_since + 20), (fine_since - 0.5, None)]
+        for start, end in windows:
+            rows = birds.top_species(connection, start, end, fine_since=fine_since)
+            assert counted(rows) == brute_force(connection, start, end)
+    finally:
+        connection.execute("ROLLBACK TO prune")
+        connection.execute("RELEASE prune")
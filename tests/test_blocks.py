@@ -0,0 +1,138 @@
+import math
+import sqlite3
+import uuid
+
+import numpy as np
+import pytest
+
+from station import blocks, migrations
+
+DAY = 1704067200  # 2024-01-01
+TABLE = "thp_readings"
+FIELDS = migrations.READING_TABLES[TABLE]
+
+
+def ids(count: int) -> list:
+    return [str(uuid.UUID(int=i + 1)) for i in range(count)]
+
+
+def round_trip(ids, ts, fields):
+    decoded_ids, decoded_ts, decoded_fields = blocks.decode_block(
+        blocks.encode_block(ids, ts, fields), ids=True
+    )
+    return decoded_ids, decoded_ts, decoded_fields
+
+
+def assert_same_bits(actual, expected):
+    # Compares NaN, -0.0 and inf exactly, not just numerically
+    np.testing.assert_array_equal(
+        np.asarray(actual, np.float64).view(np.uint64),
+        np.asarray(expected, np.float64).view(np.uint64),
+    )
+
+
+@pytest.mark.parametrize(
+    "ts, values",
+    [
+        # Steady minute readings with scheduling jitter
+        (
+            DAY + np.arange(1440) * 60 + np.random.default_rng(1).uniform(0, 0.005, 1440),
+            20 + np.cumsum(np.random.default_rng(2).normal(0, 0.05, 1440)),
+        ),
+        # Gaps in the sensor data
+        (
+            DAY + np.arange(100) * 60.0,
+            np.where(np.arange(100) % 7 == 0, np.nan, np.linspace(1000, 1010, 100)),
+        ),
+        # A constant series
+        (DAY + np.arange(500) * 60.0, np.full(500, 21.5)),
+        # Large and negative changes in both timestamps and values
+        (
+            DAY + np.array([0, 0.000001, 86399.999999, 86400 * 400, 86400 * 400.5]),
+            np.array([1e300, -1e-300, -0.0, math.inf, 5e-324]),
+        ),
+        # A single reading
+        (np.array([DAY + 12.345678]), np.array([np.nan])),
+    ],
+    ids=["jittered", "nan", "constant", "large-deltas", "single"],
+)
+def test_codec_round_trip(ts, values):
+    block_ids = ids(len(ts))
+    decoded_ids, decoded_ts, decoded_fields = round_trip(block_ids, ts, [values, values * 2])
+    assert decoded_ids == block_ids
+    np.testing.assert_array_equal(decoded_ts, np.round(ts * 1e6) / 1e6)
+    assert_same_bits(decoded_fields[0], values)
+    assert_same_bits(decoded_fields[1], values * 2)
+
+
+def test_codec_keeps_ids_that_are_not_uuids():
+    block_ids = ["a", "b-2", str(uuid.UUID(int=3)), ""]
+    decoded_ids, _, _ = round_trip(block_ids, DAY + np.arange(4.0), [np.zeros(4)])
+    assert decoded_ids == block_ids
+
+
+def test_codec_skips_ids_unless_asked():
+    data = blocks.encode_block(ids(3), DAY + np.arange(3.0), [np.ones(3)])
+    assert blocks.decode_block(data)[0] is None
+
+
+def test_steady_readings_compress():
+    ts = DAY + np.arange(1440) * 60.0
+    data = blocks.encode_block(ids(1440), ts, [np.full(1440, 20.0)] * 3)
+    assert len(data) < 1440 * 20
+
+
+@pytest.fixture
+def connection(tmp_path):
+    db_path = str(tmp_path / "server.db")
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    yield connection
+    connection.close()
+
+
+def insert(connection, rows):
+    connection.executemany(f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def stored_rows(connection):
+    return connection.execute(f"SELECT * FROM {TABLE} ORDER BY ts").fetchall()
+
+
+def test_compact_and_expand_restore_rows(connection):
+    rows = [
+        (id, DAY + i * 600 + 0.25, 20.0 + i / 8, None if i % 5 == 0 else 50.0, 1000.0)
+        for i, id in enumerate(ids(300))
+    ]
+    insert(connection, rows)
+    assert blocks.compact(connection, TABLE, FIELDS, DAY + 2 * 86400) == 144 * 2
+    # Rows of a day that isn't over yet stay rows
+    assert len(stored_rows(connection)) == 300 - 288
+    assert blocks.expand(connection, TABLE, FIELDS) == 288
+    assert stored_rows(connection) == rows
+
+
+def test_scan_merges_blocks_and_rows(connection):
+    rows = [(id, DAY + i * 3600.0, float(i), None, 1.0) for i, id in enumerate(ids(72))]
+    insert(connection, rows)
+    blocks.compact(connection, TABLE, FIELDS, DAY + 2 * 86400)
+    result = blocks.scan(connection, TABLE, FIELDS, DAY + 3600, DAY + 60 * 3600, ids=True)
+    expected = rows[1:60]
+    assert result["id"] == [row[0] for row in expected]
+    np.testing.assert_array_equal(result["ts"], [row[1] for row in expected])
+    np.testing.assert_array_equal(result["temperature"], [row[2] for row in expected])
+    assert np.isnan(result["humidity"]).all()
+    parts = blocks.rows_between(connection, TABLE, FIELDS, DAY, DAY + 72 * 3600, ids=True)
+    assert [row for part in parts for row in part] == rows
+
+
+def test_late_rows_merge_into_their_block(connection):
+    first, late = ids(2)
+    insert(connection, [(first, DAY + 60.0, 1.0, 2.0, 3.0)])
+    blocks.compact(connection, TABLE, FIELDS, DAY + 86400)
+    insert(connection, [(late, DAY + 30.0, 4.0, 5.0, 6.0), (first, DAY + 60.0, 1.0, 2.0, 3.0)])
+    blocks.compact(connection, TABLE, FIELDS, DAY + 86400)
+    block_ids, ts, _ = blocks.read_block(connection, TABLE, DAY)
+    assert block_ids == [late, first]
+    np.testing.assert_array_equal(ts, [DAY + 30.0, DAY + 60.0])
+    assert blocks.known_ids(connection, TABLE, [(late, DAY + 30.0), ("other", DAY)]) == {late}
@@ -0,0 +1,168 @@
+import math
+import random
+import shutil
+
+import pytest
+
+from station import migrations
+from station.cache import ReadingRing, SharedCounter, database_identity
+
+NOW = 1704067200.0
+
+
+@pytest.fixture
+def make_ring(tmp_path):
+    rings = []
+
+    def make(capacity=8, windows=(300,), fields=2, name="ring", identity=0):
+        ring = ReadingRing(str(tmp_path / name), fields, capacity, windows, identity)
+        rings.append(ring)
+        return ring
+
+    yield make
+    for ring in rings:
+        ring.close()
+
+
+def brute_force(records, window, now, capacity):
+    kept = [r for r in records[-capacity:] if r[0] > now - window]
+    averages = []
+    for i in range(1, len(records[0])):
+        values = [r[i] for r in kept if r[i] is not None]
+        averages.append(sum(values) / len(values) if values else None)
+    return averages, len(kept), (kept[-1][0] if kept else None)
+
+
+def test_empty_ring(make_ring):
+    ring = make_ring()
+    assert ring.latest() is None
+    assert ring.since(-math.inf) == []
+    assert ring.aggregate(300, NOW) == ([None, None], 0, None)
+    assert ring.version == 0
+
+
+def test_appends_must_be_in_time_order(make_ring):
+    ring = make_ring()
+    assert ring.append(NOW, (1, 2))
+    assert not ring.append(NOW, (3, 4))
+    assert not ring.append(NOW - 1, (3, 4))
+    assert ring.latest() == (NOW, 1.0, 2.0)
+    assert ring.version == 1
+
+
+def test_wrap_around_keeps_the_newest_records(make_ring):
+    ring = make_ring(capacity=8, windows=(3600,))
+    for i in range(21):
+        ring.append(NOW + i, (i, None))
+    assert ring.version == 21
+    assert ring.latest()[:2] == (NOW + 20, 20.0)
+    assert [r[0] for r in ring.since(-math.inf)] == [NOW + i for i in range(13, 21)]
+    assert [r[0] for r in ring.since(NOW + 17)] == [NOW + 18, NOW + 19, NOW + 20]
+    # The window is longer than the ring, so it covers only what the ring holds
+    averages, count, latest = ring.aggregate(3600, NOW + 20)
+    assert count == 8
+    assert averages == [sum(range(13, 21)) / 8, None]
+    assert latest == NOW + 20
+
+
+def test_first_after(make_ring):
+    ring = make_ring(capacity=4)
+    assert ring.first_after(-math.inf) is None
+    for i in range(6):
+        ring.append(NOW + i * 10, (i, i))
+    # Only what the ring still holds counts
+    assert ring.first_after(-math.inf) == NOW + 20
+    assert ring.first_after(NOW + 20) == NOW + 30
+    assert ring.first_after(NOW + 25) == NOW + 30
+    assert ring.first_after(NOW + 50) is None
+
+
+def test_window_edges(make_ring):
+    ring = make_ring(windows=(300,))
+    ring.append(NOW - 300, (100, 100))
+    ring.append(NOW - 299.5, (1, None))
+    ring.append(NOW, (3, 5))
+    # A reading exactly `window` old has aged out; one just inside has not
+    assert ring.aggregate(300, NOW) == ([2.0, 5.0], 2, NOW)
+    assert ring.aggregate(300, NOW + 0.5) == ([3.0, 5.0], 1, NOW)
+    assert ring.aggregate(300, NOW + 300) == ([None, None], 0, None)
+    # An emptied window starts again from the next reading
+    ring.append(NOW + 301, (7, 8))
+    assert ring.aggregate(300, NOW + 301) == ([7.0, 8.0], 1, NOW + 301)
+
+
+def test_aggregates_match_a_brute_force_scan(make_ring):
+    rng = random.Random(4)
+    windows = (60, 300, 900)
+    ring = make_ring(capacity=32, windows=windows)
+    records, ts, now = [], NOW, NOW
+    for _ in range(500):
+        ts += rng.choice((1, 5, 30, 61, 400))
+        record = (ts, rng.choice((None, rng.uniform(-10, 10))), rng.uniform(0, 1000))
+        records.append(record)
+        ring.append(ts, record[1:])
+        window = rng.choice(windows)
+        # Aggregating expires readings for good, so like the clock it never
+        # goes back; readings may arrive a little behind it
+        now = max(now, ts + rng.choice((0, 0, 30, 299.999, 300)))
+        averages, count, latest = ring.aggregate(window, now)
+        expected = brute_force(records, window, now, 32)
+        assert (count, latest) == expected[1:]
+        assert averages == [
+            None if e is None else pytest.approx(e, abs=1e-9) for e in expected[0]
+        ]
+
+
+def test_processes_share_the_ring_through_the_file(make_ring):
+    writer = make_ring(name="shared")
+    reader = make_ring(name="shared")
+    writer.append(NOW, (1, 2))
+    assert reader.latest() == (NOW, 1.0, 2.0)
+    assert reader.aggregate(300, NOW) == ([1.0, 2.0], 1, NOW)
+
+
+def test_a_changed_layout_resets_the_ring(make_ring):
+    make_ring(capacity=8, name="layout").append(NOW, (1, 2))
+    assert make_ring(capacity=16, name="layout").latest() is None
+
+
+def test_a_replaced_database_resets_the_ring(make_ring):
+    make_ring(name="identity", identity=1).append(NOW, (1, 2))
+    assert make_ring(name="identity", identity=1).latest() == (NOW, 1.0, 2.0)
+    ring = make_ring(name="identity", identity=2)
+    assert ring.latest() is None
+    ring.append(NOW - 10, (3, 4))
+    assert ring.latest() == (NOW - 10, 3.0, 4.0)
+
+
+def test_clear(make_ring):
+    ring = make_ring()
+    ring.append(NOW, (1, 2))
+    ring.clear()
+    assert ring.latest() is None
+    assert ring.aggregate(300, NOW) == ([None, None], 0, None)
+    assert ring.append(NOW - 10, (3, 4))
+
+
+def test_database_identity(tmp_path):
+    db_path = str(tmp_path / "weather.db")
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    identity = database_identity(db_path)
+    assert database_identity(db_path) == identity
+    # A copy has its own inode, and a fresh database its own token
+    shutil.copy(db_path, tmp_path / "copy.db")
+    shutil.move(tmp_path / "copy.db", db_path)
+    assert database_identity(db_path) != identity
+    other_path = str(tmp_path / "other.db")
+    migrations.migrate(other_path, migrations.SERVER_MIGRATIONS)
+    assert database_identity(other_path) != database_identity(db_path)
+
+
+def test_shared_counter(tmp_path):
+    first = SharedCounter(str(tmp_path / "counter"))
+    second = SharedCounter(str(tmp_path / "counter"))
+    first.increment()
+    second.increment(by=4)
+    assert first.value == second.value == 5
+    first.close()
+    second.close()
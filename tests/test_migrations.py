@@ -0,0 +1,38 @@
+import sqlite3
+import uuid
+
+from station import migrations
+
+
+def test_clustering_keeps_legacy_rows_without_a_unique_id(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    connection = sqlite3.connect(db_path)
+    for table, columns in migrations.BASE_COLUMNS.items():
+        connection.execute(f"CREATE TABLE {table} ({columns})")
+    connection.executemany(
+        "INSERT INTO thp_readings VALUES (?, ?, ?, ?, ?)",
+        [
+            ("a", 100, 1, 1, 1),
+            ("a", 100, 1, 1, 1),  # sent twice
+            ("a", 200, 2, 2, 2),  # a different reading under the same id
+            ("None", 300, 3, 3, 3),
+            ("None", 400, 4, 4, 4),
+            (None, 500, 5, 5, 5),
+            ("b", None, 6, 6, 6),  # can't be placed in ts order
+            ("c", 600, 7, 7, 7),
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+    migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute("SELECT id, ts, temperature FROM thp_readings ORDER BY ts").fetchall()
+    connection.close()
+    assert [row[1:] for row in rows] == [(100, 1), (200, 2), (300, 3), (400, 4), (500, 5), (600, 7)]
+    assert rows[0][0] == "a" and rows[-1][0] == "c"
+    for id, ts, _ in rows[1:-1]:
+        value = uuid.UUID(id)
+        assert value.version == 7
+        assert value.int >> 80 == ts * 1000
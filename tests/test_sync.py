@@ -0,0 +1,202 @@
+import json
+import sqlite3
+
+import pytest
+
+from station import migrations, sync
+
+TABLE = "thp_readings"
+FIELDS = migrations.READING_TABLES[TABLE]
+URL = "http://server/weather/sync"
+
+
+def create_table(connection):
+    connection.execute(
+        f"CREATE TABLE {TABLE} (id text PRIMARY KEY, ts real, "
+        + ", ".join(f"{field} real" for field in FIELDS)
+        + ")"
+    )
+
+
+class Response:
+    def __init__(self, status: int, body: dict):
+        self.status_code = status
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.body
+
+
+class FakeServer:
+    """Stands in for requests against /weather/sync: stores each batch and
+    advances the watermark in one transaction, skipping stored ids.
+
+    `fail` maps a POST number to "before" (the request never arrives) or
+    "after" (the batch is stored but the response is lost).
+    """
+
+    def __init__(self, fail=None):
+        self.connection = sqlite3.connect(":memory:")
+        create_table(self.connection)
+        sync.create_watermark_table(self.connection)
+        self.fail = fail or {}
+        self.posts = []
+
+    def get(self, url, params, timeout):
+        mark = sync.watermark(self.connection, params["source"], TABLE)
+        mark["latest"] = self.connection.execute(f"SELECT max(id) FROM {TABLE}").fetchone()[0]
+        return Response(200, mark)
+
+    def post(self, url, params, data, headers, timeout):
+        self.posts.append(data)
+        failure = self.fail.get(len(self.posts))
+        if failure == "before":
+            raise ConnectionError("connection reset")
+        records = [json.loads(line) for line in data.decode().splitlines()]
+        rows = [(r["id"], r["ts"]) + tuple(r[field] for field in FIELDS) for r in records]
+        through = (params["through"], params["through_ts"]) if "through" in params else None
+        with self.connection:
+            inserted = self.connection.executemany(
+                f"INSERT OR IGNORE INTO {TABLE} VALUES (?, ?, ?, ?, ?)", rows
+            ).rowcount
+            sync.advance_watermark(self.connection, params["source"], TABLE, rows, 0, through)
+        if failure == "after":
+            raise ConnectionError("response lost")
+        return Response(
+            200,
+            {
+                "inserted": inserted,
+                "watermark": sync.watermark(self.connection, params["source"], TABLE),
+            },
+        )
+
+    def rows(self):
+        return self.connection.execute(f"SELECT * FROM {TABLE} ORDER BY id").fetchall()
+
+
+@pytest.fixture
+def logger_db():
+    connection = sqlite3.connect(":memory:")
+    create_table(connection)
+    rows = [(f"{i:08d}", 1704067200 + i * 60.0, 20.0, 50.0, None) for i in range(25)]
+    connection.executemany(f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?)", rows)
+    yield connection, rows
+    connection.close()
+
+
+def run(connection, server, batch_rows=10, **kwargs):
+    return sync.sync_table(
+        connection, server, URL, "outside", TABLE, FIELDS, batch_rows, **kwargs
+    )
+
+
+def store(server, rows):
+    server.connection.executemany(f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def test_sync_sends_everything_in_batches(logger_db):
+    connection, rows = logger_db
+    server = FakeServer()
+    assert run(connection, server) == 25
+    assert len(server.posts) == 3
+    assert server.rows() == rows
+    assert sync.watermark(server.connection, "outside", TABLE)["id"] == rows[-1][0]
+    # Nothing new: only the watermark is fetched
+    assert run(connection, server) == 0
+    assert len(server.posts) == 3
+
+
+def test_sync_resumes_after_a_failed_batch(logger_db):
+    connection, rows = logger_db
+    server = FakeServer(fail={2: "before"})
+    with pytest.raises(ConnectionError):
+        run(connection, server)
+    assert server.rows() == rows[:10]
+    assert run(connection, server) == 15
+    # The first batch is not sent again
+    assert [json.loads(post.splitlines()[0])["id"] for post in server.posts] == [
+        rows[0][0],
+        rows[10][0],
+        rows[10][0],
+        rows[20][0],
+    ]
+    assert server.rows() == rows
+
+
+def test_sync_resends_a_batch_whose_response_was_lost(logger_db):
+    connection, rows = logger_db
+    server = FakeServer(fail={2: "after"})
+    with pytest.raises(ConnectionError):
+        run(connection, server)
+    # The batch was stored, so the watermark moved past it
+    assert sync.watermark(server.connection, "outside", TABLE)["id"] == rows[19][0]
+    assert run(connection, server) == 5
+    assert server.rows() == rows
+
+
+def test_duplicate_batches_leave_the_watermark(logger_db):
+    connection, rows = logger_db
+    server = FakeServer()
+    run(connection, server)
+    before = sync.watermark(server.connection, "outside", TABLE)
+    # A stale batch re-sent out of order neither inserts nor moves it back
+    body = "".join(
+        json.dumps(dict(zip(("id", "ts") + FIELDS, row))) + "\n" for row in rows[:5]
+    ).encode()
+    result = server.post(URL, {"source": "outside"}, body, {}, 30).json()
+    assert result["inserted"] == 0
+    assert result["watermark"]["id"] == before["id"]
+    assert result["watermark"]["ts"] == before["ts"]
+    assert server.rows() == rows
+
+
+def test_server_that_drops_a_batch_is_an_error(logger_db):
+    connection, _ = logger_db
+    server = FakeServer()
+    server.post = lambda *args, **kwargs: Response(
+        200, {"inserted": 0, "watermark": {"id": None}}
+    )
+    with pytest.raises(RuntimeError):
+        run(connection, server)
+
+
+def test_readings_delivered_live_are_not_sent_again(logger_db):
+    connection, rows = logger_db
+    server = FakeServer()
+    live = rows[:8] + rows[12:25]
+    store(server, live)
+    delivered = {row[0] for row in live}
+    assert run(connection, server, delivered=delivered) == 4
+    sent = [json.loads(line)["id"] for post in server.posts for line in post.splitlines()]
+    assert sent == [row[0] for row in rows[8:12]]
+    # The watermark still passed the readings left out, so the next sync is empty
+    assert sync.watermark(server.connection, "outside", TABLE)["id"] == rows[-1][0]
+    assert delivered == set()
+    assert server.rows() == rows
+
+
+def test_first_sync_can_start_from_the_servers_newest_reading(logger_db):
+    connection, rows = logger_db
+    server = FakeServer()
+    store(server, rows[:20])
+    assert run(connection, server, seed=True) == 5
+    assert server.rows() == rows
+    # Readings after the first one delivered live are still checked
+    missed = FakeServer()
+    store(missed, rows[:5] + rows[10:])
+    delivered = {row[0] for row in rows[10:]}
+    assert run(connection, missed, seed=True, delivered=delivered) == 0
+    missed = FakeServer()
+    store(missed, rows[:5] + rows[10:15] + rows[16:])
+    delivered = {row[0] for row in rows[10:15] + rows[16:]}
+    assert run(connection, missed, seed=True, delivered=delivered) == 1
+    assert missed.rows() == rows[:5] + rows[10:]
+    assert delivered == set()
+    # Without seeding, a new source sends everything
+    other = FakeServer()
+    store(other, rows[:20])
+    assert run(connection, other) == 25
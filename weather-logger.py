@@ -4,108 +4,87 @@ import sensors.pms_sensor
 import time
 import os
 import asyncio
+import functools
 import datetime
 import json
 import time
 import uuid
-import logging
 import requests
+import signal
 import socket
 import sqlite3
-import paho.mqtt.client as mqtt
 from uuid_extensions import uuid7str
 from zoneinfo import ZoneInfo
 import json
-import sys
-
-class JSONFormatter(logging.Formatter):
-    # Standard logging record attributes to exclude from metadata
-    RESERVED_ATTRS = {
-        'name', 'msg', 'args', 'created', 'filename', 'funcName', 'levelname',
-        'levelno', 'lineno', 'module', 'msecs', 'message', 'pathname', 'process',
-        'processName', 'relativeCreated', 'thread', 'threadName', 'exc_info',
-        'exc_text', 'stack_info', 'getMessage', 'getMessage'
-    }
-
-    def format(self, record):
-        log_data = {
-            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-            "level": record.levelname,
-            "service": "weather-logger",  # Change this to your service name
-            "message": record.getMessage(),
-            "logger": record.name,
-        }
-
-        return json.dumps(log_data)
-
-def setup_logging():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(JSONFormatter())
-
-    logger = logging.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-
-    return logger
+from station import logs, metrics, migrations, retention, sync
+from station.mqtt import MQTTPublisher
+from station.outbox import Outbox
+from station.policy import PublishPolicy
+from station.aggregate import SampleAggregator
+from station.scheduler import PeriodicTask
+from station.writer import BufferedWriter
 
 # Add Logger
-logger = setup_logging()
+logger = logs.setup_logging("weather-logger")
 
 # Database configuration
 LOGGER_DB = os.path.join(
     os.path.dirname(os.path.realpath(__file__)), "db/weather-logger.db"
 )
 
+# Metrics configuration
+METRICS_PORT = None  # Serve Prometheus metrics on this port (e.g. 9101); None disables them
 
-def initiate_tables(db_path):
-    tables = [
-        {
-            "name": "thp_readings",
-            "columns": "id text, ts integer, temperature real, humidity real, pressure real",
-        },
-        {
-            "name": "air_quality_readings",
-            "columns": "id text, ts integer, pm1 real, pm2_5 real, pm10 real",
-        },
-    ]
-    logger.info(f"Initiating {len(tables)} tables.")
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    for table in tables:
-        logger.debug(f"Initiating table: {table.get('name')} with columns: {table.get('columns')}")
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS {table_name} ({columns})""".format(
-                table_name=table.get("name"), columns=table.get("columns")
-            )
-        )
-    connection.commit()
-    connection.close()
-    logger.info(f"Completed table initiation.")
-    return True
+metrics_registry = metrics.Registry(enabled=METRICS_PORT is not None)
+db_seconds = metrics_registry.histogram(
+    "weather_logger_db_seconds", "Time spent in database flushes", ("function",)
+)
+sensor_read_seconds = metrics_registry.histogram(
+    "weather_logger_sensor_read_seconds", "Duration of raw sensor reads", ("sensor",)
+)
+sensor_errors = metrics_registry.counter(
+    "weather_logger_sensor_errors", "Failed raw sensor reads", ("sensor",)
+)
+synced_rows = metrics_registry.counter(
+    "weather_logger_synced_rows",
+    "Readings sent to the weather-server by the watermark sync",
+    ("kind",),
+)
+delivery_seconds = metrics_registry.histogram(
+    "weather_logger_delivery_seconds",
+    "Time to deliver a reading to the weather-server or MQTT broker",
+    ("sink",),
+)
+state_updates = metrics_registry.counter(
+    "weather_logger_state_updates",
+    "Readings offered for Home Assistant state, by whether they were published",
+    ("kind", "outcome"),
+)
+timed = metrics_registry.timed(db_seconds)
 
 
-def write_logger_data(query):
-    connection = sqlite3.connect(LOGGER_DB)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    connection.commit()
-    connection.close()
+def initiate_tables(db_path):
+    logger.info("Initiating tables.")
+    version = migrations.migrate(db_path, migrations.LOGGER_MIGRATIONS)
+    logger.info("Completed table initiation at schema version %d.", version)
     return True
 
 
-def write_latest_weather(
-    id: str, ts: float, temperature: float, humidity: float, pressure: float
-):
-    query = f"""INSERT INTO thp_readings VALUES('{id}', {ts}, {temperature}, {humidity}, {pressure})"""
-    logger.debug(f"Weather query: {query}")
-    write_logger_data(query)
-    return True
+def write_reading(writer: BufferedWriter, kind: str, reading: dict) -> bool:
+    """Buffer an aggregated reading and its sample statistics for the next flush.
 
+    Returns True once the buffer is full enough to flush.
+    """
+    table = READING_TABLES[kind]
+    fields = migrations.READING_TABLES[table]
+    columns = ("id", "ts") + fields + migrations.sample_stat_columns(fields)
+    return writer.add(table, columns, tuple(reading.get(column) for column in columns))
 
-def write_latest_air(id: str, ts: float, pm1: float, pm2_5: float, pm10: float):
-    query = f"""INSERT INTO air_quality_readings VALUES('{id}', {ts}, {pm1}, {pm2_5}, {pm10})"""
-    write_logger_data(query)
-    return True
+
+@timed
+def flush_readings(writer: BufferedWriter):
+    """Write all buffered readings in one transaction."""
+    return writer.flush()
 
 
 # MQTT broker settings
@@ -113,31 +92,78 @@ BROKER_HOST = "hub.local"  # Change to your MQTT broker address
 BROKER_PORT = 1883  # Default MQTT port
 TOPIC = "outside/weather"  # Change to your desired topic
 CLIENT_ID = f"weather-mqtt-{uuid.uuid4()}"  # Generate a unique client ID
+MQTT_KEEPALIVE = 60  # Seconds between keep-alive pings to the broker
+MQTT_MAX_INFLIGHT = 20  # QoS 1 messages sent before waiting for their acks
 
 # HomeAssistant MQTT configuration
 DISCOVERY_PREFIX = "homeassistant"  # Default HomeAssistant discovery prefix
 DEVICE_ID = "environment_sensor_1"  # Unique identifier for your device
 NODE_ID = socket.gethostname()  # Use hostname as node identifier
-
-
-def on_connect(client, userdata, flags, rc):
-    """Callback for when the client connects to the broker"""
-    if rc == 0:
-        logger.info(f"Connected to MQTT broker at {BROKER_HOST}:{BROKER_PORT}")
-    else:
-        logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
-
-
-def on_publish(client, userdata, mid):
-    """Callback for when a message is published"""
-    logger.debug(f"Message ID {mid} published successfully")
-
-
-def publish_discovery_messages(client):
+STATE_TOPICS = {
+    "weather": f"homeassistant/sensor/{DEVICE_ID}/state",
+    "air": f"homeassistant/sensor/{DEVICE_ID}/air_state",
+}
+AVAILABILITY_TOPIC = f"homeassistant/sensor/{DEVICE_ID}/availability"
+
+# Sampling configuration
+BME_INTERVAL = 5  # Seconds between raw BME280 reads
+PMS_INTERVAL = 10  # Seconds between raw PMS5003 reads
+EMIT_INTERVAL = 60  # Seconds of raw samples summarised into each stored reading
+STATS_INTERVAL = 3600  # Seconds between sampling jitter/overrun reports
+
+# Pipeline configuration
+QUEUE_SIZE = 100  # Readings buffered per stage before the oldest is dropped
+HTTP_TIMEOUT = 10  # Seconds to wait for the weather-server
+MQTT_TIMEOUT = 10  # Seconds to wait for a publish to be acknowledged
+READING_TABLES = {"weather": "thp_readings", "air": "air_quality_readings"}
+SERVER_URLS = {
+    "weather": "http://127.0.0.1:8000/weather/latest",
+    "air": "http://127.0.0.1:8000/air/latest",
+}
+# Readings the server missed (it was down, or a POST failed) are sent after each
+# flush: the server keeps a watermark per source, the highest reading id it has
+# stored, and the logger sends every local row above it in batches, leaving
+# out readings the server acknowledged live. A first sync starts from the
+# server's newest reading; backfill older readings with `python -m station.sync`
+SERVER_SYNC_URLS = {
+    "weather": "http://127.0.0.1:8000/weather/sync",
+    "air": "http://127.0.0.1:8000/air/sync",
+}
+SYNC_SOURCE = NODE_ID  # Name the server keeps this logger's watermarks under
+SYNC_BATCH_ROWS = 5000  # Readings sent per sync request
+OUTBOX_MAX_ROWS = 20000  # Unpublished states kept for the MQTT broker
+# Readings are buffered and written to the local database in one transaction,
+# at least this often. It is the durability window: a power cut loses up to
+# this many seconds of readings, which the server has usually received anyway
+WRITE_FLUSH_INTERVAL = 300
+WRITE_FLUSH_ROWS = 500  # Flush early once this many readings are buffered
+
+# Home Assistant state publishing: a sensor's state is published when any field
+# has moved by at least its deadband since the last publish, no more often than
+# the minimum interval, and at least every maximum interval while readings arrive
+STATE_DEADBANDS = {
+    "weather": {"temperature": 0.1, "humidity": 0.5, "pressure": 0.2},
+    "air": {"pm1": 1.0, "pm2_5": 1.0, "pm10": 1.0},
+}
+STATE_MIN_INTERVAL = 30  # Seconds
+STATE_MAX_INTERVAL = 900  # Seconds
+
+# Retention: the server keeps (and archives) the full history, so the local
+# copy only needs to cover an outage long enough to resend from
+RETENTION_DAYS = 30  # Days of readings kept in the logger database
+RETENTION_INTERVAL = 86400  # Seconds between retention runs
+RETENTION_POLICIES = [
+    retention.RetentionPolicy(table, "ts", RETENTION_DAYS, None)
+    for table in READING_TABLES.values()
+]
+
+
+def publish_discovery_messages(publisher: MQTTPublisher):
     """Publish HomeAssistant MQTT discovery messages for each sensor"""
     sensors = {
         "temperature": {
             "name": "Temperature",
+            "kind": "weather",
             "unit_of_measurement": "°C",
             "device_class": "temperature",
             "state_class": "measurement",
@@ -145,6 +171,7 @@ def publish_discovery_messages(client):
         },
         "humidity": {
             "name": "Humidity",
+            "kind": "weather",
             "unit_of_measurement": "%",
             "device_class": "humidity",
             "state_class": "measurement",
@@ -152,11 +179,36 @@ def publish_discovery_messages(client):
         },
         "pressure": {
             "name": "Pressure",
+            "kind": "weather",
             "unit_of_measurement": "hPa",
             "device_class": "pressure",
             "state_class": "measurement",
             "value_template": "{{ value_json.pressure }}",
         },
+        "pm1": {
+            "name": "PM1",
+            "kind": "air",
+            "unit_of_measurement": "µg/m³",
+            "device_class": "pm1",
+            "state_class": "measurement",
+            "value_template": "{{ value_json.pm1 }}",
+        },
+        "pm2_5": {
+            "name": "PM2.5",
+            "kind": "air",
+            "unit_of_measurement": "µg/m³",
+            "device_class": "pm25",
+            "state_class": "measurement",
+            "value_template": "{{ value_json.pm2_5 }}",
+        },
+        "pm10": {
+            "name": "PM10",
+            "kind": "air",
+            "unit_of_measurement": "µg/m³",
+            "device_class": "pm10",
+            "state_class": "measurement",
+            "value_template": "{{ value_json.pm10 }}",
+        },
     }
 
     # Device info (shared across all sensors)
@@ -180,103 +232,391 @@ def publish_discovery_messages(client):
             "device_class": config["device_class"],
             "state_class": config["state_class"],
             "unit_of_measurement": config["unit_of_measurement"],
-            "state_topic": f"homeassistant/sensor/{DEVICE_ID}/state",
+            "state_topic": STATE_TOPICS[config["kind"]],
             "value_template": config["value_template"],
             "device": device_info,
-            "availability_topic": f"homeassistant/sensor/{DEVICE_ID}/availability",
+            "availability_topic": AVAILABILITY_TOPIC,
             "payload_available": "online",
             "payload_not_available": "offline",
         }
 
         # Publish discovery message with retain flag
-        client.publish(config_topic, json.dumps(payload), qos=1, retain=True)
-        logger.debug(f"Published discovery message for {sensor_type} sensor")
+        publisher.publish(config_topic, json.dumps(payload), retain=True)
+        logger.debug("Published discovery message for %s sensor", sensor_type)
+
+
+def offer(queue: asyncio.Queue, item):
+    """Queue an item without waiting, dropping the oldest one if the queue is full."""
+    if queue.full():
+        _ = queue.get_nowait()
+        queue.task_done()
+        logger.warning("Pipeline queue full, dropped the oldest reading.")
+    queue.put_nowait(item)
+
+
+async def sample_bme(aggregator: SampleAggregator):
+    """Take one raw BME280 sample."""
+    try:
+        with sensor_read_seconds.time("bme280"):
+            bme_data = await asyncio.to_thread(sensors.bme_sensor.read_all)
+    except Exception:
+        sensor_errors.inc("bme280")
+        logger.info("Error fetching data from BME Sensor.")
+        return
+    aggregator.add(bme_data[:3])
+
 
-    # Set device as available
-    client.publish(
-        f"homeassistant/sensor/{DEVICE_ID}/availability", "online", qos=1, retain=True
+async def sample_pms(aggregator: SampleAggregator):
+    """Take one raw PMS5003 sample."""
+    try:
+        with sensor_read_seconds.time("pms5003"):
+            pms_data = await asyncio.to_thread(sensors.pms_sensor.read_all)
+    except Exception:
+        sensor_errors.inc("pms5003")
+        logger.info("Error fetching data from PMS Sensor.")
+        return
+    aggregator.add(
+        (pms_data.pm_ug_per_m3(1.0), pms_data.pm_ug_per_m3(2.5), pms_data.pm_ug_per_m3(10))
     )
 
 
-def log_readings(mqtt_client):
-    while True:
-        start_time = datetime.datetime.now(tz=ZoneInfo("UTC"))
-        run_uuid = uuid7str()
+async def emit_readings(aggregators: dict, queues):
+    """Summarise each sensor's samples since the last emit and hand them on."""
+    ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    for kind, aggregator in aggregators.items():
+        summary = aggregator.emit()
+        if summary is None:
+            logger.info("No %s samples in the last interval.", kind)
+            continue
+        reading = {"id": uuid7str(), "ts": ts, **summary}
+        for queue in queues:
+            offer(queue, (kind, reading))
+    logger.debug("Data pull complete.")
 
-        # fetch temp data
-        try:
-            bme_data = sensors.bme_sensor.read_all()
+
+async def report_schedules(tasks):
+    for task in tasks:
+        logger.info("Sampling stats: %s", task.summary())
+
+
+async def enforce_retention():
+    await asyncio.to_thread(retention.enforce, LOGGER_DB, RETENTION_POLICIES)
+
+
+async def persist_readings(queue: asyncio.Queue, writer: BufferedWriter):
+    """Buffer readings for the local database, flushing when the buffer fills."""
+    while True:
+        kind, reading = await queue.get()
+        with logs.trace(reading["id"]):
             try:
-                payload = {
-                    "id": run_uuid,
-                    "ts": start_time.timestamp(),
-                    "temperature": bme_data[0],
-                    "humidity": bme_data[1],
-                    "pressure": bme_data[2],
-                }
-                # Write to local database
-                write_latest_weather(
-                    id=run_uuid,
-                    ts=start_time.timestamp(),
-                    temperature=bme_data[0],
-                    humidity=bme_data[1],
-                    pressure=bme_data[2],
+                if write_reading(writer, kind, reading):
+                    await asyncio.to_thread(flush_readings, writer)
+            except Exception:
+                logger.info("Error saving %s reading to the local database.", kind)
+            finally:
+                queue.task_done()
+
+
+def sync_to_server() -> dict:
+    """Send the weather-server every stored reading above its watermarks."""
+    connection = sqlite3.connect(LOGGER_DB, timeout=30)
+    try:
+        with requests.Session() as session:
+            return {
+                kind: sync.sync_table(
+                    connection,
+                    session,
+                    url,
+                    SYNC_SOURCE,
+                    READING_TABLES[kind],
+                    migrations.READING_TABLES[READING_TABLES[kind]],
+                    SYNC_BATCH_ROWS,
+                    HTTP_TIMEOUT,
+                    delivered=live_delivered[kind],
+                    seed=True,
                 )
-                # Send to weather-server
-                r = requests.post("http://127.0.0.1:8000/weather/latest", json=payload)
-            except:
-                logger.info("Error saving data from BME Sensor.")
+                for kind, url in SERVER_SYNC_URLS.items()
+            }
+    finally:
+        connection.close()
+
+
+async def flush_and_sync(writer: BufferedWriter):
+    """Write buffered readings, then sync them to the server if it missed any."""
+    if writer.pending:
+        await asyncio.to_thread(flush_readings, writer)
+    try:
+        sent = await asyncio.to_thread(sync_to_server)
+    except Exception as e:
+        logger.info(
+            "Syncing to weather-server failed (%s), retrying after the next flush.",
+            type(e).__name__,
+        )
+        return
+    for kind, count in sent.items():
+        synced_rows.inc(kind, by=count)
+    logger.debug("Synced readings to weather-server: %s", sent)
+
 
+# Ids of readings the server acknowledged live, left out of the next sync
+live_delivered = {kind: set() for kind in READING_TABLES}
+
+
+async def forward_readings(queue: asyncio.Queue):
+    """Send readings to the weather-server as they are taken.
+
+    Delivery is best effort: a reading the server doesn't get is sent by the
+    next sync, once it has been flushed to the local database.
+    """
+    while True:
+        kind, reading = await queue.get()
+        with logs.trace(reading["id"]):
             try:
-                logger.debug(f"Publishing BME sensor data to MQTT broker at {BROKER_HOST}:{BROKER_PORT}")
-                sensor_data = {
-                    "temperature": bme_data[0],
-                    "humidity": bme_data[1],
-                    "pressure": bme_data[2],
-                }
-                payload = json.dumps(sensor_data)
-                state_topic = f"homeassistant/sensor/{DEVICE_ID}/state"
-                result = mqtt_client.publish(state_topic, payload, qos=1)
-                result.wait_for_publish()
-            except:
-                logger.info("Publishing to MQTT failed")
-        except:
-            logger.info("Error fetching data from BME Sensor.")
-
-        # fetch and save air quality data
+                with delivery_seconds.time("http"):
+                    r = await asyncio.to_thread(
+                        requests.post,
+                        SERVER_URLS[kind],
+                        json=reading,
+                        headers={logs.TRACE_HEADER: reading["id"]},
+                        timeout=HTTP_TIMEOUT,
+                    )
+                r.raise_for_status()
+                live_delivered[kind].add(reading["id"])
+            except Exception:
+                logger.info("Error sending %s reading to weather-server, it will be synced.", kind)
+            finally:
+                queue.task_done()
+
+
+def publish_entries(publisher: MQTTPublisher, entries):
+    """Replay outbox entries to the broker, waiting until all are acknowledged."""
+    publisher.publish_many(
+        [(STATE_TOPICS[kind], json.dumps(state)) for _, kind, state in entries],
+        timeout=MQTT_TIMEOUT,
+    )
+
+
+def create_publisher() -> MQTTPublisher:
+    return MQTTPublisher(
+        BROKER_HOST,
+        BROKER_PORT,
+        CLIENT_ID,
+        AVAILABILITY_TOPIC,
+        on_connect=publish_discovery_messages,
+        on_ack=lambda seconds: delivery_seconds.observe(seconds, "mqtt"),
+        keepalive=MQTT_KEEPALIVE,
+        max_inflight=MQTT_MAX_INFLIGHT,
+    )
+
+
+async def publish_state(publisher: MQTTPublisher, outbox: Outbox, kind: str, state: dict):
+    """Publish a state to Home Assistant, or keep it in the outbox until connected.
+
+    Home Assistant only shows the current state, so the outbox keeps just the
+    newest unpublished state of each kind rather than replaying stale ones.
+    """
+    try:
+        if not publisher.connected or await asyncio.to_thread(outbox.depth, "mqtt"):
+            await asyncio.to_thread(outbox.add, "mqtt", kind, state, True)
+            return
+        logger.debug("Publishing %s state to MQTT broker at %s:%s", kind, BROKER_HOST, BROKER_PORT)
+        publisher.publish(STATE_TOPICS[kind], json.dumps(state))
+    except Exception:
+        logger.info("Publishing to MQTT failed, saving to outbox.")
+        await asyncio.to_thread(outbox.add, "mqtt", kind, state, True)
+
+
+async def publish_readings(queue: asyncio.Queue, publisher: MQTTPublisher, outbox: Outbox):
+    """Publish readings to Home Assistant over MQTT as each one's policy allows.
+
+    While connected, publishing only queues the message: acks are collected
+    by the publisher's network thread, so several can be in flight at once.
+    Between readings the stage wakes to flush changes that were held back
+    by the minimum interval.
+    """
+    policies = {
+        kind: PublishPolicy(deadbands, STATE_MIN_INTERVAL, STATE_MAX_INTERVAL)
+        for kind, deadbands in STATE_DEADBANDS.items()
+    }
+    while True:
+        flushes = [p.flush_at() for p in policies.values() if p.flush_at() is not None]
+        timeout = max(0.0, min(flushes) - time.monotonic()) if flushes else None
         try:
-            pms_data = sensors.pms_sensor.read_all()
+            kind, reading = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            for kind, policy in policies.items():
+                state = policy.poll(time.monotonic())
+                if state is not None:
+                    state_updates.inc(kind, "published")
+                    await publish_state(publisher, outbox, kind, state)
+            continue
+        with logs.trace(reading["id"]):
             try:
-                payload = {
-                    "id": run_uuid,
-                    "ts": start_time.timestamp(),
-                    "pm1": pms_data.pm_ug_per_m3(1.0),
-                    "pm2_5": pms_data.pm_ug_per_m3(2.5),
-                    "pm10": pms_data.pm_ug_per_m3(10),
-                }
-                # Write to local database
-                write_latest_air(
-                    id=run_uuid,
-                    ts=start_time.timestamp(),
-                    pm1=pms_data.pm_ug_per_m3(1.0),
-                    pm2_5=pms_data.pm_ug_per_m3(2.5),
-                    pm10=pms_data.pm_ug_per_m3(10),
-                )
-                # Send to weather-server
-                r = requests.post("http://127.0.0.1:8000/air/latest", json=payload)
-            except:
-                logger.info("Error saving data from PMS Sensor.")
-        except:
-            logger.info("Error fetching data from PMS Sensor.")
+                state = policies[kind].offer(reading, time.monotonic())
+                state_updates.inc(kind, "published" if state is not None else "held")
+                if state is not None:
+                    await publish_state(publisher, outbox, kind, state)
+            finally:
+                queue.task_done()
+
+
+def register_pipeline_metrics(
+    tasks, queues: dict, outbox: Outbox, publisher: MQTTPublisher, writer: BufferedWriter
+):
+    """Metrics read from the scheduler, queues and outbox at scrape time."""
+
+    def task_stat(stat):
+        return lambda: {(task.name,): task.stats[stat] for task in tasks}
 
-        logger.info("Data pull complete.")
+    metrics_registry.counter(
+        "weather_logger_task_runs", "Scheduled task runs", ("task",), task_stat("runs")
+    )
+    metrics_registry.counter(
+        "weather_logger_task_overruns",
+        "Scheduled task runs that took longer than their interval",
+        ("task",),
+        task_stat("overruns"),
+    )
+    metrics_registry.counter(
+        "weather_logger_task_skipped",
+        "Scheduled ticks skipped after an overrun",
+        ("task",),
+        task_stat("skipped"),
+    )
+    metrics_registry.gauge(
+        "weather_logger_task_jitter_max_seconds",
+        "Latest start of a scheduled task after its deadline",
+        task_stat("jitter_max"),
+        ("task",),
+    )
+    metrics_registry.gauge(
+        "weather_logger_task_duration_max_seconds",
+        "Longest run of a scheduled task",
+        task_stat("duration_max"),
+        ("task",),
+    )
+    metrics_registry.gauge(
+        "weather_logger_queue_depth",
+        "Readings waiting for each pipeline stage",
+        lambda: {(stage,): queue.qsize() for stage, queue in queues.items()},
+        ("stage",),
+    )
+    metrics_registry.gauge(
+        "weather_logger_outbox_depth",
+        "Undelivered readings waiting in the outbox",
+        lambda: {(sink,): outbox.depth(sink) for sink in ("mqtt",)},
+        ("sink",),
+    )
+    metrics_registry.gauge(
+        "weather_logger_write_buffer_rows",
+        "Readings buffered for the next database flush",
+        lambda: writer.pending,
+    )
+    metrics_registry.gauge(
+        "weather_logger_mqtt_pending",
+        "MQTT messages queued or unacknowledged",
+        lambda: publisher.pending,
+    )
+    metrics_registry.counter(
+        "weather_logger_outbox_dropped",
+        "Undelivered readings dropped from a full outbox",
+        ("sink",),
+        lambda: {(sink,): stats["dropped"] for sink, stats in outbox.stats.items()},
+    )
 
-        # calculate how long to wait
-        finish_time = datetime.datetime.now(tz=ZoneInfo("UTC"))
-        calc_time = (finish_time - start_time).total_seconds()
-        time.sleep(max(0, 60 - calc_time))
 
-    return None
+async def log_readings(publisher: MQTTPublisher):
+    """Run sampling and each sink as independent stages joined by bounded queues.
+
+    Sampling only ever hands readings to the queues, so a slow database,
+    server or broker delays its own stage but never the next sample.
+    """
+    persist_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    forward_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    publish_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    outbox = Outbox(LOGGER_DB, max_rows=OUTBOX_MAX_ROWS)
+    writer = BufferedWriter(LOGGER_DB, flush_rows=WRITE_FLUSH_ROWS)
+    queues = [persist_queue, forward_queue, publish_queue]
+    aggregators = {
+        "weather": SampleAggregator(migrations.READING_TABLES["thp_readings"]),
+        "air": SampleAggregator(migrations.READING_TABLES["air_quality_readings"]),
+    }
+    # Each sensor runs on its own schedule, so a slow read of one never delays the other
+    samplers = [
+        PeriodicTask(
+            "bme280", BME_INTERVAL, functools.partial(sample_bme, aggregators["weather"])
+        ),
+        PeriodicTask(
+            "pms5003", PMS_INTERVAL, functools.partial(sample_pms, aggregators["air"])
+        ),
+    ]
+    emitter = PeriodicTask(
+        "emit",
+        EMIT_INTERVAL,
+        functools.partial(emit_readings, aggregators, queues),
+        immediate=False,
+    )
+    reporter = PeriodicTask(
+        "stats",
+        STATS_INTERVAL,
+        functools.partial(report_schedules, samplers),
+        immediate=False,
+    )
+    pruner = PeriodicTask("retention", RETENTION_INTERVAL, enforce_retention)
+    flusher = PeriodicTask(
+        "flush",
+        WRITE_FLUSH_INTERVAL,
+        functools.partial(flush_and_sync, writer),
+        immediate=False,
+    )
+    exporter = None
+    if METRICS_PORT is not None:
+        register_pipeline_metrics(
+            [*samplers, emitter, pruner, flusher],
+            {"persist": persist_queue, "forward": forward_queue, "publish": publish_queue},
+            outbox,
+            publisher,
+            writer,
+        )
+        exporter = metrics.serve(metrics_registry, METRICS_PORT)
+    try:
+        await asyncio.gather(
+            *(task.run() for task in samplers),
+            emitter.run(),
+            reporter.run(),
+            pruner.run(),
+            flusher.run(),
+            persist_readings(persist_queue, writer),
+            forward_readings(forward_queue),
+            publish_readings(publish_queue, publisher, outbox),
+            outbox.drain("mqtt", functools.partial(publish_entries, publisher)),
+        )
+    finally:
+        if exporter is not None:
+            exporter.shutdown()
+        # Readings still queued for the database and whatever is buffered are
+        # written before exiting
+        while not persist_queue.empty():
+            kind, reading = persist_queue.get_nowait()
+            write_reading(writer, kind, reading)
+        writer.close()
+        outbox.close()
+
+
+async def run_until_stopped(publisher: MQTTPublisher):
+    """Run the logger until SIGTERM (systemctl or docker stop) or SIGINT.
+
+    Either signal cancels the pipeline, so log_readings' cleanup writes the
+    buffered readings instead of the process dying with them.
+    """
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await log_readings(publisher)
+    except asyncio.CancelledError:
+        logger.info("Received a stop signal.")
 
 
 def main():
@@ -284,45 +624,18 @@ def main():
     logger.info("Triggering table initiation for weather-logger database")
     initiate_tables(LOGGER_DB)
 
-    # Create an MQTT client instance
-    mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, CLIENT_ID)
+    # Connect in the background; discovery is (re)published on every connect
+    publisher = create_publisher()
+    publisher.start()
 
-    # Set up callbacks
-    mqtt_client.on_connect = on_connect
-    mqtt_client.on_publish = on_publish
-
-    # wait for the discovery message to be created
-    publish_discovery_messages(mqtt_client)
-    time.sleep(2)
-
-    async def readingsWorker():
-        while True:
-            log_readings(mqtt_client)
-
-    #    async def secondWorker():
-    #        while True:
-    #            await asyncio.sleep(1)
-    #            print("Second Worker Executed")
-
-    loop = asyncio.get_event_loop()
     logger.info("Starting Server")
     try:
-        asyncio.ensure_future(readingsWorker())
-        #        asyncio.ensure_future(secondWorker())
-        loop.run_forever()
+        asyncio.run(run_until_stopped(publisher))
     except KeyboardInterrupt:
         pass
     finally:
         logger.info("Stopping Server")
-        mqtt_client.publish(
-            f"homeassistant/sensor/{DEVICE_ID}/availability",
-            "offline",
-            qos=1,
-            retain=True,
-        )
-        mqtt_client.disconnect()
-        logger.info("Stopping Server")
-        loop.close()
+        publisher.stop(timeout=MQTT_TIMEOUT)
 
 
 if __name__ == "__main__":
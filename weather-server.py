@@ -1,239 +1,902 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, make_response, render_template, jsonify, request
 import sqlite3
 import os
+import asyncio
 import datetime
+import fcntl
+import functools
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
-import logging
 import json
-import sys
-
-class JSONFormatter(logging.Formatter):
-    # Standard logging record attributes to exclude from metadata
-    RESERVED_ATTRS = {
-        'name', 'msg', 'args', 'created', 'filename', 'funcName', 'levelname',
-        'levelno', 'lineno', 'module', 'msecs', 'message', 'pathname', 'process',
-        'processName', 'relativeCreated', 'thread', 'threadName', 'exc_info',
-        'exc_text', 'stack_info', 'getMessage', 'getMessage'
-    }
-
-    def format(self, record):
-        log_data = {
-            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-            "level": record.levelname,
-            "service": "weather-server",  # Change this to your service name
-            "message": record.getMessage(),
-            "logger": record.name,
-        }
-
-        return json.dumps(log_data)
-
-def setup_logging():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(JSONFormatter())
-
-    logger = logging.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-
-    return logger
+from station.db import ConnectionPool
+from station import (
+    archive,
+    birds,
+    blocks,
+    derived,
+    export,
+    logs,
+    metrics,
+    migrations,
+    retention,
+    rollups,
+    sync,
+)
+from station.asgi import WSGIBridge, lifespan, wait_for_disconnect
+from station.broadcast import AsyncBroadcaster, Broadcaster
+from station.cache import ReadingRing, SharedCounter, database_identity, ring_path
 
 # Add Logger
-logger = setup_logging()
+logger = logs.setup_logging("weather-server")
 
 app = Flask(__name__)
 
-PRIMARY_DB = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)), "db/weather-server.db"
+PRIMARY_DB = os.environ.get(
+    "WEATHER_SERVER_DB",
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "db/weather-server.db"),
 )
+DB_POOL_SIZE = 4
+# Readings older than this are not "recent" (seconds)
+RECENT_WINDOW = 300
+# Windows the /recent endpoints can average over (seconds)
+RECENT_WINDOWS = (300, 3600, 86400)
+# Default and maximum number of points returned by the history endpoints
+HISTORY_POINTS = 500
+HISTORY_MAX_POINTS = 5000
+# Largest number of records accepted by one batch POST
+BATCH_MAX_RECORDS = 10000
+# Rows read and encoded at a time by the export endpoints
+EXPORT_BATCH_ROWS = 5000
+# Birds seen within this many seconds are "recent"
+BIRD_WINDOW = 60
+# Default window (seconds) and number of species for /birds/top
+BIRD_TOP_WINDOW = 86400
+BIRD_TOP_LIMIT = 10
+# Seconds between keep-alive comments on idle /stream connections
+STREAM_KEEPALIVE = 15
+# Open /stream clients per worker. Under gunicorn gthread each one holds a
+# thread, so keep this well below --threads to leave room for polling; beyond
+# it clients get a 503 and the dashboard polls instead
+STREAM_MAX_CLIENTS = 6
+# Seconds a refused /stream client is asked to wait before trying again
+STREAM_RETRY_AFTER = 60
+# Cached GET responses are rebuilt at least this often, as windows age (seconds)
+RESPONSE_CACHE_TTL = 60
+# How long browsers and the nginx proxy may reuse a response (seconds)
+RESPONSE_MAX_AGE = 10
+# Rendered responses kept per worker
+RESPONSE_CACHE_SIZE = 256
+# Threads running views and database calls for each ASGI worker
+ASGI_THREADS = 8
+# Days of data kept in the database (None keeps it forever). Raw readings and
+# bird sightings are archived to monthly files first and history still reads
+# them; a pruned rollup resolution falls back to the next coarser one.
+RAW_RETENTION_DAYS = 365
+ROLLUP_RETENTION_DAYS = {300: 730, 3600: None, 86400: None}
+BIRD_RETENTION_DAYS = 365
+# Per-minute bird counts are only needed for the partial hours at the ends of
+# a /birds/top window; older windows count those minutes from the sightings
+BIRD_MINUTE_COUNT_DAYS = 30
+# Seconds between retention runs
+RETENTION_INTERVAL = 86400
+# Pack raw readings into compressed daily blocks (see station/blocks.py) once
+# they are READING_BLOCK_DAYS old, at each retention run. History and export
+# read the blocks transparently. Keep it at least 1 so the recent windows are
+# still served from rows; to turn blocks off again, first run
+# `python -m station.blocks expand db/weather-server.db`
+READING_BLOCKS = False
+READING_BLOCK_DAYS = 2
+# Serve Prometheus metrics at /metrics; when off, instrumented calls run unwrapped
+METRICS_ENABLED = True
 
 
 def initiate_tables(db_path):
-    tables = [
-        {
-            "name": "thp_readings",
-            "columns": "id text, ts integer, temperature real, humidity real, pressure real",
-        },
-        {
-            "name": "air_quality_readings",
-            "columns": "id text, ts integer, pm1 real, pm2_5 real, pm10 real",
-        },
-        {
-            "name": "bird_observations",
-            "columns": "id text, ts integer, scientific_name text, common_name text, confidence real",
-        },
-    ]
-    logger.info(f"Initiating {len(tables)} tables.")
-    print("Initiating tables")
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    for table in tables:
-        print("Initiating a table")
-        print(table.get("name"))
-        print(table.get("columns"))
-        _ = cursor.execute(
-            """CREATE TABLE IF NOT EXISTS {table_name} ({columns})""".format(
-                table_name=table.get("name"), columns=table.get("columns")
-            )
-        )
-    connection.commit()
-    connection.close()
-    print("Completed table initiation")
-    logger.info("Completed table initiation.")
+    logger.info("Initiating tables.")
+    version = migrations.migrate(db_path, migrations.SERVER_MIGRATIONS)
+    logger.info("Completed table initiation at schema version %d.", version)
     return True
 
 
 # Initialize database tables on module load (required for gunicorn)
 initiate_tables(PRIMARY_DB)
 
+# Connections are opened lazily, so each gunicorn worker gets its own pool
+db_pool = ConnectionPool(PRIMARY_DB, size=DB_POOL_SIZE)
+
+# Each worker shares its metrics through a file, so any worker can answer /metrics
+metrics_registry = metrics.Registry(
+    enabled=METRICS_ENABLED, shared=ring_path(PRIMARY_DB, "metrics-{pid}", "json")
+)
+db_seconds = metrics_registry.histogram(
+    "weather_server_db_seconds", "Time spent in database calls", ("function",)
+)
+request_seconds = metrics_registry.histogram(
+    "weather_server_request_seconds",
+    "Time to build each response",
+    ("route", "method", "status"),
+)
+timed = metrics_registry.timed(db_seconds)
+metrics_registry.start_sharing()
+
 
-def query_db(query: str):
-    logger.info(f"Executing query: {query[:100]}...")
+@timed
+def query_db(query: str, params: tuple = ()):
+    logger.debug("Executing query: %.100s...", query)
     try:
-        connection = sqlite3.connect(PRIMARY_DB)
-        cursor = connection.cursor()
-        _ = cursor.execute(query)
-        data = cursor.fetchall()
-        connection.close()
-        return data
+        return db_pool.query(query, params)
     except sqlite3.Error as e:
-        logger.error(f"Database error executing query: {type(e).__name__}: {e}")
+        logger.error("Database error executing query: %s: %s", type(e).__name__, e)
         raise
 
 
-def write_db(query: str):
-    connection = sqlite3.connect(PRIMARY_DB)
-    cursor = connection.cursor()
-    _ = cursor.execute(query)
-    connection.commit()
-    connection.close()
+@timed
+def write_reading(table: str, id: str, ts: float, values: tuple):
+    """Insert a raw reading and fold it into the rollups in one transaction.
+
+    Returns False, storing nothing, if the id was already compacted into a
+    block (the primary key only catches ids still stored as rows).
+    """
+    fields = migrations.READING_TABLES[table]
+    with db_pool.connection() as connection:
+        with connection:
+            if READING_BLOCKS and blocks.known_ids(connection, table, [(id, ts)]):
+                return False
+            connection.execute(
+                f"INSERT INTO {table} VALUES(?, ?, {', '.join('?' for _ in fields)})",
+                (id, ts) + values,
+            )
+            rollups.add_readings(connection, table, fields, [(ts, values)])
     return True
 
 
-def query_latest_air():
-    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - 300
-    data = query_db(
-        "select pm1, pm2_5, pm10, ts from air_quality_readings where ts > {min_ts} order by ts desc limit 1".format(
-            min_ts=min_ts
+@timed
+def write_readings(table: str, rows: list, source: str = None, through: tuple = None):
+    """Insert (id, ts, *values) rows and their rollups in one transaction.
+
+    Rows whose id is already stored (or repeated within the batch) are skipped,
+    so a batch can safely be re-sent. With a source, its sync watermark is
+    advanced in the same transaction, to `through` (id, ts) if that is higher. Returns the rows actually inserted.
+    """
+    fields = migrations.READING_TABLES[table]
+    unique = list({row[0]: row for row in rows}.values())
+    with db_pool.connection() as connection:
+        with connection:
+            existing = set()
+            for i in range(0, len(unique), 500):
+                ids = [row[0] for row in unique[i : i + 500]]
+                existing.update(
+                    r[0]
+                    for r in connection.execute(
+                        f"select id from {table} where id in ({', '.join('?' for _ in ids)})",
+                        ids,
+                    )
+                )
+            if READING_BLOCKS:
+                existing.update(blocks.known_ids(connection, table, unique))
+            new_rows = [row for row in unique if row[0] not in existing]
+            connection.executemany(
+                f"INSERT INTO {table} VALUES(?, ?, {', '.join('?' for _ in fields)})",
+                new_rows,
+            )
+            rollups.add_readings(
+                connection, table, fields, [(row[1], row[2:]) for row in new_rows]
+            )
+            if source is not None:
+                sync.advance_watermark(
+                    connection, source, table, unique, time.time(), through
+                )
+    for row in sorted(new_rows, key=lambda row: row[1]):
+        reading_cache[table].append(row[1], row[2:])
+    return new_rows
+
+
+def parse_batch():
+    """Records from a JSON array body or an NDJSON stream, one object per line."""
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        records = [json.loads(line) for line in request.stream if line.strip()]
+    else:
+        records = request.get_json()
+    if not isinstance(records, list) or len(records) > BATCH_MAX_RECORDS:
+        raise ValueError(f"Batch must be a list of at most {BATCH_MAX_RECORDS} records")
+    return records
+
+
+def validate_batch(records: list, fields: tuple):
+    """(id, ts, *fields) rows, or ValueError naming the first bad record."""
+    rows = []
+    for index, r in enumerate(records):
+        if not isinstance(r, dict):
+            raise ValueError(f"Record {index} is not an object")
+        values = tuple(r.get(field) for field in fields)
+        if (
+            not isinstance(r.get("id"), str)
+            or not isinstance(r.get("ts"), (int, float))
+            or not all(v is None or isinstance(v, (int, float)) for v in values)
+        ):
+            raise ValueError(f"Record {index} is missing or has invalid fields")
+        rows.append((r["id"], r["ts"]) + values)
+    return rows
+
+
+def validate_bird_batch(records: list):
+    """(id, ts, scientific_name, common_name, confidence) rows, or ValueError
+    naming the first bad record."""
+    rows = []
+    for index, r in enumerate(records):
+        if not isinstance(r, dict):
+            raise ValueError(f"Record {index} is not an object")
+        row = (
+            r.get("id"),
+            r.get("ts"),
+            r.get("scientific_name"),
+            r.get("common_name"),
+            r.get("confidence"),
         )
+        if (
+            not isinstance(row[0], str)
+            or not isinstance(row[1], (int, float))
+            or not (row[2] is None or isinstance(row[2], str))
+            or not isinstance(row[3], str)
+            or not (row[4] is None or isinstance(row[4], (int, float)))
+        ):
+            raise ValueError(f"Record {index} is missing or has invalid fields")
+        rows.append(row)
+    return rows
+
+
+def write_batch(table: str):
+    try:
+        rows = validate_batch(parse_batch(), migrations.READING_TABLES[table])
+    except ValueError as e:
+        return jsonify({"error": f"Request data issue: {e}"}), 400
+    inserted = write_readings(table, rows)
+    logger.info("Batch to %s: received %d, inserted %d", table, len(rows), len(inserted))
+    return jsonify({"success": True, "received": len(rows), "inserted": len(inserted)})
+
+
+@timed
+def query_watermark(source: str, table: str) -> dict:
+    with db_pool.connection() as connection:
+        return sync.watermark(connection, source, table)
+
+
+def query_latest_id(table: str):
+    """The highest reading id stored as a row, for new loggers to sync from."""
+    with db_pool.connection() as connection:
+        return connection.execute(f"select max(id) from {table}").fetchone()[0]
+
+
+def sync_readings(table: str):
+    """GET a source's watermark, or POST its readings above the watermark."""
+    source = request.args.get("source")
+    if not source:
+        return jsonify({"error": "Missing source"}), 400
+    if request.method == "GET":
+        return jsonify(dict(query_watermark(source, table), latest=query_latest_id(table)))
+    # The source vouches that every reading up to `through` is stored, e.g.
+    # those it left out of the batch because a live POST was acknowledged
+    through = None
+    if "through" in request.args:
+        through_ts = request.args.get("through_ts", type=float)
+        if through_ts is None:
+            return jsonify({"error": "Request data issue: through needs through_ts"}), 400
+        through = (request.args["through"], through_ts)
+    try:
+        rows = validate_batch(parse_batch(), migrations.READING_TABLES[table])
+    except ValueError as e:
+        return jsonify({"error": f"Request data issue: {e}"}), 400
+    inserted = write_readings(table, rows, source=source, through=through)
+    logger.info(
+        "Sync from %s to %s: received %d, inserted %d", source, table, len(rows), len(inserted)
     )
-    if not data:
+    return jsonify(
+        {
+            "success": True,
+            "received": len(rows),
+            "inserted": len(inserted),
+            "watermark": query_watermark(source, table),
+        }
+    )
+
+
+# Latest readings shared by all workers, written through by the POST handlers.
+# They outlive the process, so they are tied to this database file
+cache_identity = database_identity(PRIMARY_DB)
+reading_cache = {
+    table: ReadingRing(
+        ring_path(PRIMARY_DB, table),
+        fields=len(fields),
+        windows=RECENT_WINDOWS,
+        identity=cache_identity,
+    )
+    for table, fields in migrations.READING_TABLES.items()
+}
+bird_version = SharedCounter(ring_path(PRIMARY_DB, "bird_observations", "version"))
+
+
+def cached_value(value: float):
+    return None if math.isnan(value) else value
+
+
+def warm_reading_cache():
+    """Copy any recent rows the shared cache is missing, e.g. after a reboot."""
+    for table, ring in reading_cache.items():
+        latest = ring.latest()
+        newest = query_db(f"select max(ts) from {table}")[0][0]
+        if latest is not None and (newest is None or latest[0] > newest):
+            # A backup was restored over this database: the ring is ahead of it
+            logger.info("Clearing the %s cache, which is newer than the database", table)
+            ring.clear()
+            latest = None
+        min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - max(
+            RECENT_WINDOWS
+        )
+        if latest is not None:
+            min_ts = max(min_ts, latest[0])
+        columns = ", ".join(migrations.READING_TABLES[table])
+        rows = query_db(
+            f"select ts, {columns} from {table} where ts > ? order by ts", (min_ts,)
+        )
+        for row in rows:
+            ring.append(row[0], row[1:])
+    return True
+
+
+def derived_weather(temperature: float, humidity: float) -> dict:
+    metrics = derived.weather_metrics([temperature], [humidity])
+    return {name: derived.to_list(values)[0] for name, values in metrics.items()}
+
+
+def derived_air(pm2_5: float, pm10: float) -> dict:
+    metrics = {
+        name: derived.to_list(values)[0]
+        for name, values in derived.air_metrics([pm2_5], [pm10]).items()
+    }
+    level = metrics["aqi_eu"]
+    metrics["aqi_eu_level"] = None if level is None else derived.EU_AQI_LEVELS[int(level) - 1]
+    return metrics
+
+
+def current_pressure_tendency():
+    """Pressure change over the last TENDENCY_PERIOD, from the shared cache."""
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    records = reading_cache["thp_readings"].since(
+        now - derived.TENDENCY_PERIOD - RECENT_WINDOW
+    )
+    if not records:
+        return None
+    ts = derived.as_array([record[0] for record in records])
+    pressure = derived.as_array([record[3] for record in records])
+    return derived.to_list(derived.pressure_tendency(ts, pressure))[-1]
+
+
+def query_latest_air():
+    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - RECENT_WINDOW
+    data = reading_cache["air_quality_readings"].latest()
+    if data is None or data[0] <= min_ts:
         raise ValueError("No recent readings")
     else:
         r = {
-            "pm1": data[0][0],
-            "pm2_5": data[0][1],
-            "pm10": data[0][2],
-            "reading_time": data[0][3],
+            "pm1": cached_value(data[1]),
+            "pm2_5": cached_value(data[2]),
+            "pm10": cached_value(data[3]),
+            "reading_time": data[0],
         }
+        r.update(derived_air(r["pm2_5"], r["pm10"]))
         return r
 
 
 def write_latest_air(id: str, ts: float, pm1: float, pm2_5: float, pm10: float):
-    query = f"""INSERT INTO air_quality_readings VALUES('{id}', {ts}, {pm1}, {pm2_5}, {pm10})"""
-    _ = write_db(query)
+    if write_reading("air_quality_readings", id, ts, (pm1, pm2_5, pm10)):
+        reading_cache["air_quality_readings"].append(ts, (pm1, pm2_5, pm10))
     return True
 
 
 def query_latest_weather():
-    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - 300
-    data = query_db(
-        "select temperature, humidity, pressure, ts from thp_readings where ts > {min_ts} order by ts desc limit 1".format(
-            min_ts=min_ts
-        )
-    )
-    if not data:
+    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - RECENT_WINDOW
+    data = reading_cache["thp_readings"].latest()
+    if data is None or data[0] <= min_ts:
         raise ValueError("No recent readings")
     else:
         r = {
-            "temp": data[0][0],
-            "humidity": data[0][1],
-            "pressure": data[0][2],
-            "reading_time": data[0][3],
+            "temp": cached_value(data[1]),
+            "humidity": cached_value(data[2]),
+            "pressure": cached_value(data[3]),
+            "reading_time": data[0],
         }
+        r.update(derived_weather(r["temp"], r["humidity"]))
+        r["pressure_tendency"] = current_pressure_tendency()
         return r
 
 
 def write_latest_weather(
     id: str, ts: float, temperature: float, humidity: float, pressure: float
 ):
-    query = f"""INSERT INTO thp_readings VALUES('{id}', {ts}, {temperature}, {humidity}, {pressure})"""
-    print(query)
-    write_db(query)
+    if write_reading("thp_readings", id, ts, (temperature, humidity, pressure)):
+        reading_cache["thp_readings"].append(ts, (temperature, humidity, pressure))
     return True
 
 
-def query_recent_air():
-    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - 300
-    data = query_db(
-        "select avg(pm1), avg(pm2_5), avg(pm10), count(id), max(ts) from air_quality_readings where ts > {min_ts} ".format(
-            min_ts=min_ts
-        )
-    )
-    if data[0][3] == 0:
+def query_recent_air(window: int = RECENT_WINDOW):
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    averages, num_readings, latest_reading = reading_cache[
+        "air_quality_readings"
+    ].aggregate(window, now)
+    if num_readings == 0:
         raise ValueError("No recent readings")
     else:
         r = {
-            "pm1": data[0][0],
-            "pm2_5": data[0][1],
-            "pm10": data[0][2],
-            "num_readings": data[0][3],
-            "latest_reading": data[0][4],
+            "pm1": averages[0],
+            "pm2_5": averages[1],
+            "pm10": averages[2],
+            "num_readings": num_readings,
+            "latest_reading": latest_reading,
         }
+        r.update(derived_air(r["pm2_5"], r["pm10"]))
         return r
 
 
-def query_recent_weather():
-    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - 300
-    logger.info(f"Querying recent weather with min_ts={min_ts}")
-    data = query_db(
-        "select avg(temperature), avg(humidity), avg(pressure), count(id), max(ts) from thp_readings where ts > {min_ts} ".format(
-            min_ts=min_ts
-        )
+def query_recent_weather(window: int = RECENT_WINDOW):
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    logger.debug("Querying recent weather over the last %s seconds", window)
+    averages, num_readings, latest_reading = reading_cache["thp_readings"].aggregate(
+        window, now
     )
-    logger.info(f"Query returned: {data}")
-    if data[0][3] == 0:
+    logger.debug("Cache returned %s readings", num_readings)
+    if num_readings == 0:
         raise ValueError("No recent readings")
     else:
         r = {
-            "temp": data[0][0],
-            "humidity": data[0][1],
-            "pressure": data[0][2],
-            "num_readings": data[0][3],
-            "latest_reading": data[0][4],
+            "temp": averages[0],
+            "humidity": averages[1],
+            "pressure": averages[2],
+            "num_readings": num_readings,
+            "latest_reading": latest_reading,
         }
+        r.update(derived_weather(r["temp"], r["humidity"]))
+        r["pressure_tendency"] = current_pressure_tendency()
         return r
 
 
-def get_recent_birds():
-    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - 60
-    data = query_db(
-        "select common_name, sum(confidence) from bird_observations where ts > {min_ts} and confidence > 0.1 group by 1 order by 2 desc".format(
-            min_ts=min_ts
+warm_reading_cache()
+
+
+def history_resolution(start: float, end: float, points: int, now: float):
+    """The resolution to answer from, skipping rollups pruned before start."""
+    resolution = rollups.pick_resolution(start, end, points)
+    if resolution is None:
+        return None
+    candidates = [r for r in rollups.RESOLUTIONS if r >= resolution]
+    for candidate in candidates:
+        days = ROLLUP_RETENTION_DAYS.get(candidate)
+        if days is None or start >= now - days * 86400:
+            return candidate
+    return candidates[-1]
+
+
+def archived_history(table: str, start: float, end: float):
+    """Raw history rows for the part of a range pruned into the archive."""
+    columns = ("ts",) + migrations.READING_TABLES[table]
+    rows = archive.read(archive.archive_dir(PRIMARY_DB), table, columns, start, end)
+    return [(row[0], 1, [(v, v, v) for v in row[1:]]) for row in rows]
+
+
+def history_derived(table: str, ts: list, averages: list, resolution) -> dict:
+    """Derived metrics for every history point, computed over the whole series."""
+    if not averages:
+        return {}
+    columns = list(zip(*averages))
+    if table == "air_quality_readings":
+        return derived.air_metrics(columns[1], columns[2])
+    metrics = derived.weather_metrics(*columns, ts=ts)
+    if resolution is not None and resolution > derived.TENDENCY_PERIOD:
+        # Points are too far apart to interpolate a 3 hour change
+        del metrics["pressure_tendency"]
+    return metrics
+
+
+def block_history(connection, table: str, start: float, end: float):
+    """Raw history rows, like rollups.history, from blocks and uncompacted rows."""
+    rows = [
+        row
+        for part in blocks.rows_between(
+            connection, table, migrations.READING_TABLES[table], start, end
+        )
+        for row in part
+    ]
+    return [(row[0], 1, [(v, v, v) for v in row[1:]]) for row in rows]
+
+
+@timed
+def query_history(table: str, names: tuple, start: float, end: float, points: int):
+    """Readings between start and end, downsampled to at most `points` buckets."""
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    resolution = history_resolution(start, end, points, now)
+    with db_pool.connection() as connection:
+        if resolution is None and READING_BLOCKS:
+            rows = block_history(connection, table, start, end)
+        else:
+            rows = rollups.history(
+                connection, table, migrations.READING_TABLES[table], start, end, resolution
+            )
+    if (
+        resolution is None
+        and RAW_RETENTION_DAYS is not None
+        and start < now - RAW_RETENTION_DAYS * 86400
+    ):
+        rows = sorted(archived_history(table, start, end) + rows, key=lambda row: row[0])
+    data = []
+    for ts, count, stats in rows:
+        point = {"ts": ts, "num_readings": count}
+        for name, (avg, low, high) in zip(names, stats):
+            point[name] = avg
+            point[f"{name}_min"] = low
+            point[f"{name}_max"] = high
+        data.append(point)
+    metrics = history_derived(
+        table,
+        [row[0] for row in rows],
+        [[avg for avg, _, _ in stats] for _, _, stats in rows],
+        resolution,
+    )
+    for name, values in metrics.items():
+        for point, value in zip(data, derived.to_list(values)):
+            point[name] = value
+    return {
+        "start": start,
+        "end": end,
+        "resolution": resolution or rollups.RAW_INTERVAL,
+        "points": data,
+    }
+
+
+def history_args():
+    """start, end and points from the query string, defaulting to the last day."""
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    end = request.args.get("end", now, type=float)
+    start = request.args.get("start", end - 86400, type=float)
+    points = request.args.get("points", HISTORY_POINTS, type=int)
+    if start >= end or not 0 < points <= HISTORY_MAX_POINTS:
+        raise ValueError("Invalid history range")
+    return start, end, points
+
+
+def export_batches(table: str, start: float, end: float, resolution):
+    """Lists of at most EXPORT_BATCH_ROWS export rows in ts order.
+
+    Raw rows come from the archive, then the database; `resolution` exports a
+    rollup instead. The database is read through its own read-only
+    connection and a cursor, so a long export neither ties up the pool nor
+    fetches more than one batch at a time.
+    """
+    fields = migrations.READING_TABLES[table]
+    if resolution is None:
+        columns = ("id", "ts") + fields
+        query = f"select {', '.join(columns)} from {table} where ts >= ? and ts < ? order by ts"
+        params = (start, end)
+        if RAW_RETENTION_DAYS is not None and start < time.time() - RAW_RETENTION_DAYS * 86400:
+            directory = archive.archive_dir(PRIMARY_DB)
+            yield from archive.iter_months(
+                directory, table, columns, start, end, EXPORT_BATCH_ROWS, cached=False
+            )
+    else:
+        stats = ", ".join(f"{f}_sum / nullif({f}_n, 0), {f}_min, {f}_max" for f in fields)
+        query = f"""select bucket, count, {stats} from {rollups.rollup_table(table, resolution)}
+        where bucket >= ? and bucket < ? order by bucket"""
+        params = (int(start // resolution) * resolution, end)
+    # Under the ASGI bridge each chunk may be pulled on a different pool
+    # thread, one at a time, so the connection must not be tied to one
+    connection = sqlite3.connect(
+        f"file:{PRIMARY_DB}?mode=ro", uri=True, timeout=5, check_same_thread=False
+    )
+    try:
+        if resolution is None and READING_BLOCKS:
+            for rows in blocks.rows_between(connection, table, fields, start, end, ids=True):
+                for i in range(0, len(rows), EXPORT_BATCH_ROWS):
+                    yield rows[i : i + EXPORT_BATCH_ROWS]
+            return
+        cursor = connection.execute(query, params)
+        while rows := cursor.fetchmany(EXPORT_BATCH_ROWS):
+            yield rows
+    finally:
+        connection.close()
+
+
+def export_table(table: str):
+    """Stream a time range of a reading table as CSV, NDJSON, Arrow or Parquet."""
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    end = request.args.get("end", now, type=float)
+    start = request.args.get("start", end - 86400, type=float)
+    format = request.args.get("format", "csv")
+    resolution = request.args.get("resolution", type=int)
+    if start >= end or (resolution is not None and resolution not in rollups.RESOLUTIONS):
+        return jsonify({"error": "Invalid export range or resolution"}), 400
+    if not export.available(format):
+        return jsonify({"error": f"Export format {format} is not available"}), 400
+    fields = migrations.READING_TABLES[table]
+    if resolution is None:
+        columns = ("id", "ts") + fields
+    else:
+        columns = ("ts", "count") + tuple(
+            f"{f}{suffix}" for f in fields for suffix in ("", "_min", "_max")
         )
+    logger.info("Exporting %s from %s to %s as %s", table, start, end, format)
+    return Response(
+        export.encode(format, columns, export_batches(table, start, end, resolution)),
+        mimetype=export.MIMETYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table}.{format}"',
+            # Stream through nginx rather than spooling the file to disk
+            "X-Accel-Buffering": "no",
+        },
     )
-    l = []
-    for d in data:
-        l.append(d[0])
-    return l
 
 
+@timed
+def write_birds(rows: list):
+    """Store (id, ts, scientific_name, common_name, confidence) sightings.
+
+    Like write_readings, sightings whose id is already stored (or repeated
+    within the batch) are skipped, so they aren't counted twice. Returns the
+    rows actually inserted.
+    """
+    unique = list({row[0]: row for row in rows if row[0] is not None}.values())
+    unique += [row for row in rows if row[0] is None]
+    with db_pool.connection() as connection:
+        with connection:
+            existing = birds.stored_ids(
+                connection, [row[0] for row in unique if row[0] is not None]
+            )
+            new_rows = [row for row in unique if row[0] not in existing]
+            birds.add_sightings(connection, new_rows)
+    if new_rows:
+        bird_version.increment(len(new_rows))
+    return new_rows
+
+
+@timed
+def get_recent_birds():
+    min_ts = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp() - BIRD_WINDOW
+    with db_pool.connection() as connection:
+        data = birds.top_species(connection, min_ts)
+    return [d[0] for d in data]
+
+
+@timed
 def get_latest_birds():
-    data = query_db(
-        "select common_name, confidence from bird_observations where ts = (select max(ts) from bird_observations) order by 2 desc"
-    )
-    l = []
-    for d in data:
-        l.append(d[0])
-    return l
+    with db_pool.connection() as connection:
+        return birds.latest_species(connection)
 
 
 def write_latest_birds(
     id: str, ts: int, scientific_name: str, common_name: str, confidence: float
 ):
-    query = f"""INSERT INTO bird_observations VALUES('{id}', {ts}, '{scientific_name}', '{common_name}', {confidence})"""
-    print(query)
-    _ = write_db(query)
-    return True
+    return write_birds([(id, ts, scientific_name, common_name, confidence)])
+
+
+@timed
+def get_top_birds(start: float, end: float, limit: int):
+    with db_pool.connection() as connection:
+        data = birds.top_species(
+            connection, start, end, limit, time.time() - BIRD_MINUTE_COUNT_DAYS * 86400
+        )
+    return [
+        {
+            "common_name": common_name,
+            "scientific_name": scientific_name,
+            "detections": detections,
+            "confidence": confidence,
+        }
+        for common_name, scientific_name, detections, confidence in data
+    ]
+
+
+@timed
+def get_bird_species(common_name: str = None):
+    with db_pool.connection() as connection:
+        rows = birds.species(connection, common_name)
+    return [dict(zip(birds.SPECIES_COLUMNS, row)) for row in rows]
+
+
+RETENTION_POLICIES = (
+    [
+        retention.RetentionPolicy(table, "ts", RAW_RETENTION_DAYS, ("id", "ts") + fields)
+        for table, fields in migrations.READING_TABLES.items()
+    ]
+    + [
+        retention.RetentionPolicy(rollups.rollup_table(table, resolution), "bucket", days, None)
+        for table in migrations.READING_TABLES
+        for resolution, days in ROLLUP_RETENTION_DAYS.items()
+    ]
+    + [
+        retention.RetentionPolicy(
+            "bird_sightings",
+            "ts",
+            BIRD_RETENTION_DAYS,
+            ("id", "ts", "species_id", "confidence"),
+        ),
+        retention.RetentionPolicy(
+            "bird_counts",
+            "bucket",
+            BIRD_MINUTE_COUNT_DAYS,
+            None,
+            f"resolution = {birds.RESOLUTIONS[0]}",
+        ),
+    ]
+)
+
+
+def compact_readings():
+    """Pack aged raw readings into blocks, and archive blocks past retention."""
+    now = time.time()
+    directory = archive.archive_dir(PRIMARY_DB)
+    connection = sqlite3.connect(PRIMARY_DB, isolation_level=None, timeout=30)
+    try:
+        for table, fields in migrations.READING_TABLES.items():
+            packed = blocks.compact(connection, table, fields, now - READING_BLOCK_DAYS * 86400)
+            removed = 0
+            if RAW_RETENTION_DAYS is not None:
+                removed = blocks.prune(
+                    connection, table, fields, now - RAW_RETENTION_DAYS * 86400, directory
+                )
+            logger.info("Blocks for %s: packed %d rows, archived %d", table, packed, removed)
+    finally:
+        connection.close()
+
+
+def run_retention():
+    """Pack reading blocks and apply the retention policies every RETENTION_INTERVAL.
+
+    Every worker runs this thread, but only the one holding the lock file
+    does any work; if it exits, another takes over at its next attempt.
+    """
+    lock = open(ring_path(PRIMARY_DB, "retention", "lock"), "a")
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if READING_BLOCKS:
+                compact_readings()
+            retention.enforce(PRIMARY_DB, RETENTION_POLICIES)
+        except BlockingIOError:
+            pass
+        except Exception:
+            logger.exception("Retention run failed")
+        time.sleep(RETENTION_INTERVAL)
+
+
+threading.Thread(target=run_retention, name="retention", daemon=True).start()
+
+
+def stream_versions():
+    """Cheap version numbers of everything the dashboard shows."""
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    return {
+        "weather": reading_cache["thp_readings"].version,
+        "air": reading_cache["air_quality_readings"].version,
+        # Recent birds also change as sightings age out of the window
+        "birds": (bird_version.value, int(now // BIRD_WINDOW)),
+    }
+
+
+def stream_payload(topic: str):
+    try:
+        if topic == "weather":
+            return query_recent_weather()
+        elif topic == "air":
+            return query_recent_air()
+        else:
+            return get_recent_birds()
+    except ValueError:
+        return None
+
+
+def stream_event(topic: str) -> str:
+    return f"event: {topic}\ndata: {json.dumps(stream_payload(topic))}\n\n"
+
+
+broadcaster = Broadcaster(stream_versions)
+
+
+def reading_ages():
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    latest = {table: ring.latest() for table, ring in reading_cache.items()}
+    return {
+        (table,): now - record[0] if record is not None else None
+        for table, record in latest.items()
+    }
+
+
+metrics_registry.gauge(
+    "weather_server_reading_age_seconds",
+    "Seconds since the newest reading in each table",
+    reading_ages,
+    ("table",),
+)
+
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+
+
+def recent_window() -> int:
+    """The averaging window a /recent request asked for."""
+    return request.args.get("window", RECENT_WINDOW, type=int)
+
+
+def expiry(topics, window: int, now: float):
+    """When the oldest reading of `topics` within `window` ages out of it, and
+    a view showing it changes; None if there are none."""
+    deadlines = [
+        reading_cache[table].first_after(now - window)
+        for topic, table in (("weather", "thp_readings"), ("air", "air_quality_readings"))
+        if topic in topics
+    ]
+    return min((ts + window for ts in deadlines if ts is not None), default=None)
+
+
+def cached_response(*topics, window=None):
+    """Cache a GET view's rendered body for as long as its data is unchanged.
+
+    The cache key is the request path, the shared version of each topic the
+    view reads and a RESPONSE_CACHE_TTL time bucket, so every worker derives
+    the same ETag. Views showing readings from a recent `window` (seconds, or
+    a function of the request) also key on when the oldest of them ages out,
+    so they never serve a reading past it; browsers and proxies aren't told
+    to reuse the response beyond then either.
+
+    Requests with a matching If-None-Match get a 304 without the view,
+    template or database being touched. The ETag is weak: views that render
+    times from `now` (history, /birds/top) may differ by a few bytes between
+    workers under the same key. There is no Last-Modified, since windowed
+    results change as time passes without any new reading.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+            versions = stream_versions()
+            deadline = None
+            if window is not None:
+                deadline = expiry(topics, window() if callable(window) else window, now)
+            key = (
+                request.full_path,
+                tuple(versions[topic] for topic in topics),
+                int(now // RESPONSE_CACHE_TTL),
+                deadline,
+            )
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()
+            with response_cache_lock:
+                cached = response_cache.get(key)
+                if cached is not None:
+                    response_cache.move_to_end(key)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                cached = (response.get_data(), response.mimetype)
+                with response_cache_lock:
+                    response_cache[key] = cached
+                    if len(response_cache) > RESPONSE_CACHE_SIZE:
+                        response_cache.popitem(last=False)
+            response = Response(cached[0], mimetype=cached[1])
+            response.set_etag(etag, weak=True)
+            response.cache_control.public = True
+            max_age = RESPONSE_MAX_AGE
+            if deadline is not None:
+                max_age = max(0, min(max_age, int(deadline - now)))
+            response.cache_control.max_age = max_age
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
 
 
 def safe_get_from_list(list: list, index: int):
@@ -243,7 +906,45 @@ def safe_get_from_list(list: list, index: int):
         return None
 
 
+@app.before_request
+def start_trace():
+    # The logger sends the reading id, so its records and ours can be matched up
+    g.trace_token = logs.trace_id.set(request.headers.get(logs.TRACE_HEADER))
+
+
+@app.teardown_request
+def end_trace(exc):
+    if "trace_token" in g:
+        logs.trace_id.reset(g.trace_token)
+
+
+if METRICS_ENABLED:
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_seconds.observe(
+            time.perf_counter() - g.request_started,
+            route,
+            request.method,
+            str(response.status_code),
+        )
+        return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/")
+@cached_response("weather", "air", "birds", window=RECENT_WINDOW)
 def index():
     # fetch the data
     try:
@@ -253,24 +954,60 @@ def index():
     try:
         air_data = query_recent_air()
     except:
-        pass
+        air_data = {}
     bird_list = get_recent_birds()
+
+    def show(value):
+        return "n/a" if value is None else "{:.0f}".format(value)
+
     # generate the site
     return render_template(
         "web-app.html",
-        temp="{:.0f}".format(weather_data.get("temp")) or "n/a",
-        humidity="{:.0f}".format(weather_data.get("humidity")) or "n/a",
-        pressure="{:.0f}".format(weather_data.get("pressure")) or "n/a",
-        pm1="{:.0f}".format(air_data.get("pm1")) or "n/a",
-        pm25="{:.0f}".format(air_data.get("pm2_5")) or "n/a",
-        pm10="{:.0f}".format(air_data.get("pm10")) or "n/a",
+        temp=show(weather_data.get("temp")),
+        humidity=show(weather_data.get("humidity")),
+        pressure=show(weather_data.get("pressure")),
+        pm1=show(air_data.get("pm1")),
+        pm25=show(air_data.get("pm2_5")),
+        pm10=show(air_data.get("pm10")),
         bird_list=bird_list,
     )
 
 
+@app.route("/stream")
+def stream():
+    """Server-Sent Events: the full dashboard state, then only what changes."""
+    if not broadcaster.subscribe(STREAM_MAX_CLIENTS):
+        logger.info("Refused /stream: %d clients already connected.", broadcaster.subscribers)
+        return (
+            jsonify({"error": "Too many live clients, poll instead"}),
+            503,
+            {"Retry-After": str(STREAM_RETRY_AFTER)},
+        )
+
+    def events():
+        seen = {}
+        yield f"retry: {STREAM_KEEPALIVE * 1000}\n\n"
+        while True:
+            seen, changed = broadcaster.wait(seen, STREAM_KEEPALIVE)
+            if not changed:
+                yield ": keep-alive\n\n"
+            for topic in changed:
+                yield stream_event(topic)
+
+    response = Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Runs when the server closes the response, even if it never started
+    response.call_on_close(broadcaster.unsubscribe)
+    return response
+
+
 @app.route("/weather/latest", methods=["GET", "POST"])
+@cached_response("weather", window=RECENT_WINDOW)
 def latest_weather():
-    logger.info(f"Received {request.method} request to /weather/latest.")
+    logger.debug("Received %s request to /weather/latest.", request.method)
     if request.method == "POST":
         try:
             r = request.get_json()
@@ -283,36 +1020,64 @@ def latest_weather():
             )
             return jsonify({"success": True}), 200, {"ContentType": "application/json"}
         except:
-            logger.info(
-                f"Experienced an error processing POST request to /weather/latest"
-            )
+            logger.info("Experienced an error processing POST request to /weather/latest")
             return jsonify({"error": "Request data issue"}), 400
     else:
         try:
             return jsonify(query_latest_weather())
         except ValueError:
-            logger.info(
-                f"Experienced an error processing GET request to /weather/latest"
-            )
+            logger.info("Experienced an error processing GET request to /weather/latest")
             return jsonify({"error": "No recent readings"}), 500
 
 
 @app.route("/weather/recent", methods=["GET"])
+@cached_response("weather", window=recent_window)
 def read_recent_weather():
-    logger.info("Received GET request to /weather/recent")
+    logger.debug("Received GET request to /weather/recent")
+    window = request.args.get("window", RECENT_WINDOW, type=int)
+    if window not in RECENT_WINDOWS:
+        return jsonify({"error": "Unsupported window", "windows": RECENT_WINDOWS}), 400
     try:
-        result = query_recent_weather()
-        logger.info(f"Successfully retrieved recent weather: {result.get('num_readings')} readings")
+        result = query_recent_weather(window)
+        logger.debug("Successfully retrieved recent weather: %s readings", result.get("num_readings"))
         return jsonify(result)
     except ValueError as e:
-        logger.warning(f"No recent readings available: {e}")
+        logger.warning("No recent readings available: %s", e)
         return jsonify({"error": "No recent readings"}), 500
     except Exception as e:
-        logger.error(f"Unexpected error in /weather/recent: {type(e).__name__}: {e}", exc_info=True)
+        logger.exception("Unexpected error in /weather/recent: %s: %s", type(e).__name__, e)
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route("/weather/history", methods=["GET"])
+@cached_response("weather")
+def weather_history():
+    try:
+        start, end, points = history_args()
+    except ValueError:
+        return jsonify({"error": "Invalid history range"}), 400
+    return jsonify(
+        query_history("thp_readings", ("temp", "humidity", "pressure"), start, end, points)
+    )
+
+
+@app.route("/weather/export", methods=["GET"])
+def weather_export():
+    return export_table("thp_readings")
+
+
+@app.route("/weather/batch", methods=["POST"])
+def weather_batch():
+    return write_batch("thp_readings")
+
+
+@app.route("/weather/sync", methods=["GET", "POST"])
+def weather_sync():
+    return sync_readings("thp_readings")
+
+
 @app.route("/air/latest", methods=["GET", "POST"])
+@cached_response("air", window=RECENT_WINDOW)
 def latest_air():
     if request.method == "POST":
         try:
@@ -335,14 +1100,46 @@ def latest_air():
 
 
 @app.route("/air/recent", methods=["GET"])
+@cached_response("air", window=recent_window)
 def read_recent_air():
+    window = request.args.get("window", RECENT_WINDOW, type=int)
+    if window not in RECENT_WINDOWS:
+        return jsonify({"error": "Unsupported window", "windows": RECENT_WINDOWS}), 400
     try:
-        return jsonify(query_recent_air())
+        return jsonify(query_recent_air(window))
     except ValueError:
         return jsonify({"error": "No recent readings"}), 500
 
 
+@app.route("/air/history", methods=["GET"])
+@cached_response("air")
+def air_history():
+    try:
+        start, end, points = history_args()
+    except ValueError:
+        return jsonify({"error": "Invalid history range"}), 400
+    return jsonify(
+        query_history("air_quality_readings", ("pm1", "pm2_5", "pm10"), start, end, points)
+    )
+
+
+@app.route("/air/export", methods=["GET"])
+def air_export():
+    return export_table("air_quality_readings")
+
+
+@app.route("/air/batch", methods=["POST"])
+def air_batch():
+    return write_batch("air_quality_readings")
+
+
+@app.route("/air/sync", methods=["GET", "POST"])
+def air_sync():
+    return sync_readings("air_quality_readings")
+
+
 @app.route("/birds/recent_ha", methods=["GET"])
+@cached_response("birds")
 def birds_recent_ha():
     try:
         l = get_recent_birds()
@@ -354,6 +1151,7 @@ def birds_recent_ha():
 
 
 @app.route("/birds/recent", methods=["GET"])
+@cached_response("birds")
 def birds_recent():
     try:
         l = get_recent_birds()
@@ -363,6 +1161,7 @@ def birds_recent():
 
 
 @app.route("/birds/latest", methods=["GET", "POST"])
+@cached_response("birds")
 def birds_latest():
     if request.method == "POST":
         try:
@@ -384,7 +1183,100 @@ def birds_latest():
             return jsonify({"error": "No recent readings"}), 500
 
 
+@app.route("/birds/top", methods=["GET"])
+@cached_response("birds")
+def birds_top():
+    now = datetime.datetime.now(tz=ZoneInfo("UTC")).timestamp()
+    end = request.args.get("end", now, type=float)
+    window = request.args.get("window", BIRD_TOP_WINDOW, type=float)
+    start = request.args.get("start", end - window, type=float)
+    limit = request.args.get("limit", BIRD_TOP_LIMIT, type=int)
+    if start >= end or limit <= 0:
+        return jsonify({"error": "Invalid window or limit"}), 400
+    return jsonify(
+        {"start": start, "end": end, "species": get_top_birds(start, end, limit)}
+    )
+
+
+@app.route("/birds/species", methods=["GET"])
+@cached_response("birds")
+def birds_species():
+    return jsonify(get_bird_species())
+
+
+@app.route("/birds/species/<common_name>", methods=["GET"])
+@cached_response("birds")
+def birds_species_detail(common_name):
+    data = get_bird_species(common_name)
+    if not data:
+        return jsonify({"error": "Unknown species"}), 404
+    return jsonify(data[0])
+
+
+@app.route("/birds/batch", methods=["POST"])
+def birds_batch():
+    try:
+        rows = validate_bird_batch(parse_batch())
+    except ValueError as e:
+        return jsonify({"error": f"Request data issue: {e}"}), 400
+    inserted = write_birds(rows)
+    logger.info("Batch to bird_sightings: received %d, inserted %d", len(rows), len(inserted))
+    return jsonify({"success": True, "received": len(rows), "inserted": len(inserted)})
+
+
+# ASGI entry point, e.g. `uvicorn weather-server:asgi_app --workers 2`. Flask
+# views and their database calls run on a thread pool, and /stream is served
+# natively so idle dashboards cost a coroutine rather than a thread.
+asgi_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+asgi_bridge = WSGIBridge(app, asgi_executor)
+async_broadcaster = AsyncBroadcaster(stream_versions)
+
+
+async def asgi_stream(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    async_broadcaster.subscribe()
+    try:
+        seen = {}
+        body = f"retry: {STREAM_KEEPALIVE * 1000}\n\n"
+        while True:
+            await send({"type": "http.response.body", "body": body.encode(), "more_body": True})
+            waiter = asyncio.ensure_future(async_broadcaster.wait(seen, STREAM_KEEPALIVE))
+            await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                waiter.cancel()
+                return
+            seen, changed = waiter.result()
+            events = [
+                await loop.run_in_executor(asgi_executor, stream_event, topic)
+                for topic in changed
+            ]
+            body = "".join(events) or ": keep-alive\n\n"
+    finally:
+        async_broadcaster.unsubscribe()
+        disconnected.cancel()
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/stream":
+        await asgi_stream(scope, receive, send)
+    elif scope["type"] == "http":
+        await asgi_bridge(scope, receive, send)
+
+
 if __name__ == "__main__":
-    print("Triggering table initiation")
     _ = initiate_tables(PRIMARY_DB)
     app.run(debug=True, host="0.0.0.0", port=5005)